@@ -1,27 +1,108 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, send_file, Response
+from flask import Flask, render_template, stream_template, request, redirect, url_for, flash, send_file, Response, stream_with_context, abort
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, create_engine, inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import aliased, Session
+from sqlalchemy.schema import CreateColumn, CreateTable
 from werkzeug.utils import secure_filename
-from datetime import datetime
+from markupsafe import Markup
+from datetime import datetime, timedelta
 from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image, PageBreak
 from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.lib import colors
+from reportlab import rl_config
+import io
 import os
 import shutil
 import csv
+import json
+import hashlib
+import re
+import uuid
+import zlib
+from collections import OrderedDict, Counter
+from contextlib import contextmanager
+from itertools import groupby
+import heapq
+import sqlite3
+import threading
+import queue
+import time
+import click
+import numpy as np
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+try:
+    from PIL import Image as PILImage
+except ImportError:  # optional: reports list receipts without thumbnails
+    PILImage = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: concurrent PATCHes to one upload aren't locked out
+    fcntl = None
 
 # --- Config ---
 APP_VERSION = "v0.6.3-prod"  # update manually when you push changes
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("SECRET_KEY", "dev-secret-key")
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///business.db'
+
+def database_url():
+    """DATABASE_URL from the environment (SQLite by default), normalised to the psycopg 3 driver."""
+    url = os.environ.get("DATABASE_URL", "sqlite:///business.db")
+    for prefix in ("postgres://", "postgresql://"):
+        if url.startswith(prefix):
+            return "postgresql+psycopg://" + url[len(prefix):]
+    return url
+
+def engine_options(url):
+    """Pool / timeout settings from DB_* environment variables."""
+    options = {
+        "pool_pre_ping": os.environ.get("DB_POOL_PRE_PING", "1") == "1",
+        "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE", 1800)),
+    }
+    if url.startswith("sqlite") and ":memory:" not in url:
+        # How long a writer waits on SQLite's database lock before "database is locked"
+        options["connect_args"] = {"timeout": float(os.environ.get("DB_BUSY_TIMEOUT", 15))}
+    if url.startswith("postgresql"):
+        options["pool_size"] = int(os.environ.get("DB_POOL_SIZE", 5))
+        options["max_overflow"] = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+        statement_timeout = int(os.environ.get("DB_STATEMENT_TIMEOUT", 30000))  # ms, 0 disables
+        options["connect_args"] = {"options": f"-c statement_timeout={statement_timeout}"}
+    return options
+
+app.config['SQLALCHEMY_DATABASE_URI'] = database_url()
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = os.path.join('static', 'receipts')
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+os.makedirs(app.instance_path, exist_ok=True)
+app.config['WORKORDER_FOLDER'] = os.path.join('static', 'workorders')
+app.config['REPORT_FOLDER'] = os.path.join(app.instance_path, 'reports')
+# partial chunked uploads (see "Uploads"); form posts are capped, bigger files go in chunks
+app.config['UPLOAD_TMP_FOLDER'] = os.path.join(app.instance_path, 'uploads')
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get("FORM_UPLOAD_MAX_MB", 32)) * 1024 * 1024
+# Cold storage for archived transactions / work orders, attached as schema "archive"
+# (on Postgres "archive" is a real schema in the same database)
+app.config['ARCHIVE_DATABASE'] = os.environ.get("ARCHIVE_DATABASE", os.path.join(app.instance_path, "archive.db"))
 
 db = SQLAlchemy(app)
 
+@event.listens_for(Engine, "connect")
+def attach_archive(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("ATTACH DATABASE ? AS archive", (app.config['ARCHIVE_DATABASE'],))
+        # enforce the ON DELETE rules declared on the models, as Postgres does
+        cursor.execute("PRAGMA foreign_keys = ON")
+        cursor.close()
+
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp', 'pdf'}
 
 def allowed_file(filename):
@@ -39,52 +120,71 @@ class Transaction(db.Model):
     date = db.Column(db.Date, nullable=False, default=datetime.utcnow)
     receipt_path = db.Column(db.String(300), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # what a payment was for; set by the app, or by the backfill-transaction-links job for older rows
+    customer_id = db.Column(db.Integer, db.ForeignKey("customer.id", ondelete="SET NULL"), nullable=True, index=True)
+    booking_id = db.Column(db.Integer, db.ForeignKey("booking.id", ondelete="SET NULL"), nullable=True, index=True)
+    invoice_id = db.Column(db.Integer, db.ForeignKey("invoice.id", ondelete="SET NULL"), nullable=True, index=True)
+
+    __table_args__ = (
+        # leads with date, so it also serves date filters/sorts; covers the forecast's per-day sums
+        db.Index("ix_transaction_date_cashflow", "date", "type", "status", "amount"),
+        # the year-end report reads by category, then date, in keyset batches
+        db.Index("ix_transaction_category_date", "category", "date", "id"),
+        # archived rows keep their ids, so an id must never be handed out twice
+        {"sqlite_autoincrement": True},
+    )
 
 class WorkOrder(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    customer_id = db.Column(db.Integer, db.ForeignKey("customer.id"), nullable=False)
-    booking_id = db.Column(db.Integer, db.ForeignKey("booking.id"), nullable=True)
-    description = db.Column(db.Text, nullable=True)
+    customer_id = db.Column(db.Integer, db.ForeignKey("customer.id", ondelete="CASCADE"), nullable=False, index=True)
+    booking_id = db.Column(db.Integer, db.ForeignKey("booking.id", ondelete="SET NULL"), nullable=True, index=True)
+    description = db.deferred(db.Column(db.Text, nullable=True))
     order_type = db.Column(db.String(50), nullable=False)
     price = db.Column(db.Float, default=0.0)
-    due_date = db.Column(db.Date, nullable=True)
-    status = db.Column(db.String(20), default="New")
+    due_date = db.Column(db.Date, nullable=True, index=True)
+    status = db.Column(db.String(20), default="New", index=True)
     file_path = db.Column(db.String(300), nullable=True)
     priority = db.Column(db.String(20), default="Medium")
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    __table_args__ = {"sqlite_autoincrement": True}  # archived rows keep their ids; never reuse one
 
     customer = db.relationship("Customer", back_populates="workorders")
     booking = db.relationship("Booking", back_populates="workorders")
     
 class Booking(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    customer_id = db.Column(db.Integer, db.ForeignKey("customer.id"), nullable=False)
+    customer_id = db.Column(db.Integer, db.ForeignKey("customer.id", ondelete="CASCADE"), nullable=False, index=True)
     booking_type = db.Column(db.String(50), nullable=False)
     event_date = db.Column(db.Date, nullable=False)
     secondary_date = db.Column(db.Date, nullable=True)
     expected_income = db.Column(db.Float, nullable=False, default=0.0)
     paid_status = db.Column(db.String(10), default="Pending")
-    notes = db.Column(db.Text, nullable=True)
+    notes = db.deferred(db.Column(db.Text, nullable=True))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     customer = db.relationship("Customer", back_populates="bookings")
-    workorders = db.relationship("WorkOrder", back_populates="booking", lazy=True)
-    invoices = db.relationship("Invoice", back_populates="booking", lazy=True)
-    booking_type_id = db.Column(db.Integer, db.ForeignKey("booking_type.id"), nullable=False)
+    workorders = db.relationship("WorkOrder", back_populates="booking", lazy=True, passive_deletes=True)
+    invoices = db.relationship("Invoice", back_populates="booking", lazy=True, passive_deletes=True)
+    booking_type_id = db.Column(db.Integer, db.ForeignKey("booking_type.id", ondelete="RESTRICT"), nullable=False)
     booking_type = db.relationship("BookingType", backref="bookings")
+
+    __table_args__ = (
+        db.Index("ix_booking_event_cashflow", "event_date", "paid_status", "expected_income"),
+    )
     
 class Customer(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(120), nullable=False)
+    name = db.Column(db.String(120), nullable=False, index=True)
     email = db.Column(db.String(120), nullable=True)
     phone = db.Column(db.String(50), nullable=True)
     address = db.Column(db.String(250), nullable=True)
-    notes = db.Column(db.Text, nullable=True)
+    notes = db.deferred(db.Column(db.Text, nullable=True))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
-    bookings = db.relationship("Booking", back_populates="customer", lazy=True)
-    workorders = db.relationship("WorkOrder", back_populates="customer", lazy=True)
-    invoices = db.relationship("Invoice", back_populates="customer", lazy=True)
+    bookings = db.relationship("Booking", back_populates="customer", lazy=True, passive_deletes=True)
+    workorders = db.relationship("WorkOrder", back_populates="customer", lazy=True, passive_deletes=True)
+    invoices = db.relationship("Invoice", back_populates="customer", lazy=True, passive_deletes=True)
 
     
 class JobType(db.Model):
@@ -98,8 +198,8 @@ class JobType(db.Model):
 
 class Invoice(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    customer_id = db.Column(db.Integer, db.ForeignKey("customer.id"), nullable=False)
-    booking_id = db.Column(db.Integer, db.ForeignKey("booking.id"), nullable=True)
+    customer_id = db.Column(db.Integer, db.ForeignKey("customer.id", ondelete="CASCADE"), nullable=False, index=True)
+    booking_id = db.Column(db.Integer, db.ForeignKey("booking.id", ondelete="SET NULL"), nullable=True, index=True)
     total = db.Column(db.Float, default=0.0)
     status = db.Column(db.String(20), default="Draft")
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -115,7 +215,7 @@ class Invoice(db.Model):
 
 class InvoiceItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    invoice_id = db.Column(db.Integer, db.ForeignKey("invoice.id"), nullable=False)
+    invoice_id = db.Column(db.Integer, db.ForeignKey("invoice.id", ondelete="CASCADE"), nullable=False, index=True)
     description = db.Column(db.String(200))
     price = db.Column(db.Float, default=0.0)
     quantity = db.Column(db.Integer, default=1)
@@ -130,11 +230,14 @@ class BookingType(db.Model):
 
     def __repr__(self):
         return f"<BookingType {self.name}>"
+
+    def __str__(self):
+        return self.name
     
 
 class Lead(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    contact_name = db.Column(db.String(120), nullable=False)
+    contact_name = db.Column(db.String(120), nullable=False, index=True)
     business_name = db.Column(db.String(120), nullable=True)  # optional
     type = db.Column(db.String(20), nullable=False, default="Personal")  # Business/Personal
     phone = db.Column(db.String(20), nullable=True)
@@ -144,7 +247,178 @@ class Lead(db.Model):
 
     status = db.Column(db.String(50), nullable=False, default="New")
     source = db.Column(db.String(120), nullable=True)
-    notes = db.Column(db.Text, nullable=True)
+    notes = db.deferred(db.Column(db.Text, nullable=True))
+
+    __table_args__ = (
+        # covers the facet-count GROUP BY (same column order as LEAD_FACETS)
+        db.Index("ix_lead_facets", "status", "type", "source", "preferred_contact"),
+    )
+
+class ChangeLog(db.Model):
+    """Append-only record of row changes, read incrementally through /api/changes."""
+    __table_args__ = {"sqlite_autoincrement": True}  # never reuse a sequence number
+    seq = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(50), nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(10), nullable=False)  # insert | update | delete | archive
+    fields = db.Column(db.JSON, nullable=True)      # changed column -> new value
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+class Upload(db.Model):
+    """A chunked file upload, resumable from ``received`` until it's attached."""
+    id = db.Column(db.String(32), primary_key=True)           # uuid4 hex, also names the .part file
+    target = db.Column(db.String(20), nullable=False)         # workorder | receipt
+    target_id = db.Column(db.Integer, nullable=False)
+    filename = db.Column(db.String(300), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    received = db.Column(db.BigInteger, nullable=False, default=0)
+    sha256 = db.Column(db.String(64), nullable=True)          # expected digest, if the client sent one
+    path = db.Column(db.String(300), nullable=True)           # final file, once complete
+    error = db.Column(db.String(200), nullable=True)          # why the last whole-file check failed
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+class ReportJob(db.Model):
+    """A PDF report generated in the background; any worker can show its status."""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(30), nullable=False)           # year_end
+    params = db.Column(db.JSON, nullable=False, default=dict)
+    status = db.Column(db.String(10), nullable=False, default="queued")  # queued | running | done | failed
+    rows = db.Column(db.Integer, nullable=True)
+    path = db.Column(db.String(300), nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+
+# --- Archive (cold) tables ---
+def archive_table(model):
+    """Column-for-column copy of a model's table in the archive schema.
+
+    Foreign keys are dropped: archived rows are history and the archive
+    lives in a separate database file.
+    """
+    columns = [
+        db.Column(c.name, c.type, primary_key=c.primary_key, nullable=c.nullable)
+        for c in model.__table__.columns
+    ]
+    return db.Table(model.__tablename__, db.metadata, *columns, schema="archive")
+
+archived_transactions = archive_table(Transaction)
+# payment lookups by booking/invoice (outstanding balances) span the archive too
+db.Index("ix_archive_transaction_booking_id", archived_transactions.c.booking_id)
+db.Index("ix_archive_transaction_invoice_id", archived_transactions.c.invoice_id)
+# statements read a customer's payments from both tables
+db.Index("ix_archive_transaction_customer_id", archived_transactions.c.customer_id)
+db.Index("ix_archive_transaction_category_date", archived_transactions.c.category,
+         archived_transactions.c.date, archived_transactions.c.id)
+archived_workorders = archive_table(WorkOrder)
+
+class TransactionRollup(db.Model):
+    """Monthly totals of archived transactions, so aggregates never scan the archive."""
+    __table_args__ = {"schema": "archive"}
+    year = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.Integer, primary_key=True)
+    type = db.Column(db.String(10), primary_key=True)
+    status = db.Column(db.String(10), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Float, nullable=False, default=0.0)
+
+class WorkOrderRollup(db.Model):
+    """Counts of archived work orders by status and priority."""
+    __table_args__ = {"schema": "archive"}
+    status = db.Column(db.String(20), primary_key=True)
+    priority = db.Column(db.String(20), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Float, nullable=False, default=0.0)
+
+
+def add_missing_columns():
+    """ALTER existing tables to add nullable columns the models gained since they were created.
+
+    Foreign keys on such columns aren't enforced on SQLite (it can't add constraints later).
+    """
+    inspector = inspect(db.engine)
+    with db.engine.begin() as conn:
+        preparer = conn.dialect.identifier_preparer
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name, schema=table.schema):
+                continue
+            present = {c["name"] for c in inspector.get_columns(table.name, schema=table.schema)}
+            for column in table.columns:
+                if column.name not in present and column.nullable:
+                    ddl = CreateColumn(column).compile(dialect=conn.dialect)
+                    conn.execute(db.text(f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {ddl}"))
+
+def migrate_autoincrement():
+    """Rebuild SQLite tables created before their model asked for AUTOINCREMENT.
+
+    Without it SQLite hands out max(id) + 1, so once the newest row has been
+    archived its id is given out again and collides with the archived copy.
+    SQLite can't change a primary key in place, so the table is recreated and
+    its rows copied. Hot rows that already share an id with an archived row get
+    a fresh id (logged as delete + insert in change_log), and the sequence
+    starts above the archive's highest id. Postgres sequences never reuse ids.
+    """
+    if db.engine.dialect.name != "sqlite":
+        return
+    copies = db.MetaData()
+    for table in db.metadata.sorted_tables:
+        table.to_metadata(copies)
+    targets = {model: target for target, (model, _, _) in UPLOAD_TARGETS.items()}
+    with db.engine.connect() as conn:
+        q = conn.dialect.identifier_preparer.format_table
+        conn.exec_driver_sql("PRAGMA foreign_keys = OFF")  # ignored once a transaction is open
+        try:
+            conn.exec_driver_sql("BEGIN")
+            for model in (Transaction, WorkOrder):
+                table = model.__table__
+                ddl = conn.execute(db.text("SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = :name"),
+                                   {"name": table.name}).scalar()
+                if ddl is None or "AUTOINCREMENT" in ddl.upper():
+                    continue
+                archived = db.metadata.tables[f"archive.{table.name}"]
+                new = table.to_metadata(copies, name=f"_{table.name}_rebuild")
+                conn.execute(CreateTable(new))
+                columns = [c.name for c in table.columns]
+                conn.execute(new.insert().from_select(
+                    columns, db.select(table).where(table.c.id.not_in(db.select(archived.c.id)))))
+                top = max(conn.execute(db.select(db.func.max(t.c.id))).scalar() or 0 for t in (new, archived))
+                conn.execute(db.text("DELETE FROM sqlite_sequence WHERE name = :name"), {"name": new.name})
+                conn.execute(db.text("INSERT INTO sqlite_sequence (name, seq) VALUES (:name, :top)"),
+                             {"name": new.name, "top": top})
+                clashing = conn.execute(db.select(table).where(table.c.id.in_(db.select(archived.c.id)))
+                                        .order_by(table.c.id)).mappings().all()
+                for row in clashing:
+                    values = {name: row[name] for name in columns if name != "id"}
+                    new_id = conn.execute(new.insert().values(values)).inserted_primary_key[0]
+                    conn.execute(ChangeLog.__table__.insert(), [
+                        {"table_name": table.name, "row_id": row["id"], "op": "delete", "created_at": datetime.utcnow()},
+                        {"table_name": table.name, "row_id": new_id, "op": "insert", "created_at": datetime.utcnow()},
+                    ])
+                    conn.execute(Upload.__table__.update().where(
+                        Upload.target == targets[model], Upload.target_id == row["id"]).values(target_id=new_id))
+                conn.exec_driver_sql(f"DROP TABLE {q(table)}")
+                conn.exec_driver_sql(f"ALTER TABLE {q(new)} RENAME TO {q(table)}")
+                if clashing:
+                    app.logger.warning("%s: gave %d rows that shared an id with the archive new ids",
+                                       table.name, len(clashing))
+            conn.commit()
+        finally:
+            conn.rollback()
+            conn.exec_driver_sql("PRAGMA foreign_keys = ON")
+
+def init_db():
+    """Create missing tables, plus columns and indexes added to existing tables since they were created."""
+    if db.engine.dialect.name == "postgresql":
+        with db.engine.begin() as conn:
+            conn.execute(db.text("CREATE SCHEMA IF NOT EXISTS archive"))
+    db.create_all()
+    add_missing_columns()
+    migrate_autoincrement()
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
 
 
 # --- Routes ---
@@ -155,23 +429,26 @@ def index():
 @app.route("/bookings/<int:booking_id>")
 def view_booking(booking_id):
     booking = Booking.query.get_or_404(booking_id)
-    return render_template("view_booking.html", booking=booking)
+    balance = outstanding_balances(booking_ids=[booking.id], invoice_ids=[])["booking"][booking.id]
+    payments = Transaction.query.filter_by(booking_id=booking.id).order_by(Transaction.date.asc()).all()
+    return render_template("view_booking.html", booking=booking, balance=balance, payments=payments,
+                           today=datetime.utcnow().date())
 
 @app.route('/dashboard')
 def dashboard():
-
-    
-    # --- Transactions ---
-    income_paid = db.session.query(db.func.coalesce(db.func.sum(Transaction.amount), 0.0))\
-        .filter_by(type='Income', status='Paid').scalar()
-    expense_paid = db.session.query(db.func.coalesce(db.func.sum(Transaction.amount), 0.0))\
-        .filter_by(type='Expense', status='Paid').scalar()
+    # the page then subscribes to /dashboard/stream for live updates
+    return render_template('dashboard.html', **dashboard_data())
+
+def dashboard_data():
+    """Everything the dashboard shows: the tile metrics plus the recent/upcoming rows."""
+    # --- Transactions (hot rows + archive rollup) ---
+    txn_totals = transaction_totals()
+    income_paid = txn_totals.get(('Income', 'Paid'), (0, 0.0))[1]
+    expense_paid = txn_totals.get(('Expense', 'Paid'), (0, 0.0))[1]
     profit = (income_paid or 0.0) - (expense_paid or 0.0)
 
-    pending_income = db.session.query(db.func.count(Transaction.id))\
-        .filter_by(type='Income', status='Pending').scalar()
-    pending_expense = db.session.query(db.func.count(Transaction.id))\
-        .filter_by(type='Expense', status='Pending').scalar()
+    pending_income = txn_totals.get(('Income', 'Pending'), (0, 0.0))[0]
+    pending_expense = txn_totals.get(('Expense', 'Pending'), (0, 0.0))[0]
 
     recent = Transaction.query.order_by(Transaction.date.desc(), Transaction.id.desc()).limit(10).all()
 
@@ -185,11 +462,7 @@ def dashboard():
     
 
     # --- Work Orders ---
-    total_orders = db.session.query(db.func.count(WorkOrder.id)).scalar()
-    open_orders = db.session.query(db.func.count(WorkOrder.id)).filter_by(status="New").scalar()
-    in_progress_orders = db.session.query(db.func.count(WorkOrder.id)).filter_by(status="In Progress").scalar()
-    closed_orders = db.session.query(db.func.count(WorkOrder.id)).filter_by(status="Closed").scalar()
-    high_priority = db.session.query(db.func.count(WorkOrder.id)).filter_by(priority="High").scalar()
+    total_orders, open_orders, in_progress_orders, closed_orders, high_priority = workorder_tiles()
 
     recent_orders = WorkOrder.query.order_by(WorkOrder.created_at.desc()).limit(5).all()
 
@@ -198,8 +471,7 @@ def dashboard():
                                     .order_by(WorkOrder.due_date.asc())\
                                     .first()
 
-    return render_template(
-        'dashboard.html',
+    return dict(
         # Transactions
         income_paid=income_paid or 0.0,
         expense_paid=expense_paid or 0.0,
@@ -225,52 +497,47 @@ def dashboard():
 
 # ------------------ Transactions ------------------
 
-@app.route('/transactions')
-def transactions():
-    q_type = request.args.get('type', 'All')
-    q_status = request.args.get('status', 'All')
-    q_text = request.args.get('q', '').strip()
-
-    query = Transaction.query
+def filtered_transactions(q_type, q_status, q_text, include_archive=False):
+    """Transaction list query shared by the list page and the CSV export."""
+    T = transaction_source(include_archive)
+    query = db.session.query(T)
     if q_type in ('Income', 'Expense'):
-        query = query.filter(Transaction.type == q_type)
+        query = query.filter(T.type == q_type)
     if q_status in ('Paid', 'Pending'):
-        query = query.filter(Transaction.status == q_status)
+        query = query.filter(T.status == q_status)
     if q_text:
         like = f"%{q_text}%"
         query = query.filter(
             db.or_(
-                Transaction.category.ilike(like),
-                Transaction.description.ilike(like),
-                Transaction.party.ilike(like)
+                T.category.ilike(like),
+                T.description.ilike(like),
+                T.party.ilike(like)
             )
         )
+    return query.order_by(T.date.desc(), T.id.desc())
+
+@app.route('/transactions')
+def transactions():
+    q_type = request.args.get('type', 'All')
+    q_status = request.args.get('status', 'All')
+    q_text = request.args.get('q', '').strip()
+    include_archive = request.args.get('archive') == '1'
 
-    txns = query.order_by(Transaction.date.desc(), Transaction.id.desc()).all()
-    return render_template('transactions.html', transactions=txns, q_type=q_type, q_status=q_status, q_text=q_text)
+    query = filtered_transactions(q_type, q_status, q_text, include_archive)
+    T = query.column_descriptions[0]["entity"]
+    txns = query.with_entities(*transaction_list_columns(T), archived_flag(T)).all()
+    return render_template('transactions.html', transactions=txns, q_type=q_type, q_status=q_status, q_text=q_text,
+                           include_archive=include_archive)
 
 @app.route('/transactions/export')
 def export_transactions():
     q_type = request.args.get('type', 'All')
     q_status = request.args.get('status', 'All')
     q_text = request.args.get('q', '').strip()
+    include_archive = request.args.get('archive') == '1'
 
-    query = Transaction.query
-    if q_type in ('Income', 'Expense'):
-        query = query.filter(Transaction.type == q_type)
-    if q_status in ('Paid', 'Pending'):
-        query = query.filter(Transaction.status == q_status)
-    if q_text:
-        like = f"%{q_text}%"
-        query = query.filter(
-            db.or_(
-                Transaction.category.ilike(like),
-                Transaction.description.ilike(like),
-                Transaction.party.ilike(like)
-            )
-        )
-
-    txns = query.order_by(Transaction.date.desc(), Transaction.id.desc()).all()
+    query = filtered_transactions(q_type, q_status, q_text, include_archive)
+    txns = query.with_entities(*transaction_list_columns(query.column_descriptions[0]["entity"])).all()
 
     # Create CSV
     def generate():
@@ -314,14 +581,7 @@ def add_transaction():
         receipt_path = None
         file = request.files.get('receipt')
         if file and file.filename and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            save_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            base, ext = os.path.splitext(filename)
-            counter = 1
-            while os.path.exists(save_path):
-                filename = f"{base}_{counter}{ext}"
-                save_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                counter += 1
+            save_path = unique_path(app.config['UPLOAD_FOLDER'], file.filename)
             file.save(save_path)
             receipt_path = save_path
 
@@ -352,13 +612,17 @@ def edit_transaction(transaction_id):
         txn.amount = float(request.form["amount"])
         txn.status = request.form["status"]
 
+        replaced = None
         receipt = request.files.get("receipt")
-        if receipt and receipt.filename:
-            path = os.path.join("static/receipts", receipt.filename)
+        if receipt and receipt.filename and allowed_file(receipt.filename):
+            path = unique_path(app.config['UPLOAD_FOLDER'], receipt.filename)
             receipt.save(path)
-            txn.receipt_path = path
+            replaced, txn.receipt_path = txn.receipt_path, path
 
+        if txn.booking_id is not None:
+            sync_booking_status([txn.booking_id])
         db.session.commit()
+        queue_file_removal([replaced])
         flash("Transaction updated successfully!", "success")
         return redirect(url_for("transactions"))
 
@@ -367,13 +631,12 @@ def edit_transaction(transaction_id):
 @app.route('/delete/<int:txn_id>', methods=['POST'])
 def delete_transaction(txn_id):
     t = Transaction.query.get_or_404(txn_id)
-    if t.receipt_path and os.path.exists(t.receipt_path):
-        try:
-            os.remove(t.receipt_path)
-        except Exception:
-            pass
+    receipt, booking_id = t.receipt_path, t.booking_id
     db.session.delete(t)
+    if booking_id is not None:
+        sync_booking_status([booking_id])
     db.session.commit()
+    queue_file_removal([receipt])
     return redirect(url_for('transactions'))
 
 # ------------------ Work Orders ------------------
@@ -383,30 +646,29 @@ def workorders():
     q_type = request.args.get("type", "All")
     q_status = request.args.get("status", "All")
     q_text = request.args.get("q", "").strip()
+    include_archive = request.args.get("archive") == "1"
 
-    query = WorkOrder.query
+    W = workorder_source(include_archive)
+    query = db.session.query(*workorder_list_columns(W), archived_flag(W)).select_from(W)\
+        .outerjoin(Customer, W.customer_id == Customer.id)
 
     if q_type != "All":
-        query = query.filter(WorkOrder.order_type == q_type)
+        query = query.filter(W.order_type == q_type)
     if q_status in ("New", "In Progress", "Closed"):
-        query = query.filter(WorkOrder.status == q_status)
+        query = query.filter(W.status == q_status)
     if q_text:
         like = f"%{q_text}%"
-        query = query.join(Customer).filter(
+        query = query.filter(
             db.or_(
                 Customer.name.ilike(like),
-                WorkOrder.description.ilike(like)
+                W.description.ilike(like)
             )
         )
 
-    all_orders = query.order_by(WorkOrder.due_date.asc()).all()
+    all_orders = query.order_by(W.due_date.asc()).all()
 
-    # 🔹 Stats for tiles
-    total_orders = WorkOrder.query.count()
-    open_orders = WorkOrder.query.filter_by(status="New").count()
-    in_progress_orders = WorkOrder.query.filter_by(status="In Progress").count()
-    closed_orders = WorkOrder.query.filter_by(status="Closed").count()
-    high_priority = WorkOrder.query.filter_by(priority="High").count()
+    # 🔹 Stats for tiles (lifetime, including archived orders)
+    total_orders, open_orders, in_progress_orders, closed_orders, high_priority = workorder_tiles()
 
     return render_template(
         "workorders.html",
@@ -414,11 +676,13 @@ def workorders():
         q_type=q_type,
         q_status=q_status,
         q_text=q_text,
+        include_archive=include_archive,
         total_orders=total_orders,
         open_orders=open_orders,
         in_progress_orders=in_progress_orders,
         closed_orders=closed_orders,
-        high_priority=high_priority
+        high_priority=high_priority,
+        customers=db.session.query(Customer.id, Customer.name).order_by(Customer.name.asc()).all()
     )
 
 @app.route("/workorders/add", methods=["GET", "POST"])
@@ -476,7 +740,8 @@ def add_workorder():
 
 @app.route("/workorders/edit/<int:workorder_id>", methods=["GET", "POST"])
 def edit_workorder(workorder_id):
-    order = WorkOrder.query.get_or_404(workorder_id)
+    # edit forms show and overwrite the deferred text, so load it up front (keeps the change feed exact)
+    order = WorkOrder.query.options(db.undefer(WorkOrder.description)).get_or_404(workorder_id)
 
     if request.method == "POST":
         order.customer_id = int(request.form["customer_id"])
@@ -498,13 +763,10 @@ def edit_workorder(workorder_id):
 @app.route("/workorders/delete/<int:workorder_id>", methods=["POST"])
 def delete_workorder(workorder_id):
     order = WorkOrder.query.get_or_404(workorder_id)
-    if order.file_path and os.path.exists(order.file_path):
-        try:
-            os.remove(order.file_path)
-        except Exception:
-            pass
+    attachment = order.file_path
     db.session.delete(order)
     db.session.commit()
+    queue_file_removal([attachment])
     flash("Work order deleted!", "danger")
     return redirect(url_for("workorders"))
 
@@ -513,27 +775,29 @@ def delete_workorder(workorder_id):
 @app.route("/bookings")
 def bookings():
     q_status = request.args.get("status", "All")
-    query = Booking.query
+    query = db.session.query(*BOOKING_LIST_COLUMNS)\
+        .outerjoin(Customer, Booking.customer_id == Customer.id)\
+        .outerjoin(BookingType, Booking.booking_type_id == BookingType.id)
     if q_status in ("Paid", "Pending", "Partial"):
         query = query.filter(Booking.paid_status == q_status)
 
-    all_bookings = query.order_by(Booking.event_date.asc()).all()
-    return render_template("bookings.html", bookings=all_bookings, q_status=q_status)
+    all_bookings = query.order_by(Booking.event_date.asc()).yield_per(500)
+    rows = render_rows("_booking_row.html", "booking", all_bookings, tuple)
+    customers = db.session.query(Customer.id, Customer.name).order_by(Customer.name.asc()).all()
+    return stream_template("bookings.html", rows=rows, q_status=q_status, customers=customers)
     
 @app.route("/bookings/add", methods=["GET", "POST"])
 def add_booking():
     if request.method == "POST":
         customer_id = int(request.form["customer_id"])
-        booking_type = request.form["booking_type"]
+        booking_type = BookingType.query.get_or_404(int(request.form["booking_type_id"]))
         event_date = datetime.strptime(request.form["event_date"], "%Y-%m-%d").date()
         secondary_date_str = request.form.get("secondary_date")
         secondary_date = datetime.strptime(secondary_date_str, "%Y-%m-%d").date() if secondary_date_str else None
         expected_income = float(request.form.get("expected_income", 0))
         paid_status = request.form.get("paid_status", "Pending")
         notes = request.form.get("notes")
-        booking_type_id = int(request.form["booking_type_id"])
 
-        
         new_booking = Booking(
             customer_id=customer_id,
             booking_type=booking_type,
@@ -547,32 +811,15 @@ def add_booking():
         db.session.commit()
 
         # --- Transaction logging ---
-        customer = Customer.query.get(customer_id)
+        # payments are linked to the booking; Paid/Partial then follows from its balance
         if paid_status == "Paid":
-            txn = Transaction(
-                type="Income",
-                category="Booking",
-                party=customer.name,
-                description=f"{booking_type} Booking",
-                amount=expected_income,
-                status="Paid",
-                date=datetime.utcnow().date()
-            )
-            db.session.add(txn)
-
+            record_booking_payment(new_booking, expected_income, f"{booking_type} Booking")
         elif paid_status == "Partial":
-            partial_amount = float(request.form.get("partial_amount", 0))
+            partial_amount = float(request.form.get("partial_amount", 0) or 0)
             if partial_amount > 0:
-                txn = Transaction(
-                    type="Income",
-                    category="Booking",
-                    party=customer.name,
-                    description=f"{booking_type} Booking (Partial Payment)",
-                    amount=partial_amount,
-                    status="Paid",
-                    date=datetime.utcnow().date(),
-                )
-                db.session.add(txn)
+                record_booking_payment(new_booking, partial_amount, f"{booking_type} Booking (Partial Payment)")
+            else:
+                new_booking.paid_status = "Pending"
 
         db.session.commit()
         flash("Booking added successfully!", "success")
@@ -580,37 +827,39 @@ def add_booking():
 
     # --- GET request: fetch customers & job types ---
     customers = Customer.query.order_by(Customer.name.asc()).all()
-    job_types = JobType.query.order_by(JobType.name.asc()).all()
-    return render_template("add_booking.html", customers=customers, job_types=job_types)
+    booking_types = BookingType.query.order_by(BookingType.name.asc()).all()
+    return render_template("add_booking.html", customers=customers, booking_types=booking_types)
 
 @app.route("/bookings/edit/<int:booking_id>", methods=["GET", "POST"])
 def edit_booking(booking_id):
-    booking = Booking.query.get_or_404(booking_id)
+    booking = Booking.query.options(db.undefer(Booking.notes)).get_or_404(booking_id)
 
     if request.method == "POST":
         booking.customer_id = int(request.form["customer_id"])
-        booking.booking_type = request.form["booking_type"]
+        booking.booking_type_id = int(request.form["booking_type_id"])
         booking.event_date = datetime.strptime(request.form["event_date"], "%Y-%m-%d").date()
         secondary_date_str = request.form.get("secondary_date")
         booking.secondary_date = datetime.strptime(secondary_date_str, "%Y-%m-%d").date() if secondary_date_str else None
         booking.expected_income = float(request.form.get("expected_income", 0))
-        booking.paid_status = request.form.get("paid_status", "Pending")
         booking.notes = request.form.get("notes")
-        booking_type_id = int(request.form["booking_type_id"])
+        # payments are recorded on the booking page; the status follows the new expected income
+        balance = outstanding_balances(booking_ids=[booking.id], invoice_ids=[])["booking"][booking.id]
+        booking.paid_status = booking_status(balance)
 
-        
         db.session.commit()
         flash("Booking updated successfully!", "success")
         return redirect(url_for("bookings"))
 
     customers = Customer.query.order_by(Customer.name.asc()).all()
-    return render_template("edit_booking.html", booking=booking, customers=customers)
+    booking_types = BookingType.query.order_by(BookingType.name.asc()).all()
+    return render_template("edit_booking.html", booking=booking, customers=customers, booking_types=booking_types)
 
 @app.route("/bookings/delete/<int:booking_id>", methods=["POST"])
 def delete_booking(booking_id):
-    booking = Booking.query.get_or_404(booking_id)
-    db.session.delete(booking)
+    customer_id = Booking.query.get_or_404(booking_id).customer_id  # the instance is gone after commit
+    delete_bookings(Booking.id == booking_id)
     db.session.commit()
+    invalidate_customer_summaries([customer_id])
     flash("Booking deleted!", "danger")
     return redirect(url_for("bookings"))
 
@@ -619,8 +868,9 @@ def delete_booking(booking_id):
 
 @app.route("/customers")
 def customers():
-    all_customers = Customer.query.order_by(Customer.name.asc()).all()
-    return render_template("customers.html", customers=all_customers)
+    all_customers = db.session.query(*CUSTOMER_LIST_COLUMNS).order_by(Customer.name.asc()).yield_per(500)
+    rows = render_rows("_customer_row.html", "c", all_customers, tuple)
+    return stream_template("customers.html", rows=rows)
 
 @app.route("/customers/add", methods=["GET", "POST"])
 def add_customer():
@@ -643,7 +893,7 @@ def add_customer():
 
 @app.route("/customers/edit/<int:customer_id>", methods=["GET", "POST"])
 def edit_customer(customer_id):
-    customer = Customer.query.get_or_404(customer_id)
+    customer = Customer.query.options(db.undefer(Customer.notes)).get_or_404(customer_id)
     if request.method == "POST":
         customer.name = request.form["name"]
         customer.email = request.form.get("email")
@@ -659,16 +909,174 @@ def edit_customer(customer_id):
 
 @app.route("/customers/delete/<int:customer_id>", methods=["POST"])
 def delete_customer(customer_id):
-    customer = Customer.query.get_or_404(customer_id)
-    db.session.delete(customer)
+    db.first_or_404(db.select(Customer.id).where(Customer.id == customer_id))
+    counts, paths = delete_customer_graph(customer_id)
     db.session.commit()
-    flash("Customer deleted!", "danger")
+    invalidate_customer_summaries([customer_id])
+    queue_file_removal(paths)
+    flash("Customer deleted with {bookings} bookings, {workorders} work orders and {invoices} invoices!".format(**counts),
+          "danger")
     return redirect(url_for("customers"))
 
 @app.route("/customers/<int:customer_id>")
 def view_customer(customer_id):
-    customer = Customer.query.get_or_404(customer_id)
-    return render_template("view_customer.html", customer=customer)
+    customer = Customer.query.options(
+        db.selectinload(Customer.bookings),
+        db.selectinload(Customer.workorders),
+    ).get_or_404(customer_id)
+    return render_template("view_customer.html", customer=customer, summary=customer_summary(customer_id))
+
+TOP_CUSTOMER_SORTS = ("expected_income", "paid_income", "outstanding", "bookings", "open_workorders", "last_activity")
+
+@app.route("/customers/top")
+def top_customers():
+    sort = request.args.get("sort", "expected_income")
+    if sort not in TOP_CUSTOMER_SORTS:
+        sort = "expected_income"
+    limit = max(1, min(request.args.get("limit", 50, type=int), 500))
+    return render_template("top_customers.html", customers=top_customer_summaries(sort, limit),
+                           sort=sort, sorts=TOP_CUSTOMER_SORTS, limit=limit)
+
+# --- Customer summaries ---
+# Lifetime stats per customer, computed for any number of customers in one
+# statement: each child table is aggregated once by customer_id and joined.
+# Results are cached in-process and invalidated when a customer's rows change;
+# the TTL bounds staleness across worker processes.
+
+CUSTOMER_SUMMARY_TTL = int(os.environ.get("CUSTOMER_SUMMARY_TTL", 300))
+_summary_cache = {}
+_summary_cache_lock = threading.Lock()
+
+def customer_summary_query(customer_id=None):
+    """Summary rows for every customer, or just ``customer_id`` (filtered inside
+    each grouped subquery, so only that customer's rows are read)."""
+    def only(column):
+        return column == customer_id if customer_id is not None else db.true()
+
+    bookings = db.session.query(
+        Booking.customer_id.label("customer_id"),
+        db.func.count(Booking.id).label("bookings"),
+        db.func.sum(Booking.expected_income).label("expected_income"),
+    ).filter(only(Booking.customer_id)).group_by(Booking.customer_id).subquery()
+
+    # paid = payments recorded against the bookings, as in outstanding_balances(),
+    # so part-paid bookings count for what's been paid on them
+    payments = db.union_all(*(
+        db.select(Booking.customer_id.label("customer_id"), table.c.amount)
+        .join(Booking, Booking.id == table.c.booking_id).where(_paid_income(table), only(Booking.customer_id))
+        for table in (Transaction.__table__, archived_transactions)
+    )).subquery("booking_payments")
+    paid = db.select(
+        payments.c.customer_id, db.func.sum(payments.c.amount).label("paid_income"),
+    ).group_by(payments.c.customer_id).subquery()
+
+    orders = db.session.query(
+        WorkOrder.customer_id.label("customer_id"),
+        db.func.count(WorkOrder.id).label("workorders"),
+        db.func.sum(db.case((WorkOrder.status != "Closed", 1), else_=0)).label("open_workorders"),
+    ).filter(only(WorkOrder.customer_id)).group_by(WorkOrder.customer_id).subquery()
+
+    invoices = db.session.query(
+        Invoice.customer_id.label("customer_id"),
+        db.func.count(Invoice.id).label("invoices"),
+        db.func.sum(db.case((Invoice.status == "Draft", Invoice.total), else_=0.0)).label("invoiced_draft"),
+        db.func.sum(db.case((Invoice.status == "Paid", Invoice.total), else_=0.0)).label("invoiced_paid"),
+        db.func.sum(db.case((Invoice.status != "Paid", Invoice.total), else_=0.0)).label("outstanding"),
+    ).filter(only(Invoice.customer_id)).group_by(Invoice.customer_id).subquery()
+
+    events = db.union_all(
+        db.select(Booking.customer_id.label("customer_id"), Booking.created_at.label("at")).where(only(Booking.customer_id)),
+        db.select(WorkOrder.customer_id, WorkOrder.created_at).where(only(WorkOrder.customer_id)),
+        db.select(Invoice.customer_id, Invoice.created_at).where(only(Invoice.customer_id)),
+    ).subquery()
+    activity = db.select(
+        events.c.customer_id, db.func.max(events.c.at).label("last_activity")
+    ).group_by(events.c.customer_id).subquery()
+
+    zero = db.literal(0)
+    return db.session.query(
+        Customer.id.label("customer_id"),
+        Customer.name,
+        db.func.coalesce(bookings.c.bookings, zero).label("bookings"),
+        db.func.coalesce(bookings.c.expected_income, 0.0).label("expected_income"),
+        db.func.coalesce(paid.c.paid_income, 0.0).label("paid_income"),
+        db.func.coalesce(orders.c.workorders, zero).label("workorders"),
+        db.func.coalesce(orders.c.open_workorders, zero).label("open_workorders"),
+        db.func.coalesce(invoices.c.invoices, zero).label("invoices"),
+        db.func.coalesce(invoices.c.invoiced_draft, 0.0).label("invoiced_draft"),
+        db.func.coalesce(invoices.c.invoiced_paid, 0.0).label("invoiced_paid"),
+        db.func.coalesce(invoices.c.outstanding, 0.0).label("outstanding"),
+        db.func.coalesce(activity.c.last_activity, Customer.created_at).label("last_activity"),
+    ).outerjoin(bookings, bookings.c.customer_id == Customer.id)\
+     .outerjoin(paid, paid.c.customer_id == Customer.id)\
+     .outerjoin(orders, orders.c.customer_id == Customer.id)\
+     .outerjoin(invoices, invoices.c.customer_id == Customer.id)\
+     .outerjoin(activity, activity.c.customer_id == Customer.id)
+
+def _cache_get(key):
+    with _summary_cache_lock:
+        entry = _summary_cache.get(key)
+    if entry and entry[0] > time.monotonic():
+        return entry[1]
+    return None
+
+def _cache_put(key, value):
+    with _summary_cache_lock:
+        _summary_cache[key] = (time.monotonic() + CUSTOMER_SUMMARY_TTL, value)
+    return value
+
+def customer_summary(customer_id):
+    """Lifetime stats for one customer as a dict (None if the customer doesn't exist)."""
+    cached = _cache_get(customer_id)
+    if cached is not None:
+        return cached
+    row = customer_summary_query(customer_id).filter(Customer.id == customer_id).first()
+    return _cache_put(customer_id, dict(row._mapping)) if row else None
+
+def top_customer_summaries(sort="expected_income", limit=50):
+    """Customers ranked by a summary column, highest first, from one query."""
+    key = ("top", sort, limit)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+    query = customer_summary_query()
+    column = next(c for c in query.statement.selected_columns if c.name == sort)
+    rows = query.order_by(column.desc(), Customer.name.asc()).limit(limit).all()
+    return _cache_put(key, [dict(r._mapping) for r in rows])
+
+def invalidate_customer_summaries(customer_ids=None):
+    """Drop cached summaries for ``customer_ids`` (all when None); ranked lists always go."""
+    with _summary_cache_lock:
+        if customer_ids is None:
+            _summary_cache.clear()
+            return
+        for key in list(_summary_cache):
+            if isinstance(key, tuple) or key in customer_ids:
+                del _summary_cache[key]
+
+@event.listens_for(Session, "after_flush")
+def collect_flushed_customers(session, flush_context):
+    """Note whose summaries a flush changes; they're dropped once it commits,
+    so nothing can re-cache the old figures in between."""
+    touched = session.info.setdefault("summary_customers", set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Customer):
+            touched.add(obj.id)
+        elif isinstance(obj, (Booking, WorkOrder, Invoice)):
+            # old and new owner both change when a row moves between customers
+            touched.update(v for v in inspect(obj).attrs.customer_id.history.sum() if v)
+        elif isinstance(obj, Transaction) and obj.booking_id is not None:
+            touched.update(v for v in inspect(obj).attrs.customer_id.history.sum() if v)
+
+@event.listens_for(Session, "after_commit")
+def invalidate_committed_customers(session):
+    touched = session.info.pop("summary_customers", None)
+    if touched:
+        invalidate_customer_summaries(touched)
+
+@event.listens_for(Session, "after_rollback")
+def discard_rolled_back_customers(session):
+    session.info.pop("summary_customers", None)
 
 
 @app.before_request
@@ -685,8 +1093,10 @@ def seed_job_types():
 
 @app.route("/invoices", endpoint="invoices")
 def invoices():
-    invoices = Invoice.query.order_by(Invoice.created_at.desc()).all()
-    return render_template("invoices.html", invoices=invoices)
+    invoices = db.session.query(*INVOICE_LIST_COLUMNS).outerjoin(Customer, Invoice.customer_id == Customer.id)\
+        .order_by(Invoice.created_at.desc()).yield_per(500)
+    rows = render_rows("_invoice_row.html", "inv", invoices, tuple)
+    return stream_template("invoices.html", rows=rows)
 
 @app.route("/invoices/create/<int:customer_id>", methods=["POST"])
 def create_invoice(customer_id):
@@ -720,7 +1130,8 @@ def create_invoice(customer_id):
 def view_invoice(invoice_id):
     invoice = Invoice.query.get_or_404(invoice_id)
     customer = Customer.query.get(invoice.customer_id)
-    return render_template("view_invoice.html", invoice=invoice, customer=customer)
+    balance = outstanding_balances(booking_ids=[], invoice_ids=[invoice.id])["invoice"][invoice.id]
+    return render_template("view_invoice.html", invoice=invoice, customer=customer, balance=balance)
 
 @app.route("/invoices/create_from_booking/<int:booking_id>", methods=["POST"])
 def create_invoice_from_booking(booking_id):
@@ -759,19 +1170,21 @@ def create_invoice_from_booking(booking_id):
 def mark_invoice_paid(invoice_id):
     invoice = Invoice.query.get_or_404(invoice_id)
     invoice.status = "Paid"
-    db.session.commit()
 
-    # Optional: log a transaction when invoice is marked paid
-    txn = Transaction(
-        type="Income",
-        category="Invoice",
-        party=invoice.customer.name,
-        description=f"Invoice #{invoice.id}",
-        amount=invoice.total,
-        status="Paid",
-        date=datetime.utcnow().date(),
-    )
-    db.session.add(txn)
+    # log whatever is still outstanding as a payment against the invoice
+    outstanding = outstanding_balances(booking_ids=[], invoice_ids=[invoice.id])["invoice"][invoice.id]["outstanding"]
+    if outstanding > 0:
+        db.session.add(Transaction(
+            type="Income",
+            category="Invoice",
+            party=invoice.customer.name,
+            description=f"Invoice #{invoice.id}",
+            amount=outstanding,
+            status="Paid",
+            date=datetime.utcnow().date(),
+            customer_id=invoice.customer_id,
+            invoice_id=invoice.id,
+        ))
     db.session.commit()
 
     flash(f"Invoice #{invoice.id} marked as Paid", "success")
@@ -780,9 +1193,10 @@ def mark_invoice_paid(invoice_id):
 @app.route("/invoices/delete/<int:invoice_id>", methods=["POST"])
 def delete_invoice(invoice_id):
     invoice = Invoice.query.get_or_404(invoice_id)
-    db.session.delete(invoice)
+    _, paths = delete_invoices(Invoice.id == invoice.id)
     db.session.commit()
-    flash(f"Invoice #{invoice.id} deleted!", "danger")
+    queue_file_removal(paths)
+    flash(f"Invoice #{invoice_id} deleted!", "danger")
     return redirect(url_for("invoices"))
 
 @app.route("/invoices/<int:invoice_id>/pdf")
@@ -790,8 +1204,7 @@ def invoice_pdf(invoice_id):
     invoice = Invoice.query.get_or_404(invoice_id)
     customer = invoice.customer
 
-    filename = f"invoice_{invoice.id}.pdf"
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    filepath = invoice_pdf_path(invoice.id)
 
     doc = SimpleDocTemplate(filepath, pagesize=letter)
     styles = getSampleStyleSheet()
@@ -834,35 +1247,132 @@ def invoice_pdf(invoice_id):
     # --- Build PDF ---
     doc.build(elements)
 
-    return send_file(filepath, as_attachment=True)
+    # send_file resolves relative paths against the app root, not the cwd the PDF was written to
+    return send_file(os.path.abspath(filepath), as_attachment=True)
 
 # ------------------ Leads ------------------
 
+# Facet counts (status, type, source, preferred contact) come from one GROUP
+# BY over the searched leads and are cached per filter signature; the page
+# total falls out of the same query. Pages fetch one extra row to know if
+# there's a next page, so no COUNT(*) runs per page turn, and past
+# LEAD_EXACT_COUNT_PAGES the counts are only shown if already cached.
+
+LEAD_FACETS = ("status", "type", "source", "preferred_contact")
+LEADS_PER_PAGE = 20
+LEAD_EXACT_COUNT_PAGES = int(os.environ.get("LEAD_EXACT_COUNT_PAGES", 50))
+LEAD_FACET_TTL = int(os.environ.get("LEAD_FACET_TTL", 300))
+_lead_facet_cache = {}
+_lead_facet_cache_lock = threading.Lock()
+
+class Page:
+    """One page of results; ``total`` and ``pages`` are None when counting was skipped."""
+
+    def __init__(self, items, page, per_page, has_next, total=None):
+        self.items = items
+        self.page = page
+        self.per_page = per_page
+        self.has_next = has_next
+        self.has_prev = page > 1
+        self.prev_num = page - 1
+        self.next_num = page + 1
+        self.total = total
+        self.pages = max(1, -(-total // per_page)) if total is not None else None
+
+    def __iter__(self):
+        return iter(self.items)
+
+def lead_search_filter(search):
+    return (
+        (Lead.contact_name.ilike(f"%{search}%")) |
+        (Lead.business_name.ilike(f"%{search}%")) |
+        (Lead.email.ilike(f"%{search}%")) |
+        (Lead.phone.ilike(f"%{search}%"))
+    )
+
+def _lead_facet_key(search, filters):
+    # the exact string the queries use: lower() here could merge searches
+    # SQLite's ASCII-only case folding treats as different
+    return search, tuple(sorted(filters.items()))
+
+def cached_lead_facets(search, filters):
+    with _lead_facet_cache_lock:
+        entry = _lead_facet_cache.get(_lead_facet_key(search, filters))
+    if entry and entry[0] > time.monotonic():
+        return entry[1]
+    return None
+
+def lead_facets(search, filters):
+    """``({facet: {value: count}}, total)`` for leads matching ``search`` and ``filters``.
+
+    Each facet's counts apply the other facets' filters but not its own, so a
+    dropdown shows what picking another value would return. One grouped query,
+    cached per (search, filters) until a lead is written.
+    """
+    cached = cached_lead_facets(search, filters)
+    if cached is not None:
+        return cached
+    columns = [getattr(Lead, f) for f in LEAD_FACETS]
+    query = db.session.query(*columns, db.func.count(Lead.id)).group_by(*columns)
+    if search:
+        query = query.filter(lead_search_filter(search))
+
+    counts = {f: {} for f in LEAD_FACETS}
+    total = 0
+    for *values, n in query:
+        row = dict(zip(LEAD_FACETS, values))
+        mismatched = {f for f, value in filters.items() if row[f] != value}
+        if not mismatched:
+            total += n
+        for f in LEAD_FACETS:
+            if mismatched <= {f}:
+                counts[f][row[f]] = counts[f].get(row[f], 0) + n
+    result = (counts, total)
+    with _lead_facet_cache_lock:
+        _lead_facet_cache[_lead_facet_key(search, filters)] = (time.monotonic() + LEAD_FACET_TTL, result)
+    return result
+
+def invalidate_lead_facets():
+    with _lead_facet_cache_lock:
+        _lead_facet_cache.clear()
+
+@event.listens_for(Session, "after_flush")
+def collect_flushed_leads(session, flush_context):
+    # the counts are dropped once the write commits, not while it can still be re-cached
+    if any(isinstance(obj, Lead) for obj in list(session.new) + list(session.dirty) + list(session.deleted)):
+        session.info["leads_changed"] = True
+
+@event.listens_for(Session, "after_commit")
+def invalidate_committed_leads(session):
+    if session.info.pop("leads_changed", False):
+        invalidate_lead_facets()
+
+@event.listens_for(Session, "after_rollback")
+def discard_rolled_back_leads(session):
+    session.info.pop("leads_changed", None)
+
 @app.route("/leads")
 def leads():
-    page = request.args.get("page", 1, type=int)
-    search = request.args.get("search", "")
-    status_filter = request.args.get("status", "")
-    type_filter = request.args.get("type", "")
+    page = max(request.args.get("page", 1, type=int), 1)
+    search = request.args.get("search", "").strip()
+    filters = {f: request.args[f] for f in LEAD_FACETS if request.args.get(f)}
+    # ?counts=1 forces exact counts on deep pages, ?counts=0 skips them everywhere
+    counts_arg = request.args.get("counts")
+    exact = counts_arg == "1" or (counts_arg != "0" and page <= LEAD_EXACT_COUNT_PAGES)
 
     query = Lead.query
-
     if search:
-        query = query.filter(
-            (Lead.contact_name.ilike(f"%{search}%")) |
-            (Lead.business_name.ilike(f"%{search}%")) |
-            (Lead.email.ilike(f"%{search}%")) |
-            (Lead.phone.ilike(f"%{search}%"))
-        )
-    if status_filter:
-        query = query.filter_by(status=status_filter)
-    if type_filter:
-        query = query.filter_by(type=type_filter)
+        query = query.filter(lead_search_filter(search))
+    for f, value in filters.items():
+        query = query.filter(getattr(Lead, f) == value)
 
-    leads = query.order_by(Lead.contact_name.asc()).paginate(page=page, per_page=20)
+    rows = query.order_by(Lead.contact_name.asc(), Lead.id.asc())\
+        .offset((page - 1) * LEADS_PER_PAGE).limit(LEADS_PER_PAGE + 1).all()
+    facets = lead_facets(search, filters) if exact else cached_lead_facets(search, filters)
+    counts, total = facets if facets else (None, None)
+    leads = Page(rows[:LEADS_PER_PAGE], page, LEADS_PER_PAGE, len(rows) > LEADS_PER_PAGE, total)
 
-    return render_template("leads.html", leads=leads, search=search,
-                           status_filter=status_filter, type_filter=type_filter)
+    return render_template("leads.html", leads=leads, search=search, filters=filters, counts=counts)
 
 
 @app.route("/leads/add", methods=["GET", "POST"])
@@ -899,7 +1409,7 @@ def add_lead():
 
 @app.route("/leads/edit/<int:lead_id>", methods=["GET", "POST"])
 def edit_lead(lead_id):
-    lead = Lead.query.get_or_404(lead_id)
+    lead = Lead.query.options(db.undefer(Lead.notes)).get_or_404(lead_id)
     if request.method == "POST":
         lead.contact_name = request.form["contact_name"]
         lead.business_name = request.form.get("business_name")
@@ -1012,6 +1522,10 @@ def add_bookingtype():
 @app.route("/settings/bookingtypes/delete/<int:type_id>", methods=["POST"])
 def delete_bookingtype(type_id):
     btype = BookingType.query.get_or_404(type_id)
+    if Booking.query.filter_by(booking_type_id=btype.id).first():
+        # booking.booking_type_id is ON DELETE RESTRICT
+        flash("Booking type is in use by bookings and can't be deleted.", "warning")
+        return redirect(url_for("bookingtypes"))
     db.session.delete(btype)
     db.session.commit()
     flash("Booking type deleted!", "danger")
@@ -1031,21 +1545,2109 @@ def edit_bookingtype(type_id):
 
 @app.route("/settings/backup", methods=["POST"])
 def backup_database():
+    if db.engine.dialect.name != "sqlite":
+        flash("Backups from this page only cover SQLite; use pg_dump for Postgres.", "warning")
+        return redirect(url_for("jobtypes"))
+
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     backup_dir = os.path.join(app.root_path, "backups")
     os.makedirs(backup_dir, exist_ok=True)
 
-    # Path to SQLite file inside Flask's instance folder
-    db_path = os.path.join(app.instance_path, "business.db")
+    # Path to the SQLite file (inside Flask's instance folder by default)
+    db_path = db.engine.url.database
 
     backup_filename = f"backup_{timestamp}.db"
     backup_path = os.path.join(backup_dir, backup_filename)
 
     shutil.copy(db_path, backup_path)
+    if os.path.exists(app.config['ARCHIVE_DATABASE']):
+        shutil.copy(app.config['ARCHIVE_DATABASE'], os.path.join(backup_dir, f"backup_{timestamp}_archive.db"))
 
     flash(f"Database backup created: {backup_filename}", "success")
     return redirect(url_for("jobtypes"))  # back to settings
 
+# ------------------- Archive ---------------------
+
+def transaction_source(include_archive=False):
+    """Entity to query transactions from; with ``include_archive`` it spans hot and archived rows."""
+    if not include_archive:
+        return Transaction
+    combined = db.union_all(
+        db.select(Transaction.__table__, db.false().label("archived")),
+        db.select(archived_transactions, db.true().label("archived")),
+    ).subquery("all_transactions")
+    return aliased(Transaction, combined)
+
+def workorder_source(include_archive=False):
+    """Entity to query work orders from; with ``include_archive`` it spans hot and archived rows."""
+    if not include_archive:
+        return WorkOrder
+    combined = db.union_all(
+        db.select(WorkOrder.__table__, db.false().label("archived")),
+        db.select(archived_workorders, db.true().label("archived")),
+    ).subquery("all_workorders")
+    return aliased(WorkOrder, combined)
+
+def archived_flag(entity):
+    """``archived`` column for a list query: true for rows read from the archive."""
+    columns = inspect(entity).selectable.c
+    return (columns.archived if "archived" in columns else db.false()).label("archived")
+
+def transaction_totals():
+    """Lifetime ``{(type, status): (count, total)}`` from the hot table plus the archive rollup."""
+    hot = db.session.query(
+        Transaction.type, Transaction.status,
+        db.func.count(Transaction.id), db.func.coalesce(db.func.sum(Transaction.amount), 0.0)
+    ).group_by(Transaction.type, Transaction.status)
+    cold = db.session.query(
+        TransactionRollup.type, TransactionRollup.status,
+        db.func.sum(TransactionRollup.count), db.func.sum(TransactionRollup.total)
+    ).group_by(TransactionRollup.type, TransactionRollup.status)
+
+    totals = {}
+    for t_type, status, count, total in list(hot) + list(cold):
+        prev_count, prev_total = totals.get((t_type, status), (0, 0.0))
+        totals[(t_type, status)] = (prev_count + (count or 0), prev_total + (total or 0.0))
+    return totals
+
+def monthly_transaction_totals(year=None):
+    """Per-month ``{(year, month, type, status): (count, total)}``, hot rows plus archive rollup."""
+    t_year = db.extract("year", Transaction.date)
+    t_month = db.extract("month", Transaction.date)
+    hot = db.session.query(
+        t_year, t_month, Transaction.type, Transaction.status,
+        db.func.count(Transaction.id), db.func.coalesce(db.func.sum(Transaction.amount), 0.0)
+    )
+    cold = db.session.query(
+        TransactionRollup.year, TransactionRollup.month, TransactionRollup.type, TransactionRollup.status,
+        TransactionRollup.count, TransactionRollup.total
+    )
+    if year is not None:
+        hot = hot.filter(Transaction.date >= datetime(year, 1, 1).date(),
+                         Transaction.date < datetime(year + 1, 1, 1).date())
+        cold = cold.filter(TransactionRollup.year == year)
+    hot = hot.group_by(t_year, t_month, Transaction.type, Transaction.status)
+
+    totals = {}
+    for y, m, t_type, status, count, total in list(hot) + list(cold):
+        key = (int(y), int(m), t_type, status)
+        prev_count, prev_total = totals.get(key, (0, 0.0))
+        totals[key] = (prev_count + (count or 0), prev_total + (total or 0.0))
+    return totals
+
+def workorder_tiles():
+    """(total, new, in progress, closed, high priority) work order counts, archive included."""
+    hot = db.session.query(WorkOrder.status, WorkOrder.priority, db.func.count(WorkOrder.id))\
+        .group_by(WorkOrder.status, WorkOrder.priority)
+    cold = db.session.query(WorkOrderRollup.status, WorkOrderRollup.priority, WorkOrderRollup.count)
+
+    total = new = in_progress = closed = high = 0
+    for status, priority, count in list(hot) + list(cold):
+        total += count
+        if status == "New":
+            new += count
+        elif status == "In Progress":
+            in_progress += count
+        elif status == "Closed":
+            closed += count
+        if priority == "High":
+            high += count
+    return total, new, in_progress, closed, high
+
+def archive_before(cutoff):
+    """Move paid transactions dated before ``cutoff`` and closed work orders created
+    before it into the archive, in one transaction, and rebuild the archive rollups.
+
+    Returns ``(transactions_moved, workorders_moved)``.
+    """
+    cutoff_dt = datetime.combine(cutoff, datetime.min.time())
+    txn_filter = db.and_(Transaction.status == "Paid", Transaction.date < cutoff)
+    wo_filter = db.and_(WorkOrder.status == "Closed", WorkOrder.created_at < cutoff_dt)
+
+    try:
+        log_bulk_changes(Transaction.__table__, "archive", txn_filter)
+        log_bulk_changes(WorkOrder.__table__, "archive", wo_filter)
+        db.session.execute(archived_transactions.insert().from_select(
+            [c.name for c in Transaction.__table__.columns],
+            db.select(Transaction.__table__).where(txn_filter)
+        ))
+        moved_txns = db.session.execute(Transaction.__table__.delete().where(txn_filter)).rowcount
+
+        db.session.execute(archived_workorders.insert().from_select(
+            [c.name for c in WorkOrder.__table__.columns],
+            db.select(WorkOrder.__table__).where(wo_filter)
+        ))
+        moved_orders = db.session.execute(WorkOrder.__table__.delete().where(wo_filter)).rowcount
+
+        # Rollups are rebuilt from the archive; archival is a rare batch job.
+        a = archived_transactions.c
+        a_year = db.cast(db.extract("year", a.date), db.Integer)
+        a_month = db.cast(db.extract("month", a.date), db.Integer)
+        db.session.execute(TransactionRollup.__table__.delete())
+        db.session.execute(TransactionRollup.__table__.insert().from_select(
+            ["year", "month", "type", "status", "count", "total"],
+            db.select(a_year, a_month, a.type, a.status,
+                      db.func.count(), db.func.coalesce(db.func.sum(a.amount), 0.0))
+            .group_by(a_year, a_month, a.type, a.status)
+        ))
+
+        w = archived_workorders.c
+        # literal '' (not a bound parameter) so Postgres sees identical SELECT/GROUP BY expressions
+        w_status = db.func.coalesce(w.status, db.literal_column("''"))
+        w_priority = db.func.coalesce(w.priority, db.literal_column("''"))
+        db.session.execute(WorkOrderRollup.__table__.delete())
+        db.session.execute(WorkOrderRollup.__table__.insert().from_select(
+            ["status", "priority", "count", "total"],
+            db.select(w_status, w_priority, db.func.count(), db.func.coalesce(db.func.sum(w.price), 0.0))
+            .group_by(w_status, w_priority)
+        ))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    invalidate_customer_summaries()
+    return moved_txns, moved_orders
+
+@app.route("/settings/archive", methods=["POST"])
+def archive_records():
+    before = request.form.get("before")
+    try:
+        cutoff = datetime.strptime(before or "", "%Y-%m-%d").date()
+    except ValueError:
+        flash("Pick a cutoff date to archive.", "warning")
+        return redirect(url_for("jobtypes"))
+
+    moved_txns, moved_orders = archive_before(cutoff)
+    flash(f"Archived {moved_txns} transactions and {moved_orders} work orders before {before}.", "success")
+    return redirect(url_for("jobtypes"))
+
+@app.cli.command("archive")
+@click.option("--before", required=True, type=click.DateTime(formats=["%Y-%m-%d"]),
+              help="Archive paid transactions and closed work orders older than this date.")
+def archive_command(before):
+    """Move old paid transactions and closed work orders into the archive database."""
+    moved_txns, moved_orders = archive_before(before.date())
+    click.echo(f"Archived {moved_txns} transactions and {moved_orders} work orders.")
+
+@app.cli.command("init-db")
+def init_db_command():
+    """Create tables and indexes (including the archive schema)."""
+    init_db()
+    click.echo("Database initialised.")
+
+# ------------------- Cash-flow forecast ---------------------
+# The database pre-sums amounts per day; those day totals are pulled in bulk
+# into NumPy arrays and bucketed with vectorised ops (datetime64 arithmetic,
+# bincount, digitize) — no per-row Python math, and a few thousand rows even
+# for years of history. Past buckets show paid transactions; the current and
+# future buckets add what's still owed on unpaid bookings (on their event
+# date) and pending transactions, with overdue items landing in the current
+# bucket. Archived transactions come from the monthly rollups, each month
+# counted on its first day: in the bucket that day falls in, or in the
+# opening balance if it's before the window.
+
+AGING_EDGES = np.array([0, 31, 61, 91])
+AGING_LABELS = ("0-30", "31-60", "61-90", "90+")
+
+def _column_arrays(query):
+    rows = db.session.execute(query).all()
+    if not rows:
+        return None
+    return [np.array(col) for col in zip(*rows)]
+
+def _iso_date(column):
+    # dates come back as 'YYYY-MM-DD' text, which NumPy parses far faster than
+    # the driver builds date objects
+    return db.cast(column, db.String)
+
+def cash_flow_forecast(granularity="month", horizon=12, history=12, today=None):
+    today = np.datetime64(today or datetime.utcnow().date(), "D")
+    if granularity == "week":
+        # weeks start on Monday; 1970-01-01 (day 0) was a Thursday
+        start = today - ((today.astype(np.int64) + 3) % 7) - 7 * history
+        def bucket(days):
+            return (days - start).astype(np.int64) // 7
+        labels = [str(start + 7 * i) for i in range(history + horizon)]
+    else:
+        granularity = "month"
+        start = today.astype("datetime64[M]") - history
+        def bucket(days):
+            return (days.astype("datetime64[M]") - start).astype(np.int64)
+        labels = [str(start + i) for i in range(history + horizon)]
+    n = history + horizon
+    current = history
+
+    def sums(index, weights):
+        keep = (index >= 0) & (index < n)
+        return np.bincount(index[keep], weights=weights[keep], minlength=n)
+
+    def age(days, amounts):
+        overdue = days < today
+        overdue_days = (today - days[overdue]).astype(np.int64)
+        slots = np.digitize(overdue_days, AGING_EDGES) - 1
+        return np.bincount(slots, weights=amounts[overdue], minlength=len(AGING_LABELS))
+
+    actual_in, actual_out = np.zeros(n), np.zeros(n)
+    projected_in, projected_out = np.zeros(n), np.zeros(n)
+    aging_receivable, aging_payable = np.zeros(len(AGING_LABELS)), np.zeros(len(AGING_LABELS))
+
+    # opening balance: paid net (archived and hot) before the window
+    opening_balance = 0.0
+
+    rollups = _column_arrays(
+        db.select(TransactionRollup.year, TransactionRollup.month, TransactionRollup.type, TransactionRollup.total)
+        .where(TransactionRollup.status == "Paid")
+    )
+    if rollups:
+        years, months, types, totals = rollups
+        days = ((years.astype(np.int64) - 1970) * 12 + months.astype(np.int64) - 1).astype("datetime64[M]")
+        idx = bucket(days.astype("datetime64[D]"))
+        totals = totals.astype(float)
+        income = types == "Income"
+        actual_in += sums(idx[income], totals[income])
+        actual_out += sums(idx[~income], totals[~income])
+        before = idx < 0
+        opening_balance += totals[before & income].sum() - totals[before & ~income].sum()
+
+    txns = _column_arrays(
+        db.select(_iso_date(Transaction.date), Transaction.type, Transaction.status, db.func.sum(Transaction.amount))
+        .group_by(Transaction.date, Transaction.type, Transaction.status)
+    )
+    if txns:
+        days, types, statuses, amounts = txns
+        days = days.astype("datetime64[D]")
+        amounts = amounts.astype(float)
+        income, paid = types == "Income", statuses == "Paid"
+        idx = bucket(days)
+
+        actual_in += sums(idx[income & paid], amounts[income & paid])
+        actual_out += sums(idx[~income & paid], amounts[~income & paid])
+        before = idx < 0
+        opening_balance += amounts[before & income & paid].sum() - amounts[before & ~income & paid].sum()
+
+        pending_idx = np.maximum(idx, current)  # overdue -> current bucket
+        projected_in += sums(pending_idx[income & ~paid], amounts[income & ~paid])
+        projected_out += sums(pending_idx[~income & ~paid], amounts[~income & ~paid])
+        aging_receivable += age(days[income & ~paid], amounts[income & ~paid])
+        aging_payable += age(days[~income & ~paid], amounts[~income & ~paid])
+
+    # one row per unpaid booking with what's still owed (Partial payments are
+    # already in actual_in), clamped here so the paid subquery runs once per row
+    bookings = _column_arrays(
+        db.select(_iso_date(Booking.event_date),
+                  db.func.coalesce(Booking.expected_income, 0.0) - booking_paid_subquery())
+        .where(Booking.paid_status != "Paid")
+    )
+    if bookings:
+        days, amounts = bookings
+        days = days.astype("datetime64[D]")
+        amounts = np.maximum(amounts.astype(float), 0.0)
+        projected_in += sums(np.maximum(bucket(days), current), amounts)
+        aging_receivable += age(days, amounts)
+
+    inflow = actual_in + projected_in
+    outflow = actual_out + projected_out
+    balance = opening_balance + np.cumsum(inflow - outflow)
+
+    return {
+        "granularity": granularity,
+        "today": str(today),
+        "opening_balance": round(float(opening_balance), 2),
+        "periods": [
+            {
+                "start": labels[i],
+                "projected": i >= current,
+                "actual_in": round(float(actual_in[i]), 2),
+                "actual_out": round(float(actual_out[i]), 2),
+                "projected_in": round(float(projected_in[i]), 2),
+                "projected_out": round(float(projected_out[i]), 2),
+                "net": round(float(inflow[i] - outflow[i]), 2),
+                "balance": round(float(balance[i]), 2),
+            }
+            for i in range(n)
+        ],
+        "aging": {
+            "receivable": dict(zip(AGING_LABELS, np.round(aging_receivable, 2).tolist())),
+            "payable": dict(zip(AGING_LABELS, np.round(aging_payable, 2).tolist())),
+        },
+    }
+
+def forecast_args():
+    granularity = request.args.get("granularity", "month")
+    limit = 104 if granularity == "week" else 60
+    horizon = max(1, min(request.args.get("horizon", 12, type=int), limit))
+    history = max(0, min(request.args.get("history", 12, type=int), limit))
+    return granularity, horizon, history
+
+@app.route("/forecast")
+def forecast():
+    granularity, horizon, history = forecast_args()
+    return render_template("forecast.html", forecast=cash_flow_forecast(granularity, horizon, history),
+                           horizon=horizon, history=history)
+
+@app.route("/api/forecast")
+def api_forecast():
+    return cash_flow_forecast(*forecast_args())
+
+# ------------------- Change feed ---------------------
+# Every ORM flush appends compact records to change_log, so downstream
+# consumers (accounting sync, offline reports) can pull "changes since seq N"
+# instead of re-exporting whole tables. Set-based statements that bypass the
+# ORM record their rows with log_bulk_changes().
+
+def _json_value(value):
+    if isinstance(value, datetime) or hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
+
+def _change_fields(obj, op):
+    state = inspect(obj)
+    fields = {}
+    for attr in state.mapper.column_attrs:
+        if op == "insert":
+            value = state.dict.get(attr.key)  # no load for unset deferred columns
+            if value is not None:
+                fields[attr.key] = _json_value(value)
+        else:
+            history = state.attrs[attr.key].history
+            if history.added:
+                fields[attr.key] = _json_value(history.added[0])
+    return fields
+
+@event.listens_for(Session, "after_flush")
+def record_changes(session, flush_context):
+    now = datetime.utcnow()
+    rows = []
+    for op, objects in (("insert", session.new), ("update", session.dirty), ("delete", session.deleted)):
+        for obj in objects:
+            if isinstance(obj, (ChangeLog, Upload, ReportJob)) or not isinstance(obj, db.Model):
+                continue
+            fields = None
+            if op != "delete":
+                fields = _change_fields(obj, op)
+                if op == "update" and not fields:
+                    continue
+            rows.append({
+                "table_name": obj.__table__.name, "row_id": inspect(obj).mapper.primary_key_from_instance(obj)[0],
+                "op": op, "fields": fields, "created_at": now,
+            })
+    if rows:
+        session.connection().execute(ChangeLog.__table__.insert(), rows)
+        session.info["changed"] = True  # wakes the dashboard publisher on commit
+
+def log_bulk_changes(table, op, where, fields=None):
+    """Append change records for the rows of ``table`` matching ``where``.
+
+    Call before a set-based UPDATE/DELETE (after it, for the rows still visible).
+    """
+    columns = [
+        db.literal(table.name).label("table_name"), table.c.id, db.literal(op).label("op"),
+        db.literal(datetime.utcnow()).label("created_at"),
+    ]
+    into = ["table_name", "row_id", "op", "created_at"]
+    if fields is not None:
+        columns.append(db.literal(fields, ChangeLog.__table__.c.fields.type).label("fields"))
+        into.append("fields")
+    db.session.execute(ChangeLog.__table__.insert().from_select(into, db.select(*columns).where(where)))
+    db.session.info["changed"] = True
+
+@app.route("/api/changes")
+def api_changes():
+    """Newline-delimited JSON change records with seq > ``since``, oldest first.
+
+    Consumers store the last ``seq`` they processed and pass it back as ``since``.
+    On Postgres, concurrent writers can commit slightly out of seq order, so
+    consumers should re-read a small overlap (e.g. the last few seconds).
+    """
+    since = request.args.get("since", 0, type=int)
+    limit = min(request.args.get("limit", 10000, type=int), 100000)
+    tables = set(filter(None, request.args.get("tables", "").split(",")))
+    batch = 1000
+
+    def generate():
+        cursor, sent = since, 0
+        while sent < limit:
+            query = ChangeLog.query.filter(ChangeLog.seq > cursor)
+            if tables:
+                query = query.filter(ChangeLog.table_name.in_(tables))
+            chunk = query.order_by(ChangeLog.seq.asc()).limit(min(batch, limit - sent)).all()
+            if not chunk:
+                break
+            for change in chunk:
+                yield json.dumps({
+                    "seq": change.seq, "table": change.table_name, "id": change.row_id,
+                    "op": change.op, "fields": change.fields,
+                    "at": change.created_at.isoformat(),
+                }) + "\n"
+            cursor, sent = chunk[-1].seq, sent + len(chunk)
+            db.session.expunge_all()
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+# ------------------- Live dashboard ---------------------
+# Open dashboards subscribe to /dashboard/stream (Server-Sent Events) instead
+# of reloading. One publisher thread per process recomputes the dashboard once
+# per change, not once per tab, and pushes only what differs: changed tile
+# metrics, and new or changed "recent" rows (rendered server-side with the same
+# partials as the page). A commit that wrote anything wakes it at once; it also
+# checks the change feed's latest seq every DASHBOARD_POLL_SECONDS while
+# anyone is subscribed, which picks up writes made by other worker processes.
+# Streams end after DASHBOARD_STREAM_SECONDS and the browser reconnects, so a
+# forgotten tab never pins a worker thread for good.
+
+DASHBOARD_POLL_SECONDS = float(os.environ.get("DASHBOARD_POLL_SECONDS", 2))
+DASHBOARD_STREAM_SECONDS = int(os.environ.get("DASHBOARD_STREAM_SECONDS", 300))
+DASHBOARD_KEEPALIVE_SECONDS = 15
+DASHBOARD_DEBOUNCE_SECONDS = 0.2  # coalesce a burst of commits into one refresh
+DASHBOARD_METRICS = (
+    "income_paid", "expense_paid", "profit", "pending_income", "pending_expense",
+    "total_bookings", "total_expected_income", "pending_bookings", "paid_bookings",
+    "total_orders", "open_orders", "in_progress_orders", "closed_orders", "high_priority",
+)
+
+def dashboard_snapshot():
+    data = dashboard_data()
+    return {
+        "metrics": {name: data[name] for name in DASHBOARD_METRICS},
+        "recent": [(t.id, render_template("_recent_transaction_row.html", t=t)) for t in data["recent"]],
+        "recent_orders": [(o.id, render_template("_recent_order_row.html", order=o)) for o in data["recent_orders"]],
+        "upcoming": render_template("_upcoming_order.html", upcoming_order=data["upcoming_order"]),
+    }
+
+def dashboard_delta(old, new):
+    """What changed from snapshot ``old`` to ``new`` (everything, if ``old`` is empty)."""
+    delta = {}
+    metrics = {name: value for name, value in new["metrics"].items() if old.get("metrics", {}).get(name) != value}
+    if metrics:
+        delta["metrics"] = metrics
+    for key in ("recent", "recent_orders"):
+        before = dict(old.get(key, []))
+        ids = [row_id for row_id, _ in new[key]]
+        rows = {row_id: html for row_id, html in new[key] if before.get(row_id) != html}
+        if rows or ids != list(before):
+            delta[key] = {"ids": ids, "rows": rows}
+    if new["upcoming"] != old.get("upcoming"):
+        delta["upcoming"] = new["upcoming"]
+    return delta
+
+class DashboardPublisher:
+    """Recomputes the dashboard on writes and fans deltas out to subscriber queues."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._subscribers = set()
+        self._thread = None
+        self._snapshot = None
+        self._seq = None
+        self._version = 0
+
+    def subscribe(self):
+        subscription = queue.Queue(maxsize=100)
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="dashboard-publisher", daemon=True)
+                self._thread.start()
+            self._subscribers.add(subscription)
+            if self._snapshot is not None:
+                subscription.put(self._event(dashboard_delta({}, self._snapshot)))
+        self._wake.set()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+            if not self._subscribers:
+                self._snapshot = None  # nobody watching: don't serve a stale one to the next tab
+
+    def notify(self):
+        self._wake.set()
+
+    def refresh(self):
+        """Recompute if the change feed moved; broadcast and return the delta (None if unchanged)."""
+        with self._refresh_lock:
+            # a request context, so the row partials can use url_for
+            with app.test_request_context("/dashboard"):
+                seq = db.session.scalar(db.select(db.func.max(ChangeLog.seq)))
+                if self._snapshot is not None and seq == self._seq:
+                    return None
+                snapshot = dashboard_snapshot()
+            with self._lock:
+                delta = dashboard_delta(self._snapshot or {}, snapshot)
+                self._snapshot, self._seq = snapshot, seq
+                if delta:
+                    self._broadcast(self._event(delta), snapshot)
+            return delta
+
+    def _event(self, delta):
+        self._version += 1
+        return f"event: dashboard\nid: {self._version}\ndata: {json.dumps(delta)}\n\n"
+
+    def _broadcast(self, event, snapshot):
+        for subscription in self._subscribers:
+            try:
+                subscription.put_nowait(event)
+            except queue.Full:  # a stalled tab: replace its backlog with the full state
+                while not subscription.empty():
+                    subscription.get_nowait()
+                subscription.put_nowait(self._event(dashboard_delta({}, snapshot)))
+
+    def _run(self):
+        while True:
+            self._wake.wait(DASHBOARD_POLL_SECONDS)
+            self._wake.clear()
+            time.sleep(DASHBOARD_DEBOUNCE_SECONDS)
+            with self._lock:
+                if not self._subscribers:
+                    continue
+            try:
+                self.refresh()
+            except Exception:
+                app.logger.exception("dashboard refresh failed")
+
+dashboard_publisher = DashboardPublisher()
+
+@event.listens_for(Session, "after_commit")
+def publish_committed_changes(session):
+    if session.info.pop("changed", False):
+        dashboard_publisher.notify()
+
+@event.listens_for(Session, "after_rollback")
+def discard_rolled_back_changes(session):
+    session.info.pop("changed", None)
+
+@app.route("/dashboard/stream")
+def dashboard_stream():
+    """Server-Sent Events: a "dashboard" event with the full state, then deltas as data changes."""
+    subscription = dashboard_publisher.subscribe()
+
+    def generate():
+        try:
+            yield "retry: 3000\n\n"
+            deadline = time.monotonic() + DASHBOARD_STREAM_SECONDS
+            while time.monotonic() < deadline:
+                try:
+                    yield subscription.get(timeout=DASHBOARD_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+        finally:
+            dashboard_publisher.unsubscribe(subscription)
+
+    return Response(generate(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# ------------------- Bulk actions ---------------------
+# Multi-select actions run as one set-based UPDATE/DELETE per request, inside a
+# single transaction. They bypass the ORM, so they log to the change feed and
+# drop cached customer summaries themselves; files are queued for removal
+# after commit.
+
+WORKORDER_STATUSES = ("New", "In Progress", "Closed")
+WORKORDER_PRIORITIES = ("Low", "Medium", "High")
+
+def bulk_ids():
+    return [int(i) for i in request.form.getlist("ids") if i.isdigit()]
+
+def bulk_action():
+    """Split the submitted ``action`` into (name, value), e.g. "status:In Progress"."""
+    action, _, value = request.form.get("action", "").partition(":")
+    return action, value
+
+def bulk_update(model, where, values):
+    log_bulk_changes(model.__table__, "update", where, values)
+    return db.session.execute(model.__table__.update().where(where).values(**values)).rowcount
+
+def bulk_delete(model, where, file_column=None):
+    """Delete matching rows; returns (count, attached file paths to remove after commit)."""
+    paths = []
+    if file_column is not None:
+        paths = [p for (p,) in db.session.execute(db.select(file_column).where(where, file_column.isnot(None)))]
+    log_bulk_changes(model.__table__, "delete", where)
+    count = db.session.execute(model.__table__.delete().where(where)).rowcount
+    return count, paths
+
+def customer_exists(value):
+    return value.isdigit() and db.session.get(Customer, int(value)) is not None
+
+@app.route("/workorders/bulk", methods=["POST"])
+def bulk_workorders():
+    ids = bulk_ids()
+    action, value = bulk_action()
+    if not ids:
+        flash("No work orders selected.", "warning")
+        return redirect(url_for("workorders"))
+
+    where = WorkOrder.id.in_(ids)
+    paths = []
+    if action == "close":
+        count = bulk_update(WorkOrder, where, {"status": "Closed"})
+    elif action == "status" and value in WORKORDER_STATUSES:
+        count = bulk_update(WorkOrder, where, {"status": value})
+    elif action == "priority" and value in WORKORDER_PRIORITIES:
+        count = bulk_update(WorkOrder, where, {"priority": value})
+    elif action == "reassign" and customer_exists(value):
+        count = bulk_update(WorkOrder, where, {"customer_id": int(value)})
+    elif action == "delete":
+        count, paths = bulk_delete(WorkOrder, where, WorkOrder.file_path)
+    else:
+        flash("Unknown bulk action.", "warning")
+        return redirect(url_for("workorders"))
+
+    db.session.commit()
+    invalidate_customer_summaries()
+    queue_file_removal(paths)
+    flash(f"{count} work orders updated." if action != "delete" else f"{count} work orders deleted!",
+          "success" if action != "delete" else "danger")
+    return redirect(url_for("workorders"))
+
+@app.route("/transactions/bulk", methods=["POST"])
+def bulk_transactions():
+    ids = bulk_ids()
+    action, value = bulk_action()
+    if not ids:
+        flash("No transactions selected.", "warning")
+        return redirect(url_for("transactions"))
+
+    where = Transaction.id.in_(ids)
+    bookings = payment_bookings(where)  # before a delete takes the links with it
+    paths = []
+    if action == "mark_paid":
+        count = bulk_update(Transaction, db.and_(where, Transaction.status != "Paid"), {"status": "Paid"})
+    elif action == "mark_pending":
+        count = bulk_update(Transaction, db.and_(where, Transaction.status != "Pending"), {"status": "Pending"})
+    elif action == "delete":
+        count, paths = bulk_delete(Transaction, where, Transaction.receipt_path)
+    else:
+        flash("Unknown bulk action.", "warning")
+        return redirect(url_for("transactions"))
+
+    sync_booking_status(bookings)
+    db.session.commit()
+    if bookings:
+        invalidate_customer_summaries()  # paid totals follow booking payments
+    queue_file_removal(paths)
+    flash(f"{count} transactions updated." if action != "delete" else f"{count} transactions deleted!",
+          "success" if action != "delete" else "danger")
+    return redirect(url_for("transactions"))
+
+def log_booking_income(where):
+    """Insert a paid income Transaction for the outstanding balance of each matching
+    booking (skipping settled ones), linked like record_booking_payment() does.
+
+    One INSERT ... SELECT; the new rows are added to the change feed.
+    """
+    today, now = datetime.utcnow().date(), datetime.utcnow()
+    outstanding = Booking.expected_income - booking_paid_subquery()
+    source = db.select(
+        db.literal("Income"), db.literal("Booking"), Customer.name,
+        BookingType.name + " Booking", outstanding,
+        db.literal("Paid"), db.literal(today), db.literal(now), Booking.customer_id, Booking.id,
+    ).select_from(Booking).join(Customer, Booking.customer_id == Customer.id)\
+     .join(BookingType, Booking.booking_type_id == BookingType.id).where(where, outstanding > 0.005)
+    new_ids = db.session.execute(Transaction.__table__.insert().from_select(
+        ["type", "category", "party", "description", "amount", "status", "date", "created_at",
+         "customer_id", "booking_id"], source
+    ).returning(Transaction.__table__.c.id)).scalars().all()
+    if new_ids:
+        log_bulk_changes(Transaction.__table__, "insert", Transaction.id.in_(new_ids))
+    return len(new_ids)
+
+@app.route("/bookings/bulk", methods=["POST"])
+def bulk_bookings():
+    ids = bulk_ids()
+    action, value = bulk_action()
+    if not ids:
+        flash("No bookings selected.", "warning")
+        return redirect(url_for("bookings"))
+
+    where = Booking.id.in_(ids)
+    if action == "mark_paid":
+        unpaid = db.and_(where, Booking.paid_status != "Paid")
+        logged = log_booking_income(unpaid)
+        count = bulk_update(Booking, unpaid, {"paid_status": "Paid"})
+        message = f"{count} bookings marked Paid, {logged} payments logged for their outstanding balances."
+    elif action == "sync_status":
+        count = sync_booking_status(ids)
+        message = f"{count} booking statuses corrected from their payments."
+    elif action == "reassign" and customer_exists(value):
+        count = bulk_update(Booking, where, {"customer_id": int(value)})
+        message = f"{count} bookings reassigned."
+    elif action == "delete":
+        count = delete_bookings(where)
+        message = f"{count} bookings deleted!"
+    else:
+        flash("Unknown bulk action.", "warning")
+        return redirect(url_for("bookings"))
+
+    db.session.commit()
+    invalidate_customer_summaries()
+    flash(message, "danger" if action == "delete" else "success")
+    return redirect(url_for("bookings"))
+
+# ------------------- Deletes ---------------------
+# Deleting a customer removes its invoices (and their items), work orders and
+# bookings with one set-based DELETE per table in dependency order, so no ORM
+# objects are loaded. The models declare matching ON DELETE rules (CASCADE for
+# owned rows, SET NULL for booking links, RESTRICT for booking types) as a
+# backstop; the explicit statements keep the change feed complete and also
+# work on databases created before those rules existed. Attached files are
+# removed by a background thread once the transaction has committed.
+
+file_cleanup = queue.Queue()
+_file_cleanup_thread = None
+_file_cleanup_lock = threading.Lock()
+
+def remove_files(paths):
+    for path in paths:
+        if path and os.path.exists(path):
+            try:
+                os.remove(path)
+            except Exception:
+                pass
+
+def _file_cleanup_worker():
+    while True:
+        path = file_cleanup.get()
+        try:
+            remove_files([path])
+        finally:
+            file_cleanup.task_done()
+
+def queue_file_removal(paths):
+    """Remove ``paths`` in the background; call after the deleting commit."""
+    global _file_cleanup_thread
+    paths = [p for p in paths if p]
+    if not paths:
+        return
+    with _file_cleanup_lock:
+        if _file_cleanup_thread is None:
+            _file_cleanup_thread = threading.Thread(target=_file_cleanup_worker, name="file-cleanup", daemon=True)
+            _file_cleanup_thread.start()
+    for path in paths:
+        file_cleanup.put(path)
+
+def invoice_pdf_path(invoice_id):
+    return os.path.join(app.config['UPLOAD_FOLDER'], f"invoice_{invoice_id}.pdf")
+
+def unlink_payments(column, matching):
+    """Clear a transaction link (hot and archived) to rows about to be deleted.
+
+    Done explicitly rather than left to ON DELETE SET NULL: databases that
+    gained these columns by ALTER have no foreign key, and the constraint's
+    updates wouldn't reach change_log.
+    """
+    bulk_update(Transaction, Transaction.__table__.c[column].in_(matching), {column: None})
+    db.session.execute(archived_transactions.update().where(archived_transactions.c[column].in_(matching))
+                       .values({column: None}))
+
+def delete_invoices(where):
+    """Delete matching invoices and their items; returns (count, cached PDF paths)."""
+    ids = db.session.execute(db.select(Invoice.id).where(where)).scalars().all()
+    if not ids:
+        return 0, []
+    matching = db.select(Invoice.id).where(where).scalar_subquery()
+    unlink_payments("invoice_id", matching)
+    bulk_delete(InvoiceItem, InvoiceItem.invoice_id.in_(matching))
+    count, _ = bulk_delete(Invoice, where)
+    return count, [invoice_pdf_path(i) for i in ids]
+
+def delete_bookings(where):
+    """Delete matching bookings; their work orders, invoices and payments are kept, unlinked."""
+    matching = db.select(Booking.id).where(where).scalar_subquery()
+    for model in (WorkOrder, Invoice):
+        bulk_update(model, model.booking_id.in_(matching), {"booking_id": None})
+    unlink_payments("booking_id", matching)
+    count, _ = bulk_delete(Booking, where)
+    return count
+
+def delete_customer_graph(customer_id):
+    """Delete a customer with its invoices, work orders and bookings.
+
+    Returns ({"bookings": n, "workorders": n, "invoices": n}, file paths to queue
+    for removal after commit).
+    """
+    unlink_payments("customer_id", [customer_id])
+    invoices, paths = delete_invoices(Invoice.customer_id == customer_id)
+    workorders, files = bulk_delete(WorkOrder, WorkOrder.customer_id == customer_id, WorkOrder.file_path)
+    bookings = delete_bookings(Booking.customer_id == customer_id)
+    bulk_delete(Customer, Customer.id == customer_id)
+    return {"bookings": bookings, "workorders": workorders, "invoices": invoices}, paths + files
+
+# ------------------- Uploads ---------------------
+# Work order files and large receipts are sent in chunks. POST /api/uploads
+# opens an upload; each PATCH carries one chunk at its Upload-Offset, copied
+# from the request stream in small blocks straight into a .part file, so
+# memory stays flat whatever the file size; GET returns the offset to resume
+# from after a dropped connection. Each request is short, so a slow client
+# never holds a worker for the whole transfer. A PATCH holds an exclusive
+# lock on the .part file from its offset check to its commit, so concurrent
+# PATCHes to one upload (a retry racing the original, two tabs) get 409
+# instead of interleaving writes. Chunks can carry their own SHA-256
+# (X-Chunk-SHA256). Once the last chunk is in, the finished file is hashed,
+# checked and attached on a background thread (the final PATCH answers 202;
+# clients poll GET until "complete"), so no request spends minutes hashing
+# gigabytes. Downloads use send_file(conditional=True), which answers Range
+# requests with 206 Partial Content.
+
+UPLOAD_TARGETS = {"workorder": (WorkOrder, "file_path", "WORKORDER_FOLDER"),
+                  "receipt": (Transaction, "receipt_path", "UPLOAD_FOLDER")}
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_MB", 8)) * 1024 * 1024
+UPLOAD_MAX_SIZE = int(os.environ.get("UPLOAD_MAX_MB", 4096)) * 1024 * 1024
+UPLOAD_EXPIRY = timedelta(hours=int(os.environ.get("UPLOAD_EXPIRY_HOURS", 24)))
+UPLOAD_VERIFY_GRACE = timedelta(minutes=10)  # a check not done by then is re-queued (its worker died)
+COPY_BLOCK = 64 * 1024
+SHA256_HEX = re.compile(r"[0-9a-f]{64}")
+
+upload_jobs = queue.Queue()
+_upload_thread = None
+_upload_thread_lock = threading.Lock()
+
+def unique_path(folder, filename):
+    """``folder/filename`` (sanitised), with _1, _2... added if the name is taken."""
+    os.makedirs(folder, exist_ok=True)
+    base, ext = os.path.splitext(secure_filename(filename) or "file")
+    path, counter = os.path.join(folder, base + ext), 1
+    while os.path.exists(path):
+        path = os.path.join(folder, f"{base}_{counter}{ext}")
+        counter += 1
+    return path
+
+def upload_part_path(upload_id):
+    return os.path.join(app.config['UPLOAD_TMP_FOLDER'], f"{upload_id}.part")
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+@contextmanager
+def upload_lock(part, wait=False):
+    """Open ``part`` for writing under an exclusive lock (across threads and
+    worker processes); yields None if the finished file has already been
+    moved out, or (unless ``wait``) if another request holds the lock."""
+    try:
+        f = open(part, "r+b")
+    except FileNotFoundError:
+        yield None
+        return
+    with f:
+        if fcntl is not None:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield None
+                return
+        yield f  # closing the file releases the lock
+
+def upload_state(upload, **extra):
+    state = {"id": upload.id, "offset": upload.received, "size": upload.size,
+             "chunk_size": UPLOAD_CHUNK_SIZE, "complete": upload.path is not None,
+             "verifying": upload.path is None and upload.received == upload.size}
+    if upload.error:
+        state["error"] = upload.error
+    if upload.path:
+        state["sha256"] = upload.sha256
+        state["url"] = (url_for("workorder_file", workorder_id=upload.target_id) if upload.target == "workorder"
+                        else url_for("transaction_receipt", transaction_id=upload.target_id))
+    state.update(extra)
+    return state
+
+def set_upload_offset(upload, offset, expected=None):
+    """Move ``received`` to ``offset``; with ``expected``, only if nobody else moved it first."""
+    where = Upload.id == upload.id
+    if expected is not None:
+        where = where & (Upload.received == expected)
+    return db.session.execute(
+        Upload.__table__.update().where(where).values(received=offset, updated_at=datetime.utcnow())
+    ).rowcount
+
+def expire_uploads():
+    """Drop uploads untouched for UPLOAD_EXPIRY; returns the .part files to remove after commit."""
+    stale = db.session.query(Upload.id, Upload.path).filter(Upload.updated_at < datetime.utcnow() - UPLOAD_EXPIRY).all()
+    if stale:
+        db.session.execute(Upload.__table__.delete().where(Upload.id.in_([u.id for u in stale])))
+    return [upload_part_path(u.id) for u in stale if u.path is None]
+
+def finish_upload(upload_id):
+    """Hash a fully received upload, check it against the declared sha256 and attach it."""
+    upload = db.session.get(Upload, upload_id)
+    if upload is None:
+        return
+    part = upload_part_path(upload.id)
+    # wait out a PATCH bounced off the finished upload, or a re-queued check
+    with upload_lock(part, wait=True) as f:
+        if f is None:  # already moved into place
+            return
+        db.session.refresh(upload)
+        if upload.path is not None or upload.received != upload.size:
+            return
+        digest = file_sha256(part)
+        if upload.sha256 and digest != upload.sha256:
+            f.truncate(0)
+            upload.received, upload.error = 0, "file checksum mismatch, upload restarted"
+            upload.updated_at = datetime.utcnow()
+            db.session.commit()
+            return
+
+        model, column, folder = UPLOAD_TARGETS[upload.target]
+        target = db.session.get(model, upload.target_id)
+        if target is None:  # deleted while the upload was running
+            db.session.delete(upload)
+            db.session.commit()
+            queue_file_removal([part])
+            return
+        path = unique_path(app.config[folder], upload.filename)
+        shutil.move(part, path)
+    replaced = getattr(target, column)
+    setattr(target, column, path)
+    upload.path, upload.sha256, upload.error = path, digest, None
+    db.session.commit()
+    queue_file_removal([replaced])
+
+def _upload_worker():
+    while True:
+        upload_id = upload_jobs.get()
+        try:
+            with app.app_context():
+                finish_upload(upload_id)
+        except Exception:
+            app.logger.exception("finishing upload %s failed", upload_id)
+        finally:
+            upload_jobs.task_done()
+
+def queue_upload_finish(upload_id):
+    """Check and attach upload ``upload_id`` in the background; call after its last chunk is committed."""
+    global _upload_thread
+    with _upload_thread_lock:
+        if _upload_thread is None:
+            _upload_thread = threading.Thread(target=_upload_worker, name="uploads", daemon=True)
+            _upload_thread.start()
+    upload_jobs.put(upload_id)
+
+@app.route("/api/uploads", methods=["POST"])
+def create_upload():
+    """Open an upload. JSON body: target (workorder | receipt), target_id, filename, size, optional sha256."""
+    data = request.get_json(silent=True) or {}
+    size, filename, sha256 = data.get("size"), data.get("filename"), data.get("sha256")
+    if data.get("target") not in UPLOAD_TARGETS or not isinstance(size, int) or not filename:
+        return {"error": "target, target_id, filename and size are required"}, 400
+    if not isinstance(data.get("target_id"), int) or isinstance(data["target_id"], bool):
+        return {"error": "target_id must be an integer"}, 400
+    if not 0 < size <= UPLOAD_MAX_SIZE:
+        return {"error": f"size must be between 1 and {UPLOAD_MAX_SIZE} bytes"}, 413
+    if data["target"] == "receipt" and not allowed_file(filename):
+        return {"error": "receipts must be " + ", ".join(sorted(ALLOWED_EXTENSIONS))}, 400
+    if sha256 is not None and not SHA256_HEX.fullmatch(str(sha256)):
+        return {"error": "sha256 must be a lowercase hex digest"}, 400
+    db.get_or_404(UPLOAD_TARGETS[data["target"]][0], data["target_id"])
+
+    stale = expire_uploads()
+    upload = Upload(id=uuid.uuid4().hex, target=data["target"], target_id=data["target_id"],
+                    filename=filename, size=size, sha256=sha256)
+    os.makedirs(app.config['UPLOAD_TMP_FOLDER'], exist_ok=True)
+    open(upload_part_path(upload.id), "wb").close()
+    db.session.add(upload)
+    db.session.commit()
+    queue_file_removal(stale)
+    return upload_state(upload), 201, {"Location": url_for("upload_status", upload_id=upload.id)}
+
+@app.route("/api/uploads/<upload_id>")
+def upload_status(upload_id):
+    upload = db.get_or_404(Upload, upload_id)
+    if upload.path is None and upload.received == upload.size \
+            and upload.updated_at < datetime.utcnow() - UPLOAD_VERIFY_GRACE:
+        queue_upload_finish(upload.id)  # the worker that was checking it went away
+    return upload_state(upload)
+
+@app.route("/api/uploads/<upload_id>", methods=["PATCH"])
+def upload_chunk(upload_id):
+    """Write the request body at the Upload-Offset header; 409 carries the offset to resume from.
+
+    The last chunk answers 202: poll GET until "complete" while the file is checked.
+    """
+    upload = db.get_or_404(Upload, upload_id)
+    with upload_lock(upload_part_path(upload.id)) as f:
+        db.session.refresh(upload)  # as of taking the lock
+        if f is None and upload.path is None:
+            return upload_state(upload, error="another request is writing this upload"), 409
+        offset = request.headers.get("Upload-Offset", type=int)
+        length = request.content_length
+        if upload.path is not None or upload.received == upload.size:
+            return upload_state(upload, error="upload already complete"), 409
+        if offset != upload.received:
+            return upload_state(upload, error="offset mismatch"), 409
+        if length is None:
+            return upload_state(upload, error="Content-Length required"), 411
+        if length > UPLOAD_CHUNK_SIZE or offset + length > upload.size:
+            return upload_state(upload, error="chunk too large"), 413
+
+        digest, written = hashlib.sha256(), 0
+        f.seek(offset)
+        while written < length:
+            block = request.stream.read(min(COPY_BLOCK, length - written))
+            if not block:
+                break
+            f.write(block)
+            digest.update(block)
+            written += len(block)
+        expected = request.headers.get("X-Chunk-SHA256", "").lower()
+        if written < length or (expected and digest.hexdigest() != expected):
+            f.truncate(offset)
+            error = "chunk checksum mismatch" if written == length else "chunk incomplete"
+            return upload_state(upload, error=error), 422 if written == length else 400
+        f.truncate()
+
+        # the lock already serialises writers; the conditional update still guards
+        # against platforms without flock
+        if not set_upload_offset(upload, offset + length, expected=offset):
+            db.session.rollback()
+            return upload_state(db.session.get(Upload, upload.id), error="offset mismatch"), 409
+        upload.error = None
+        db.session.commit()
+    if upload.received == upload.size:
+        queue_upload_finish(upload.id)
+        return upload_state(upload), 202
+    return upload_state(upload)
+
+@app.route("/api/uploads/<upload_id>", methods=["DELETE"])
+def cancel_upload(upload_id):
+    upload = db.get_or_404(Upload, upload_id)
+    if upload.path is not None or upload.received == upload.size:
+        return upload_state(upload, error="upload already complete"), 409
+    db.session.delete(upload)
+    db.session.commit()
+    queue_file_removal([upload_part_path(upload_id)])
+    return "", 204
+
+def send_stored_file(table, archived, column, row_id):
+    path = db.session.scalar(db.select(table.c[column]).where(table.c.id == row_id))
+    if path is None:  # archived rows keep their files
+        path = db.session.scalar(db.select(archived.c[column]).where(archived.c.id == row_id))
+    if not path or not os.path.exists(path):
+        abort(404)
+    # relative paths are resolved against the cwd the file was written from, not the app root
+    return send_file(os.path.abspath(path), conditional=True, download_name=os.path.basename(path))
+
+@app.route("/workorders/<int:workorder_id>/file")
+def workorder_file(workorder_id):
+    return send_stored_file(WorkOrder.__table__, archived_workorders, "file_path", workorder_id)
+
+@app.route("/transactions/<int:transaction_id>/receipt")
+def transaction_receipt(transaction_id):
+    return send_stored_file(Transaction.__table__, archived_transactions, "receipt_path", transaction_id)
+
+# ------------------- Payments & reconciliation ---------------------
+# Income transactions carry nullable customer_id / booking_id / invoice_id
+# links. Balances are expected income (bookings) or totals (invoices) minus
+# linked paid income, hot and archived, computed in one grouped query; a
+# booking's Paid/Partial status follows from its balance when a payment is
+# recorded. Rows logged before the links existed are matched up by the
+# backfill-transaction-links job.
+
+def _paid_income(table):
+    return db.and_(table.c.type == "Income", table.c.status == "Paid")
+
+def booking_paid_subquery():
+    """Correlated scalar: paid income linked to the enclosing query's Booking."""
+    total = db.literal(0.0)
+    for table in (Transaction.__table__, archived_transactions):
+        total = total + db.select(db.func.coalesce(db.func.sum(table.c.amount), 0.0))\
+            .where(_paid_income(table), table.c.booking_id == Booking.id).scalar_subquery()
+    return total
+
+def outstanding_balances(booking_ids=None, invoice_ids=None):
+    """``{"booking": {id: balance}, "invoice": {id: balance}}`` with balance
+    ``{"due", "paid", "outstanding"}``, from one grouped query.
+
+    ``None`` covers every booking/invoice; a list restricts to those ids.
+    """
+    arms = []
+    for table in (Transaction.__table__, archived_transactions):
+        linked = []
+        if booking_ids is None:
+            linked.append(table.c.booking_id.isnot(None))
+        elif booking_ids:
+            linked.append(table.c.booking_id.in_(booking_ids))
+        if invoice_ids is None:
+            linked.append(table.c.invoice_id.isnot(None))
+        elif invoice_ids:
+            linked.append(table.c.invoice_id.in_(invoice_ids))
+        if linked:
+            arms.append(db.select(table.c.booking_id, table.c.invoice_id, table.c.amount)
+                        .where(_paid_income(table), db.or_(*linked)))
+    if not arms:
+        return {"booking": {}, "invoice": {}}
+    payments = db.union_all(*arms).subquery("payments")
+    paid = db.func.coalesce(db.func.sum(payments.c.amount), 0.0)
+
+    parts = []
+    for kind, model, due, ids in (
+        ("booking", Booking, Booking.expected_income, booking_ids),
+        ("invoice", Invoice, Invoice.total, invoice_ids),
+    ):
+        if ids is not None and not ids:
+            continue
+        key = payments.c.booking_id if kind == "booking" else payments.c.invoice_id
+        part = db.select(
+            db.literal_column(f"'{kind}'").label("kind"), model.id, db.func.coalesce(due, 0.0).label("due"),
+            paid.label("paid"),
+        ).select_from(model).outerjoin(payments, key == model.id).group_by(model.id, due)
+        if ids is not None:
+            part = part.where(model.id.in_(ids))
+        parts.append(part)
+
+    balances = {"booking": {}, "invoice": {}}
+    for kind, id_, due, paid_total in db.session.execute(db.union_all(*parts)):
+        balances[kind][id_] = {
+            "due": round(due, 2), "paid": round(paid_total, 2), "outstanding": round(max(due - paid_total, 0.0), 2),
+        }
+    return balances
+
+def booking_status(balance):
+    """The paid_status a booking's balance (from outstanding_balances) implies."""
+    if balance["paid"] <= 0:
+        return "Pending"
+    return "Paid" if balance["outstanding"] <= 0 else "Partial"
+
+def sync_booking_status(booking_ids):
+    """Set paid_status from recorded payments for ``booking_ids``; returns how many changed."""
+    by_status = {}
+    for booking_id, balance in outstanding_balances(booking_ids=booking_ids, invoice_ids=[])["booking"].items():
+        by_status.setdefault(booking_status(balance), []).append(booking_id)
+    return sum(
+        bulk_update(Booking, db.and_(Booking.id.in_(ids), Booking.paid_status.is_distinct_from(status)),
+                    {"paid_status": status})
+        for status, ids in by_status.items()
+    )
+
+def payment_bookings(where):
+    """Booking ids the transactions matching ``where`` are paying towards."""
+    return list(set(db.session.scalars(
+        db.select(Transaction.booking_id).where(where, Transaction.booking_id.is_not(None))
+    )))
+
+def record_booking_payment(booking, amount, description, date=None):
+    """Log a paid income transaction against ``booking`` and update its paid_status."""
+    txn = Transaction(
+        type="Income", category="Booking", party=booking.customer.name, description=description,
+        amount=amount, status="Paid", date=date or datetime.utcnow().date(),
+        customer_id=booking.customer_id, booking_id=booking.id,
+    )
+    db.session.add(txn)
+    balance = outstanding_balances(booking_ids=[booking.id], invoice_ids=[])["booking"][booking.id]
+    booking.paid_status = booking_status(balance)
+    return txn
+
+@app.route("/bookings/<int:booking_id>/payments", methods=["POST"])
+def add_booking_payment(booking_id):
+    booking = Booking.query.get_or_404(booking_id)
+    amount = float(request.form.get("amount", 0) or 0)
+    if amount <= 0:
+        flash("Enter a payment amount.", "warning")
+        return redirect(url_for("view_booking", booking_id=booking.id))
+    date_str = request.form.get("date")
+    date = datetime.strptime(date_str, "%Y-%m-%d").date() if date_str else None
+    record_booking_payment(booking, amount, f"{booking.booking_type} Booking Payment", date)
+    db.session.commit()
+    flash(f"Payment of ${amount:.2f} recorded; booking is {booking.paid_status}.", "success")
+    return redirect(url_for("view_booking", booking_id=booking.id))
+
+def normalize_party(name):
+    """Lower-case, punctuation-free, single-spaced form of a party/customer name."""
+    return " ".join(re.sub(r"[^\w\s]", " ", (name or "").lower()).split())
+
+def _cents(amount):
+    return int(round((amount or 0) * 100))
+
+def _nearest(candidates, day, window_days):
+    """The single (id, date) candidate closest to ``day`` within the window, else None."""
+    ranked = sorted((abs((d - day).days), i) for i, d in candidates if abs((d - day).days) <= window_days)
+    if not ranked or (len(ranked) > 1 and ranked[0][0] == ranked[1][0]):
+        return None
+    return ranked[0][1]
+
+def backfill_transaction_links(window_days=3, batch_size=500, dry_run=False):
+    """Link existing unlinked income transactions to customers, bookings and invoices.
+
+    The small side (customers, bookings, invoices) is loaded into dicts keyed by
+    normalized name and amount, and transactions stream past them — a hash join.
+    Bookings match on customer + expected income (or a partial payment) within
+    ``window_days`` of the booking being created; invoices on customer + total,
+    paid on or after creation. Ambiguous matches are left alone. Returns counts.
+    """
+    stats = Counter()
+    customers = {}
+    for id_, name in db.session.execute(db.select(Customer.id, Customer.name)):
+        customers.setdefault(normalize_party(name), []).append(id_)
+
+    bookings = {}
+    for id_, customer_id, expected, created in db.session.execute(
+        db.select(Booking.id, Booking.customer_id, Booking.expected_income, Booking.created_at)
+    ):
+        bookings.setdefault(customer_id, []).append((id_, _cents(expected), (created or datetime.utcnow()).date()))
+
+    invoices = {}
+    for id_, customer_id, total, created in db.session.execute(
+        db.select(Invoice.id, Invoice.customer_id, Invoice.total, Invoice.created_at)
+    ):
+        invoices.setdefault((customer_id, _cents(total)), []).append((id_, (created or datetime.utcnow()).date()))
+
+    claimed_invoices, claimed_bookings = set(), set()
+    updates = []
+    txns = db.session.execute(
+        db.select(Transaction.id, Transaction.party, Transaction.amount, Transaction.date, Transaction.category,
+                  Transaction.description, Transaction.customer_id)
+        .where(Transaction.type == "Income", Transaction.booking_id.is_(None), Transaction.invoice_id.is_(None))
+        .order_by(Transaction.id).execution_options(yield_per=batch_size)
+    )
+    for id_, party, amount, day, category, description, customer_id in txns:
+        stats["scanned"] += 1
+        if customer_id is None:
+            matches = customers.get(normalize_party(party), [])
+            if len(matches) != 1:
+                stats["ambiguous" if matches else "unmatched"] += 1
+                continue
+            customer_id = matches[0]
+        link = {"customer_id": customer_id, "booking_id": None, "invoice_id": None}
+        cents = _cents(amount)
+        partial = "partial" in (description or "").lower()
+
+        if category == "Invoice":
+            candidates = [(i, d) for i, d in invoices.get((customer_id, cents), [])
+                          if d <= day and i not in claimed_invoices]
+            invoice_id = _nearest(candidates, day, window_days=36500)
+            if invoice_id:
+                link["invoice_id"] = invoice_id
+                claimed_invoices.add(invoice_id)
+        elif category == "Booking":
+            candidates = [(i, d) for i, expected, d in bookings.get(customer_id, [])
+                          if (cents == expected and i not in claimed_bookings) or (partial and cents < expected)]
+            booking_id = _nearest(candidates, day, window_days)
+            if booking_id:
+                link["booking_id"] = booking_id
+                if not partial:
+                    claimed_bookings.add(booking_id)
+
+        for key in ("customer", "booking", "invoice"):
+            if link[f"{key}_id"]:
+                stats[key] += 1
+        updates.append({"_id": id_, **link})
+        if len(updates) >= batch_size:
+            _apply_links(updates, dry_run)
+            updates = []
+    _apply_links(updates, dry_run)
+
+    if dry_run:
+        db.session.rollback()
+    else:
+        db.session.commit()
+    return stats
+
+def _apply_links(updates, dry_run):
+    if not updates or dry_run:
+        return
+    table = Transaction.__table__
+    db.session.execute(
+        table.update().where(table.c.id == db.bindparam("_id")).values(
+            customer_id=db.bindparam("customer_id"), booking_id=db.bindparam("booking_id"),
+            invoice_id=db.bindparam("invoice_id"),
+        ),
+        updates,
+    )
+    now = datetime.utcnow()
+    db.session.execute(ChangeLog.__table__.insert(), [{
+        "table_name": table.name, "row_id": u["_id"], "op": "update", "created_at": now,
+        "fields": {k: v for k, v in u.items() if k != "_id" and v is not None},
+    } for u in updates])
+
+@app.cli.command("backfill-transaction-links")
+@click.option("--window-days", default=3, show_default=True,
+              help="How far a booking payment's date may be from the booking's creation.")
+@click.option("--dry-run", is_flag=True, help="Report what would be linked without writing.")
+def backfill_transaction_links_command(window_days, dry_run):
+    """Link existing income transactions to their customers, bookings and invoices."""
+    stats = backfill_transaction_links(window_days=window_days, dry_run=dry_run)
+    click.echo(
+        f"{stats['scanned']} unlinked income transactions: {stats['customer']} linked to customers, "
+        f"{stats['booking']} to bookings, {stats['invoice']} to invoices; "
+        f"{stats['ambiguous']} ambiguous, {stats['unmatched']} without a matching customer."
+        + (" (dry run)" if dry_run else "")
+    )
+
+# ------------------- Year-end report ---------------------
+# The accountant's report lists every transaction in a date range (hot rows
+# and the archive), grouped by category with subtotals and receipt
+# thumbnails. Rows are read in keyset batches of REPORT_BATCH_SIZE along
+# (category, date, id), and the two sources are merged as they stream. They
+# become flowables lazily: FlowableStream hands ReportLab a list it refills
+# from a generator as pages are laid out, so only a few tables exist at once
+# however long the report is. Reports run on a background thread and are
+# tracked in report_job, so any worker can show their status.
+
+REPORT_BATCH_SIZE = 2000
+REPORT_TABLE_ROWS = 50  # rows per Table flowable; ReportLab splits them across pages
+REPORT_THUMBNAIL_SIZE = 96  # pixels, longest side
+THUMBNAIL_EXTENSIONS = {"png", "jpg", "jpeg", "webp"}
+
+report_jobs = queue.Queue()
+_report_thread = None
+_report_thread_lock = threading.Lock()
+
+class FlowableStream(list):
+    """Flowables pulled from ``source`` as ReportLab consumes them.
+
+    doc.build() checks len(flowables) before each one, so topping up there
+    keeps just ``buffer`` flowables (plus any split remainders) in memory.
+    """
+
+    def __init__(self, source, buffer=3):
+        super().__init__()
+        self._source = iter(source)
+        self._buffer = buffer
+
+    def __len__(self):
+        while self._source is not None and list.__len__(self) < self._buffer:
+            try:
+                self.append(next(self._source))
+            except StopIteration:
+                self._source = None
+        return list.__len__(self)
+
+def report_transactions(start, end, categories=None, batch_size=REPORT_BATCH_SIZE):
+    """Transactions (hot and archived) dated ``start``..``end``, in (category, date, id) order."""
+    def stream(table, category):
+        c = table.c
+        cursor = None
+        while True:
+            # category = ? keeps each batch an index range scan on (category, date, id)
+            query = db.select(c.id, c.date, c.type, c.category, c.party, c.description, c.amount, c.status,
+                              c.receipt_path).where(c.category == category, c.date >= start, c.date <= end)
+            if cursor is not None:
+                query = query.where(db.tuple_(c.date, c.id) > cursor)
+            rows = db.session.execute(query.order_by(c.date, c.id).limit(batch_size)).all()
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            cursor = (rows[-1].date, rows[-1].id)
+
+    for category in sorted(categories or report_categories()):
+        yield from heapq.merge(stream(Transaction.__table__, category), stream(archived_transactions, category),
+                               key=lambda row: (row.date, row.id))
+
+def receipt_thumbnail(path):
+    """A small JPEG of an image receipt (cached by path and mtime), or None."""
+    if PILImage is None or not path or path.rsplit(".", 1)[-1].lower() not in THUMBNAIL_EXTENSIONS:
+        return None
+    try:
+        key = hashlib.sha1(f"{os.path.abspath(path)}:{os.path.getmtime(path)}".encode()).hexdigest()
+        thumbnail = os.path.join(app.config['REPORT_FOLDER'], "thumbnails", key + ".jpg")
+        if not os.path.exists(thumbnail):
+            os.makedirs(os.path.dirname(thumbnail), exist_ok=True)
+            with PILImage.open(path) as image:
+                image.thumbnail((REPORT_THUMBNAIL_SIZE, REPORT_THUMBNAIL_SIZE))
+                image.convert("RGB").save(thumbnail, "JPEG", quality=70)
+        return thumbnail
+    except Exception:  # missing or unreadable receipt: list the row without it
+        return None
+
+def _report_table(rows, subtotal=None):
+    data = [["Date", "Type", "Party", "Description", "Status", "Amount", "Receipt"]] + rows
+    style = [
+        ("BACKGROUND", (0, 0), (-1, 0), colors.grey),
+        ("TEXTCOLOR", (0, 0), (-1, 0), colors.whitesmoke),
+        ("FONTSIZE", (0, 0), (-1, -1), 8),
+        ("ALIGN", (5, 0), (5, -1), "RIGHT"),
+        ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+        ("LINEBELOW", (0, 0), (-1, -1), 0.25, colors.lightgrey),
+    ]
+    if subtotal:
+        data += subtotal
+        style += [("FONTNAME", (0, -len(subtotal)), (-1, -1), "Helvetica-Bold"),
+                  ("LINEABOVE", (0, -len(subtotal)), (-1, -len(subtotal)), 1, colors.black)]
+    table = Table(data, colWidths=[55, 45, 95, 165, 45, 65, 50], repeatRows=1)
+    table.setStyle(TableStyle(style))
+    return table
+
+def year_end_flowables(rows, start, end, categories, stats):
+    """Title, one block per category (tables + subtotal), then a category summary.
+
+    ``stats["rows"]`` counts the transactions listed so far.
+    """
+    styles = getSampleStyleSheet()
+    title = f"Financial report {start:%Y-%m-%d} to {end:%Y-%m-%d}"
+    yield Paragraph(title, styles["Title"])
+    yield Paragraph("Categories: " + (", ".join(categories) if categories else "all"), styles["Normal"])
+    yield Spacer(1, 12)
+
+    summary = []
+    for category, group in groupby(rows, key=lambda row: row.category):
+        heading = Paragraph(category, styles["Heading2"])
+        heading.keepWithNext = True
+        yield heading
+        income = expense = 0.0
+        batch = []
+        for row in group:
+            if row.type == "Income":
+                income += row.amount
+            else:
+                expense += row.amount
+            thumbnail = receipt_thumbnail(row.receipt_path)
+            batch.append([
+                row.date.strftime("%Y-%m-%d"), row.type, (row.party or "")[:24], (row.description or "")[:40],
+                row.status, f"${row.amount:,.2f}",
+                Image(thumbnail, width=36, height=36, kind="proportional") if thumbnail
+                else ("file" if row.receipt_path else ""),
+            ])
+            stats["rows"] += 1
+            if len(batch) == REPORT_TABLE_ROWS:
+                yield _report_table(batch)
+                batch = []
+        yield _report_table(batch, subtotal=[
+            ["", "", "", f"{category} income", "", f"${income:,.2f}", ""],
+            ["", "", "", f"{category} expenses", "", f"${expense:,.2f}", ""],
+            ["", "", "", f"{category} net", "", f"${income - expense:,.2f}", ""],
+        ])
+        summary.append((category, income, expense))
+
+    yield PageBreak()
+    yield Paragraph("Summary by category", styles["Heading2"])
+    total_in, total_out = sum(s[1] for s in summary), sum(s[2] for s in summary)
+    table = Table([["Category", "Income", "Expenses", "Net"]] + [
+        [name, f"${income:,.2f}", f"${expense:,.2f}", f"${income - expense:,.2f}"]
+        for name, income, expense in summary + [("Total", total_in, total_out)]
+    ], colWidths=[180, 100, 100, 100], repeatRows=1)
+    table.setStyle(TableStyle([
+        ("BACKGROUND", (0, 0), (-1, 0), colors.grey),
+        ("TEXTCOLOR", (0, 0), (-1, 0), colors.whitesmoke),
+        ("ALIGN", (1, 0), (-1, -1), "RIGHT"),
+        ("FONTNAME", (0, -1), (-1, -1), "Helvetica-Bold"),
+        ("GRID", (0, 0), (-1, -1), 0.5, colors.black),
+    ]))
+    yield table
+    yield Paragraph(f"{stats['rows']} transactions.", styles["Normal"])
+
+def build_year_end_report(path, start, end, categories=None):
+    """Write the report PDF to ``path``; returns the number of transactions listed."""
+    stats = {"rows": 0}
+    flowables = year_end_flowables(report_transactions(start, end, categories), start, end, categories, stats)
+    doc = SimpleDocTemplate(path, pagesize=letter, leftMargin=36, rightMargin=36, topMargin=36, bottomMargin=36,
+                            title="Financial report")
+    doc.build(FlowableStream(flowables), onFirstPage=_report_page_number, onLaterPages=_report_page_number)
+    return stats["rows"]
+
+def _report_page_number(canvas, doc):
+    canvas.saveState()
+    canvas.setFont("Helvetica", 8)
+    canvas.drawRightString(doc.pagesize[0] - 36, 20, f"Page {doc.page}")
+    canvas.restoreState()
+
+def _param_date(value):
+    return datetime.strptime(value, "%Y-%m-%d").date() if value else None
+
+def _year_end_job(path, params):
+    return build_year_end_report(path, _param_date(params["start"]), _param_date(params["end"]),
+                                 params.get("categories") or None)
+
+# kind -> builder(path, params) returning the row count shown on /reports
+REPORT_BUILDERS = {"year_end": _year_end_job}
+
+def run_report_job(job_id):
+    job = db.session.get(ReportJob, job_id)
+    if job is None or job.status != "queued":
+        return
+    job.status = "running"
+    db.session.commit()
+    params = job.params
+    try:
+        os.makedirs(app.config['REPORT_FOLDER'], exist_ok=True)
+        path = os.path.join(app.config['REPORT_FOLDER'], f"{job.kind}_{job.id}.pdf")
+        rows = REPORT_BUILDERS[job.kind](path, params)
+        job.status, job.path, job.rows = "done", path, rows
+    except Exception as exc:
+        db.session.rollback()
+        app.logger.exception("report job %s failed", job_id)
+        job.status, job.error = "failed", str(exc)
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+
+def _report_worker():
+    while True:
+        job_id = report_jobs.get()
+        try:
+            with app.app_context():
+                run_report_job(job_id)
+        finally:
+            report_jobs.task_done()
+
+def queue_report(job_id):
+    """Generate report ``job_id`` in the background; call after the job row is committed."""
+    global _report_thread
+    with _report_thread_lock:
+        if _report_thread is None:
+            _report_thread = threading.Thread(target=_report_worker, name="reports", daemon=True)
+            _report_thread.start()
+    report_jobs.put(job_id)
+
+def distinct_values(column):
+    """Distinct non-null values of an indexed column, one index seek per value (a "skip scan")."""
+    skip = db.select(db.func.min(column).label("value")).cte("skip", recursive=True)
+    following = db.select(db.func.min(column)).where(column > skip.c.value).scalar_subquery()
+    skip = skip.union_all(db.select(following).where(skip.c.value.is_not(None)))
+    return db.session.execute(db.select(skip.c.value).where(skip.c.value.is_not(None))).scalars().all()
+
+def report_categories():
+    return sorted(set(distinct_values(Transaction.category)) | set(distinct_values(archived_transactions.c.category)))
+
+@app.route("/reports")
+def reports():
+    jobs = ReportJob.query.order_by(ReportJob.created_at.desc()).limit(20).all()
+    last_year = datetime.utcnow().year - 1
+    return render_template("reports.html", jobs=jobs, categories=report_categories(),
+                           default_start=f"{last_year}-01-01", default_end=f"{last_year}-12-31",
+                           running=any(job.status in ("queued", "running") for job in jobs))
+
+@app.route("/reports/year-end", methods=["POST"])
+def queue_year_end_report():
+    try:
+        start = datetime.strptime(request.form["start"], "%Y-%m-%d").date()
+        end = datetime.strptime(request.form["end"], "%Y-%m-%d").date()
+    except (KeyError, ValueError):
+        flash("Pick a start and end date.", "danger")
+        return redirect(url_for("reports"))
+    if end < start:
+        flash("The end date is before the start date.", "danger")
+        return redirect(url_for("reports"))
+    job = ReportJob(kind="year_end", params={
+        "start": start.isoformat(), "end": end.isoformat(), "categories": request.form.getlist("categories"),
+    })
+    db.session.add(job)
+    db.session.commit()
+    queue_report(job.id)
+    flash(f"Report #{job.id} queued; it will appear below when it's ready.", "success")
+    return redirect(url_for("reports"))
+
+@app.route("/reports/<int:job_id>/download")
+def download_report(job_id):
+    job = db.get_or_404(ReportJob, job_id)
+    if job.status != "done" or not os.path.exists(job.path):
+        abort(404)
+    if job.kind == "statements":
+        name = f"statements_{job.params['end']}.pdf"
+    else:
+        name = f"report_{job.params['start']}_{job.params['end']}.pdf"
+    return send_file(os.path.abspath(job.path), as_attachment=True, download_name=name)
+
+@app.cli.command("year-end-report")
+@click.option("--start", required=True, type=click.DateTime(formats=["%Y-%m-%d"]))
+@click.option("--end", required=True, type=click.DateTime(formats=["%Y-%m-%d"]))
+@click.option("--category", "categories", multiple=True, help="Only these categories (repeatable).")
+@click.option("--output", default="report.pdf", show_default=True)
+def year_end_report_command(start, end, categories, output):
+    """Write the transaction report for a date range to a PDF."""
+    began = time.monotonic()
+    rows = build_year_end_report(output, start.date(), end.date(), list(categories) or None)
+    click.echo(f"{rows} transactions written to {output} in {time.monotonic() - began:.1f}s.")
+
+# ------------------- Statements ---------------------
+# A customer's ledger is their invoices (debits) and the paid income recorded
+# against those invoices (credits, archive included), as one UNION ALL.
+# Booking payments settle bookings, which aren't billed through the ledger,
+# so they stay off it. Running balances are a
+# SUM() OVER (PARTITION BY customer ORDER BY date) window in the database, and
+# a second, unordered window over the same partition gives each row its
+# customer's closing balance. A statement is one query; the batch run over
+# every customer with a balance streams the same query once, filtered on the
+# closing balance, straight into ReportLab through FlowableStream.
+
+STATEMENT_BATCH_SIZE = 1000
+BALANCE_EPSILON = 0.005  # anything smaller is rounding, not money owed
+
+# ReportLab ASCII85-encodes every compressed page stream in pure Python, which
+# was a fifth of the batch's run time; plain zlib streams are valid PDF too.
+# The switch is module-global in ReportLab, so it's only flipped while a
+# statement is being built (counted, as builds can overlap) and then restored.
+_plain_streams_lock = threading.Lock()
+_plain_streams_users = 0
+_plain_streams_saved = None
+
+@contextmanager
+def plain_pdf_streams():
+    global _plain_streams_users, _plain_streams_saved
+    with _plain_streams_lock:
+        if _plain_streams_users == 0:
+            _plain_streams_saved, rl_config.useA85 = rl_config.useA85, 0
+        _plain_streams_users += 1
+    try:
+        yield
+    finally:
+        with _plain_streams_lock:
+            _plain_streams_users -= 1
+            if _plain_streams_users == 0:
+                rl_config.useA85 = _plain_streams_saved
+
+def ledger_entries(customer_id=None, end=None):
+    """One row per invoice or payment: customer_id, date, seq, kind, ref_id, memo, debit, credit."""
+    invoice_date = db.func.date(Invoice.created_at, type_=db.Date)
+    invoices = db.select(
+        Invoice.customer_id.label("customer_id"), invoice_date.label("date"), db.literal(0).label("seq"),
+        db.literal("invoice").label("kind"), Invoice.id.label("ref_id"),
+        db.literal(None, db.String).label("memo"), Invoice.total.label("debit"), db.literal(0.0).label("credit"),
+    )
+    if customer_id is not None:
+        invoices = invoices.where(Invoice.customer_id == customer_id)
+    if end is not None:
+        invoices = invoices.where(invoice_date <= end)
+    arms = [invoices]
+    for table in (Transaction.__table__, archived_transactions):
+        c = table.c
+        payments = db.select(c.customer_id, c.date, db.literal(1), db.literal("payment"), c.id, c.description,
+                             db.literal(0.0), c.amount).where(_paid_income(table), c.customer_id.is_not(None),
+                                                               c.invoice_id.is_not(None))
+        if customer_id is not None:
+            payments = payments.where(c.customer_id == customer_id)
+        if end is not None:
+            payments = payments.where(c.date <= end)
+        arms.append(payments)
+    return db.union_all(*arms).subquery("entries")
+
+def ledger_query(customer_id=None, end=None, with_balance_only=False):
+    """Ledger rows in statement order with ``balance`` (running) and ``closing`` per customer."""
+    e = ledger_entries(customer_id, end)
+    change = e.c.debit - e.c.credit
+    ledger = db.select(
+        e,
+        db.func.sum(change).over(partition_by=e.c.customer_id, order_by=(e.c.date, e.c.seq, e.c.ref_id),
+                                 rows=(None, 0)).label("balance"),
+        db.func.sum(change).over(partition_by=e.c.customer_id).label("closing"),
+    ).subquery("ledger")
+    query = db.select(ledger).order_by(ledger.c.customer_id, ledger.c.date, ledger.c.seq, ledger.c.ref_id)
+    if with_balance_only:
+        query = query.where(db.func.abs(ledger.c.closing) > BALANCE_EPSILON)
+    return query, ledger
+
+def build_statement(rows, start=None):
+    """Opening balance, the entries from ``start`` on and totals, from one customer's ledger rows."""
+    statement = {"opening": 0.0, "entries": [], "debits": 0.0, "credits": 0.0, "closing": 0.0}
+    for row in rows:
+        statement["closing"] = row.balance
+        if start is not None and row.date < start:
+            statement["opening"] = row.balance
+            continue
+        statement["entries"].append(row)
+        statement["debits"] += row.debit
+        statement["credits"] += row.credit
+    return statement
+
+def customer_statement(customer_id, start=None, end=None):
+    query, _ = ledger_query(customer_id, end)
+    return build_statement(db.session.execute(query).all(), start)
+
+def customer_balances():
+    """Customers whose ledger doesn't net to zero, largest balance first, from one GROUP BY."""
+    e = ledger_entries()
+    balance = db.func.sum(e.c.debit - e.c.credit)
+    return db.session.execute(
+        db.select(Customer.id, Customer.name, Customer.email, db.func.sum(e.c.debit).label("debits"),
+                  db.func.sum(e.c.credit).label("credits"), balance.label("balance"),
+                  db.func.max(e.c.date).label("last_entry"))
+        .join(Customer, Customer.id == e.c.customer_id)
+        .group_by(Customer.id, Customer.name, Customer.email)
+        .having(db.func.abs(balance) > BALANCE_EPSILON)
+        .order_by(balance.desc())
+    ).all()
+
+def _statement_memo(entry):
+    if entry.kind == "invoice":
+        return f"Invoice #{entry.ref_id}"
+    return "Payment" + (f" — {entry.memo}" if entry.memo else "")
+
+def statement_flowables(customer, statement, start, end, styles=None):
+    styles = styles or getSampleStyleSheet()
+    yield Paragraph(f"Statement — {customer.name}", styles["Title"])
+    period = f"{start:%Y-%m-%d} to {end:%Y-%m-%d}" if start else f"to {end:%Y-%m-%d}"
+    yield Paragraph(f"Period: {period}", styles["Normal"])
+    if customer.email:
+        yield Paragraph(f"<b>Email:</b> {customer.email}", styles["Normal"])
+    yield Spacer(1, 12)
+    data = [["Date", "Description", "Debit", "Credit", "Balance"],
+            ["", "Opening balance", "", "", f"${statement['opening']:,.2f}"]]
+    for entry in statement["entries"]:
+        data.append([
+            entry.date.strftime("%Y-%m-%d"), _statement_memo(entry)[:50],
+            f"${entry.debit:,.2f}" if entry.debit else "", f"${entry.credit:,.2f}" if entry.credit else "",
+            f"${entry.balance:,.2f}",
+        ])
+    data.append(["", "Closing balance", f"${statement['debits']:,.2f}", f"${statement['credits']:,.2f}",
+                 f"${statement['closing']:,.2f}"])
+    table = Table(data, colWidths=[65, 225, 75, 75, 80], repeatRows=1)
+    table.setStyle(TableStyle([
+        ("BACKGROUND", (0, 0), (-1, 0), colors.grey),
+        ("TEXTCOLOR", (0, 0), (-1, 0), colors.whitesmoke),
+        ("FONTSIZE", (0, 0), (-1, -1), 9),
+        ("ALIGN", (2, 0), (-1, -1), "RIGHT"),
+        ("LINEBELOW", (0, 0), (-1, -1), 0.25, colors.lightgrey),
+        ("FONTNAME", (0, -1), (-1, -1), "Helvetica-Bold"),
+        ("LINEABOVE", (0, -1), (-1, -1), 1, colors.black),
+    ]))
+    yield table
+
+def _statement_doc(target):
+    return SimpleDocTemplate(target, pagesize=letter, leftMargin=36, rightMargin=36, topMargin=36, bottomMargin=36,
+                             title="Statement")
+
+def build_statements_report(path, start, end):
+    """One statement per customer with a balance, in a single streamed pass; returns the customer count."""
+    query, ledger = ledger_query(end=end, with_balance_only=True)
+    query = query.add_columns(Customer.name, Customer.email).join(Customer, Customer.id == ledger.c.customer_id)
+    rows = db.session.execute(query.execution_options(yield_per=STATEMENT_BATCH_SIZE))
+    stats = {"customers": 0}
+    styles = getSampleStyleSheet()
+
+    def flowables():
+        for _, group in groupby(rows, key=lambda row: row.customer_id):
+            group = list(group)  # one customer's ledger
+            if stats["customers"]:
+                yield PageBreak()
+            stats["customers"] += 1
+            yield from statement_flowables(group[0], build_statement(group, start), start, end, styles)
+
+    with plain_pdf_streams():
+        _statement_doc(path).build(FlowableStream(flowables()), onFirstPage=_report_page_number,
+                                   onLaterPages=_report_page_number)
+    return stats["customers"]
+
+def _statements_job(path, params):
+    return build_statements_report(path, _param_date(params.get("start")), _param_date(params["end"]))
+
+REPORT_BUILDERS["statements"] = _statements_job
+
+def statement_period():
+    """(start, end) from the query string; no start means the customer's whole history."""
+    try:
+        start = _param_date(request.args.get("start"))
+        end = _param_date(request.args.get("end")) or datetime.utcnow().date()
+    except ValueError:
+        abort(400)
+    return start, end
+
+@app.route("/statements")
+def statements():
+    balances = customer_balances()
+    return render_template("statements.html", balances=balances, total=sum(row.balance for row in balances),
+                           today=datetime.utcnow().date().isoformat())
+
+@app.route("/statements/batch", methods=["POST"])
+def queue_statements():
+    try:
+        start = _param_date(request.form.get("start"))
+        end = _param_date(request.form.get("end")) or datetime.utcnow().date()
+    except ValueError:
+        flash("Pick valid dates.", "danger")
+        return redirect(url_for("statements"))
+    if start and end < start:
+        flash("The end date is before the start date.", "danger")
+        return redirect(url_for("statements"))
+    job = ReportJob(kind="statements", params={"start": start.isoformat() if start else None, "end": end.isoformat()})
+    db.session.add(job)
+    db.session.commit()
+    queue_report(job.id)
+    flash(f"Statements #{job.id} queued; download them from Reports when ready.", "success")
+    return redirect(url_for("reports"))
+
+@app.route("/customers/<int:customer_id>/statement")
+def customer_statement_page(customer_id):
+    customer = db.get_or_404(Customer, customer_id)
+    start, end = statement_period()
+    return render_template("statement.html", customer=customer, statement=customer_statement(customer_id, start, end),
+                           start=start, end=end, memo=_statement_memo)
+
+@app.route("/customers/<int:customer_id>/statement.pdf")
+def customer_statement_pdf(customer_id):
+    customer = db.get_or_404(Customer, customer_id)
+    start, end = statement_period()
+    buffer = io.BytesIO()
+    flowables = list(statement_flowables(customer, customer_statement(customer_id, start, end), start, end))
+    with plain_pdf_streams():
+        _statement_doc(buffer).build(flowables, onFirstPage=_report_page_number, onLaterPages=_report_page_number)
+    buffer.seek(0)
+    return send_file(buffer, mimetype="application/pdf", as_attachment=True,
+                     download_name=f"statement_{customer_id}_{end:%Y-%m-%d}.pdf")
+
+@app.cli.command("statements")
+@click.option("--start", type=click.DateTime(formats=["%Y-%m-%d"]), help="Period start (default: all history).")
+@click.option("--end", type=click.DateTime(formats=["%Y-%m-%d"]), help="Period end (default: today).")
+@click.option("--output", default="statements.pdf", show_default=True)
+def statements_command(start, end, output):
+    """Write a statement for every customer with a balance to one PDF."""
+    began = time.monotonic()
+    count = build_statements_report(output, start.date() if start else None,
+                                    end.date() if end else datetime.utcnow().date())
+    click.echo(f"{count} statements written to {output} in {time.monotonic() - began:.1f}s.")
+
+# ------------------- Database migration ---------------------
+
+def drop_orphans(conn, table, rows, orphans):
+    """``rows`` with references to parents missing from ``conn`` nulled (or the
+    row dropped when the key is required); tallies ``orphans[(column, action)]``.
+
+    Parents are copied before their children (sorted_tables), so a missing
+    parent was missing in the source too.
+    """
+    for fk in table.foreign_keys:
+        column, parent = fk.parent, fk.column
+        if column.name not in rows[0]:
+            continue
+        keys = {row[column.name] for row in rows} - {None}
+        if not keys:
+            continue
+        found = set(conn.scalars(db.select(parent).where(parent.in_(keys))))
+        if parent.table is table:  # a self-reference may point into this batch
+            found |= {row[parent.name] for row in rows}
+        missing = keys - found
+        if not missing:
+            continue
+        kept = []
+        for row in rows:
+            if row[column.name] not in missing:
+                kept.append(row)
+            elif column.nullable:
+                row[column.name] = None
+                orphans[(str(column), "set to NULL")] += 1
+                kept.append(row)
+            else:
+                orphans[(str(column), "row skipped")] += 1
+        rows = kept
+        if not rows:
+            break
+    return rows
+
+def copy_database(source_url, batch_size=1000, echo=print):
+    """Copy every table from ``source_url`` (normally the SQLite file) into the
+    configured database, ``batch_size`` rows at a time, in one transaction.
+
+    The target must be empty. Only columns present in the source are copied, so
+    older SQLite files migrate cleanly. SQLite files written before foreign keys
+    were enforced can hold rows pointing at deleted parents; those references
+    are applied as the model's ON DELETE rule would have (nullable keys are set
+    to NULL, rows with a required key are dropped) and reported, instead of
+    aborting the copy on the target's constraints. Postgres id sequences are
+    advanced past the copied ids afterwards.
+    """
+    source = create_engine(source_url)
+    source_inspector = inspect(source)
+    init_db()
+
+    with source.connect() as src, db.engine.begin() as dst:
+        for table in db.metadata.sorted_tables:
+            if dst.execute(db.select(db.func.count()).select_from(table)).scalar():
+                raise click.ClickException(f"{table.fullname} already has rows; migrate into an empty database.")
+
+        orphans = Counter()
+        for table in db.metadata.sorted_tables:
+            if not source_inspector.has_table(table.name, schema=table.schema):
+                echo(f"{table.fullname}: not in source, skipped")
+                continue
+            present = {c["name"] for c in source_inspector.get_columns(table.name, schema=table.schema)}
+            columns = [c for c in table.columns if c.name in present]
+            pk = list(table.primary_key.columns)
+
+            copied = 0
+            last = None
+            while True:
+                query = db.select(*columns).order_by(*pk)
+                if len(pk) == 1:
+                    # keyset pagination keeps each batch an index range scan
+                    query = query.limit(batch_size)
+                    if last is not None:
+                        query = query.where(pk[0] > last)
+                rows = [dict(r._mapping) for r in src.execute(query)]
+                if not rows:
+                    break
+                next_last = rows[-1][pk[0].name] if len(pk) == 1 else None
+                rows = drop_orphans(dst, table, rows, orphans)
+                if rows:
+                    dst.execute(table.insert(), rows)
+                copied += len(rows)
+                if len(pk) != 1:
+                    break
+                last = next_last
+            echo(f"{table.fullname}: {copied} rows")
+            for (column, action), count in sorted(orphans.items()):
+                echo(f"  {count} rows referenced a missing {column}: {action}")
+            orphans.clear()
+
+        if dst.dialect.name == "postgresql":
+            for table in db.metadata.sorted_tables:
+                pk = list(table.primary_key.columns)
+                if len(pk) != 1 or not isinstance(pk[0].type, db.Integer):
+                    continue
+                max_id = dst.execute(db.select(db.func.max(pk[0]))).scalar() or 0
+                qualified = f'"{table.schema}"."{table.name}"' if table.schema else f'"{table.name}"'
+                dst.execute(
+                    db.text("SELECT setval(pg_get_serial_sequence(:table, :column), :value, false)"),
+                    {"table": qualified, "column": pk[0].name, "value": max_id + 1},
+                )
+
+@app.cli.command("copy-sqlite")
+@click.option("--source", default=lambda: os.path.join(app.instance_path, "business.db"),
+              help="SQLite file to copy from (defaults to instance/business.db).")
+@click.option("--batch-size", default=1000, show_default=True)
+def copy_sqlite_command(source, batch_size):
+    """Copy an existing SQLite business.db (and its archive) into DATABASE_URL."""
+    if db.engine.dialect.name == "sqlite":
+        raise click.ClickException("DATABASE_URL points at SQLite; set it to the Postgres database to copy into.")
+    copy_database(f"sqlite:///{os.path.abspath(source)}", batch_size=batch_size, echo=click.echo)
+    click.echo("Copy complete.")
+
+# ------------------ Projections ------------------
+# Read-only list pages select only the columns they display and get plain Row
+# tuples back (attribute access by label, no identity map or change tracking),
+# so a row costs a tuple instead of a tracked instance. Large text columns are
+# deferred on the models; lists that show them select a bounded preview, and
+# detail/edit pages load the full value. A projected row is its own fragment
+# cache version (every column is displayed).
+
+PREVIEW_CHARS = int(os.environ.get("PREVIEW_CHARS", 200))
+
+def preview(column, length=PREVIEW_CHARS):
+    """First ``length`` characters of a large text column, under the column's name."""
+    return db.func.substr(column, 1, length).label(column.key)
+
+def truncated(column, length=PREVIEW_CHARS):
+    """Whether ``column`` runs past its preview(), under ``<name>_truncated``."""
+    return (db.func.coalesce(db.func.length(column), 0) > length).label(f"{column.key}_truncated")
+
+CUSTOMER_LIST_COLUMNS = (
+    Customer.id, Customer.name, Customer.email, Customer.phone, Customer.address, preview(Customer.notes),
+)
+BOOKING_LIST_COLUMNS = (
+    Booking.id, Customer.name.label("customer_name"), BookingType.name.label("booking_type_name"),
+    Booking.event_date, Booking.expected_income, Booking.paid_status, preview(Booking.notes),
+)
+INVOICE_LIST_COLUMNS = (
+    Invoice.id, Customer.name.label("customer_name"), Invoice.total, Invoice.status, Invoice.created_at,
+)
+
+def transaction_list_columns(T):
+    """Columns for the transaction list/export; ``T`` may be the hot+archive alias."""
+    return (T.id, T.date, T.type, T.category, T.party, T.description, T.amount, T.status, T.receipt_path)
+
+def workorder_list_columns(W):
+    """Columns for the work order list (join Customer for the name); ``W`` may be the hot+archive alias."""
+    return (
+        W.id, W.customer_id, Customer.name.label("customer_name"), W.order_type, W.priority, W.status,
+        W.due_date, W.file_path, preview(W.description), truncated(W.description),
+    )
+
+# ------------------ Streaming & compression ------------------
+# Large list pages are streamed (stream_template + yield_per) and each table
+# row is rendered from a small partial. Rendered rows are cached keyed by the
+# row's version: the tuple of values the partial displays, so an edited row
+# (or a renamed customer shown on it) simply misses the cache. Responses are
+# gzip/brotli compressed as they stream.
+
+class FragmentCache:
+    """Bounded, thread-safe LRU of rendered HTML fragments."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+            return html
+
+    def put(self, key, html):
+        with self._lock:
+            self._entries[key] = html
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return html
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+fragment_cache = FragmentCache(int(os.environ.get("FRAGMENT_CACHE_SIZE", 20000)))
+
+def render_rows(template_name, name, items, version):
+    """Lazily yield rendered rows, reusing cached fragments for unchanged rows.
+
+    ``version(item)`` returns the hashable values the partial displays; the
+    item is passed to the partial as ``name``.
+    """
+    template = app.jinja_env.get_template(template_name)
+    for item in items:
+        key = (template_name, version(item))
+        html = fragment_cache.get(key)
+        if html is None:
+            html = fragment_cache.put(key, Markup(template.render({name: item})))
+        yield html
+
+COMPRESSIBLE_TYPES = {"text/html", "text/css", "text/csv", "text/plain", "application/json",
+                      "application/x-ndjson", "application/javascript"}
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_FLUSH_SIZE = 16 * 1024
+
+def _compressed_stream(chunks, compressor):
+    """Compress an iterable of chunks, flushing every ~16KB so streamed pages arrive incrementally."""
+    pending, size = [], 0
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        pending.append(chunk)
+        size += len(chunk)
+        if size >= COMPRESS_FLUSH_SIZE:
+            yield compressor.process(b"".join(pending)) + compressor.flush()
+            pending, size = [], 0
+    yield compressor.process(b"".join(pending)) + compressor.finish()
+
+class GzipCompressor:
+    """gzip with the process/flush/finish interface of ``brotli.Compressor``."""
+
+    def __init__(self):
+        self._z = zlib.compressobj(6, zlib.DEFLATED, 31)
+
+    def process(self, data):
+        return self._z.compress(data)
+
+    def flush(self):
+        return self._z.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._z.flush()
+
+@app.after_request
+def compress_response(response):
+    if (response.direct_passthrough or response.status_code < 200 or response.status_code in (204, 304)
+            or "Content-Encoding" in response.headers or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+    if not response.is_streamed and response.content_length is not None \
+            and response.content_length < COMPRESS_MIN_SIZE:
+        return response
+
+    accepted = request.accept_encodings
+    if brotli is not None and accepted["br"]:
+        encoding, compressor = "br", brotli.Compressor(quality=4)
+    elif accepted["gzip"]:
+        encoding, compressor = "gzip", GzipCompressor()
+    else:
+        return response
+
+    response.response = _compressed_stream(response.response, compressor)
+    response.headers["Content-Encoding"] = encoding
+    response.headers.pop("Content-Length", None)
+    response.vary.add("Accept-Encoding")
+    return response
+
 # ------------------ Run ------------------
 @app.context_processor
 def inject_version():
@@ -1053,5 +3655,5 @@ def inject_version():
 
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
+        init_db()
     app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,328 @@
+"""Concurrent load test for Bookcase.
+
+Seeds a throwaway database, launches the app as a local multi-worker server
+and drives a mix of staff traffic (dashboard, transaction search, new
+bookings, receipt uploads, invoice PDFs) at increasing concurrency. Reports
+throughput, latency percentiles, errors and "database is locked" failures
+per level, and writes everything to a JSON file for before/after comparisons.
+
+    python loadtest.py --levels 1,2,4,8,16 --duration 10 --workers 4 --output before.json
+    python loadtest.py --output after.json --compare before.json
+
+Uses gunicorn when installed (pre-forked workers), otherwise Werkzeug's
+forking server. Pass --database-url to run against Postgres instead of a
+temporary SQLite file (the database is seeded, so use a scratch one).
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from datetime import date, datetime, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SCENARIOS = {
+    # name: weight
+    "dashboard": 30,
+    "search_transactions": 25,
+    "add_booking": 15,
+    "add_transaction_receipt": 15,
+    "invoice_pdf": 15,
+}
+SEARCH_TERMS = ["supplies", "client", "print", "studio", "rent", "a"]
+SEED_CUSTOMERS = 50
+SEED_INVOICES = 20
+
+# A 1x1 PNG, enough for the receipt upload path
+RECEIPT_BYTES = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000100e221bc330000000049454e44ae426082"
+)
+
+
+# --- server side (run in subprocesses) ---
+
+def seed():
+    from app import app, db, init_db, Customer, BookingType, Transaction, Invoice, InvoiceItem
+
+    rng = random.Random(1)
+    with app.app_context():
+        init_db()
+        if Customer.query.count():
+            return
+        customers = [Customer(name=f"Client {i}", email=f"client{i}@example.com") for i in range(SEED_CUSTOMERS)]
+        db.session.add_all(customers)
+        db.session.add_all([BookingType(name=n) for n in ("Wedding", "Portrait", "Event")])
+        today = date.today()
+        db.session.add_all([
+            Transaction(
+                type=rng.choice(["Income", "Expense"]), category=rng.choice(["Supplies", "Print", "Studio", "Rent"]),
+                party=f"Client {rng.randrange(SEED_CUSTOMERS)}", description="seeded", amount=rng.uniform(10, 900),
+                status=rng.choice(["Paid", "Pending"]), date=today - timedelta(days=rng.randrange(730)),
+            )
+            for _ in range(2000)
+        ])
+        db.session.flush()
+        for i in range(SEED_INVOICES):
+            invoice = Invoice(customer_id=customers[i].id, status="Draft", total=300.0)
+            invoice.items = [InvoiceItem(description="Design", price=150.0, quantity=2)]
+            db.session.add(invoice)
+        db.session.commit()
+
+
+def serve(port, workers, server):
+    if server == "gunicorn":
+        os.execvp(sys.executable, [
+            sys.executable, "-m", "gunicorn", "--chdir", HERE, "-w", str(workers),
+            "-b", f"127.0.0.1:{port}", "--log-level", "warning", "app:app",
+        ])
+    from werkzeug.serving import run_simple
+    from app import app
+    run_simple("127.0.0.1", port, app, processes=workers, threaded=False)
+
+
+# --- client side ---
+
+def multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, content) in files.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f"Content-Type: application/octet-stream\r\n\r\n".encode() + content + b"\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+OPENER = urllib.request.build_opener(NoRedirect)
+
+
+def build_request(base, scenario, rng):
+    if scenario == "dashboard":
+        return urllib.request.Request(f"{base}/dashboard")
+    if scenario == "search_transactions":
+        return urllib.request.Request(f"{base}/transactions?q={rng.choice(SEARCH_TERMS)}")
+    if scenario == "invoice_pdf":
+        return urllib.request.Request(f"{base}/invoices/{rng.randint(1, SEED_INVOICES)}/pdf")
+    if scenario == "add_booking":
+        body = urllib.parse.urlencode({
+            "customer_id": rng.randint(1, SEED_CUSTOMERS), "booking_type_id": rng.randint(1, 3),
+            "event_date": (date.today() + timedelta(days=rng.randrange(365))).isoformat(),
+            "expected_income": f"{rng.uniform(200, 3000):.2f}", "paid_status": rng.choice(["Pending", "Paid"]),
+        }).encode()
+        return urllib.request.Request(f"{base}/bookings/add", data=body)
+    body, content_type = multipart({
+        "type": "Expense", "category": "Supplies", "party": "Load Test", "amount": f"{rng.uniform(5, 200):.2f}",
+        "status": "Paid", "date": date.today().isoformat(),
+    }, {"receipt": (f"receipt_{rng.randrange(10**9)}.png", RECEIPT_BYTES)})
+    return urllib.request.Request(f"{base}/add", data=body, headers={"Content-Type": content_type})
+
+
+def run_level(base, concurrency, duration, seed_value):
+    names, weights = zip(*SCENARIOS.items())
+    results = []
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker(n):
+        rng = random.Random(seed_value * 1000 + n)
+        local = []
+        while time.monotonic() < deadline:
+            scenario = rng.choices(names, weights)[0]
+            request = build_request(base, scenario, rng)
+            started = time.perf_counter()
+            try:
+                with OPENER.open(request, timeout=60) as response:
+                    response.read()
+                    status = response.status
+            except urllib.error.HTTPError as e:
+                e.read()
+                status = e.code
+            except Exception:
+                status = 0
+            local.append((scenario, status, time.perf_counter() - started))
+        with lock:
+            results.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    started = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, time.monotonic() - started
+
+
+def percentiles(latencies):
+    if not latencies:
+        return {}
+    ordered = sorted(latencies)
+
+    def pick(p):
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000, 1)
+    return {"p50": pick(50), "p90": pick(90), "p95": pick(95), "p99": pick(99), "max": round(ordered[-1] * 1000, 1)}
+
+
+def count_locked(log_text):
+    """Requests that failed on "database is locked": one per logged exception
+    (Flask starts each with "Exception on <path>"), however many times the
+    chained traceback repeats the message."""
+    return sum(1 for entry in log_text.split("Exception on ")[1:] if "database is locked" in entry)
+
+
+def summarise(concurrency, results, elapsed, locked):
+    ok = lambda status: 200 <= status < 400
+    level = {
+        "concurrency": concurrency,
+        "duration_s": round(elapsed, 2),
+        "requests": len(results),
+        "throughput_rps": round(len(results) / elapsed, 2),
+        "errors": sum(1 for _, status, _ in results if not ok(status)),
+        "db_locked": locked,
+        "latency_ms": percentiles([lat for _, _, lat in results]),
+        "scenarios": {},
+    }
+    for name in SCENARIOS:
+        rows = [r for r in results if r[0] == name]
+        level["scenarios"][name] = {
+            "requests": len(rows),
+            "errors": sum(1 for _, status, _ in rows if not ok(status)),
+            "latency_ms": percentiles([lat for _, _, lat in rows]),
+        }
+    return level
+
+
+def wait_for(base, proc, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit("server exited during startup")
+        try:
+            with urllib.request.urlopen(f"{base}/dashboard", timeout=2):
+                return
+        except Exception:
+            time.sleep(0.2)
+    raise SystemExit("server did not start")
+
+
+def print_table(levels, baseline=None):
+    print(f"{'conc':>5} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7} {'locked':>7} {'scaling':>8}")
+    single = levels[0]["throughput_rps"] / levels[0]["concurrency"] if levels and levels[0]["throughput_rps"] else 0
+    before = {lv["concurrency"]: lv for lv in (baseline or {}).get("levels", [])}
+    for lv in levels:
+        scaling = lv["throughput_rps"] / (single * lv["concurrency"]) if single else 0
+        line = (f"{lv['concurrency']:>5} {lv['throughput_rps']:>9.1f} {lv['latency_ms'].get('p50', 0):>8} "
+                f"{lv['latency_ms'].get('p95', 0):>8} {lv['latency_ms'].get('p99', 0):>8} "
+                f"{lv['errors']:>7} {lv['db_locked']:>7} {scaling:>8.2f}")
+        old = before.get(lv["concurrency"])
+        if old and old["throughput_rps"]:
+            line += f"   ({(lv['throughput_rps'] / old['throughput_rps'] - 1) * 100:+.0f}% req/s vs baseline)"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command")
+    sub.add_parser("seed")
+    serve_parser = sub.add_parser("serve")
+    serve_parser.add_argument("--port", type=int, required=True)
+    serve_parser.add_argument("--workers", type=int, default=4)
+    serve_parser.add_argument("--server", default="werkzeug")
+
+    parser.add_argument("--levels", default="1,2,4,8,16", help="comma-separated concurrency levels")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per level")
+    parser.add_argument("--workers", type=int, default=4, help="server worker processes")
+    parser.add_argument("--server", choices=["auto", "gunicorn", "werkzeug"], default="auto")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--database-url", help="database to seed and test (default: temporary SQLite file)")
+    parser.add_argument("--output", default="loadtest-report.json")
+    parser.add_argument("--compare", help="earlier report to compare throughput against")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if args.command == "seed":
+        return seed()
+    if args.command == "serve":
+        return serve(args.port, args.workers, args.server)
+
+    server = args.server
+    if server == "auto":
+        try:
+            import gunicorn  # noqa: F401
+            server = "gunicorn"
+        except ImportError:
+            server = "werkzeug"
+
+    workdir = tempfile.mkdtemp(prefix="bookcase-load-")
+    env = dict(os.environ)
+    env.setdefault("SECRET_KEY", "load-test")
+    env["DATABASE_URL"] = args.database_url or "sqlite:///" + os.path.join(workdir, "business.db")
+    env["ARCHIVE_DATABASE"] = os.path.join(workdir, "archive.db")
+    script = os.path.abspath(__file__)
+
+    # cwd=workdir keeps uploaded receipts and generated PDFs out of the repo
+    subprocess.run([sys.executable, script, "seed"], cwd=workdir, env=env, check=True)
+    log_path = os.path.join(workdir, "server.log")
+    log = open(log_path, "w+")
+    proc = subprocess.Popen(
+        [sys.executable, script, "serve", "--port", str(args.port), "--workers", str(args.workers), "--server", server],
+        cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    base = f"http://127.0.0.1:{args.port}"
+    levels = []
+    try:
+        wait_for(base, proc)
+        for concurrency in [int(c) for c in args.levels.split(",")]:
+            log.seek(0, os.SEEK_END)
+            offset = log.tell()
+            results, elapsed = run_level(base, concurrency, args.duration, args.seed)
+            log.flush()
+            with open(log_path) as f:
+                f.seek(offset)
+                locked = count_locked(f.read())
+            levels.append(summarise(concurrency, results, elapsed, locked))
+            print(f"concurrency {concurrency}: {levels[-1]['throughput_rps']} req/s", file=sys.stderr)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+        log.close()
+
+    report = {
+        "generated_at": datetime.utcnow().isoformat(),
+        "server": server,
+        "workers": args.workers,
+        "database": "postgresql" if (args.database_url or "").startswith("postgres") else "sqlite",
+        "duration_per_level_s": args.duration,
+        "scenario_weights": SCENARIOS,
+        "levels": levels,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_table(levels, baseline)
+    print(f"report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Per-request memory benchmark for the big list pages.
+
+Seeds a throwaway SQLite database with realistic volumes (including long
+notes and descriptions), then requests each list page through the Flask test
+client under tracemalloc and records the peak Python allocation and the
+number of allocated blocks per request. Each page is measured cold (row
+fragment and summary caches cleared) and warm, and the median of --repeat
+runs is reported. Results go to a JSON file for before/after comparisons.
+
+    python membench.py --output before.json
+    python membench.py --output after.json --compare before.json
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+PAGES = ["/customers", "/bookings", "/invoices", "/workorders", "/transactions"]
+SCALE = {"customer": 2000, "booking": 6000, "work_order": 6000, "transaction": 20000, "invoice": 3000}
+NOTES = "Prefers morning shoots, call before visiting. " * 40  # ~2 KB per row
+
+
+def seed(db, models, rng):
+    Customer, Booking, BookingType, WorkOrder, Transaction, Invoice, InvoiceItem = models
+    today = date.today()
+    now = datetime.utcnow()
+
+    def day(span=700):
+        return today - timedelta(days=rng.randrange(span))
+
+    def insert(model, rows):
+        db.session.execute(model.__table__.insert(), rows)
+
+    insert(BookingType, [{"name": n, "created_at": now} for n in ("Wedding", "Portrait", "Event")])
+    insert(Customer, [
+        {"name": f"Customer {i}", "email": f"c{i}@example.com", "notes": NOTES, "created_at": now}
+        for i in range(1, SCALE["customer"] + 1)
+    ])
+    insert(Booking, [{
+        "customer_id": rng.randint(1, SCALE["customer"]), "booking_type_id": rng.randint(1, 3),
+        "booking_type": "Wedding", "event_date": day() + timedelta(days=300),
+        "expected_income": rng.uniform(200, 4000), "paid_status": rng.choice(["Paid", "Pending", "Partial"]),
+        "notes": NOTES, "created_at": now,
+    } for _ in range(SCALE["booking"])])
+    insert(WorkOrder, [{
+        "customer_id": rng.randint(1, SCALE["customer"]), "order_type": "Design", "description": NOTES,
+        "price": rng.uniform(50, 900), "due_date": day(), "status": rng.choice(["New", "In Progress", "Closed"]),
+        "priority": rng.choice(["Low", "Medium", "High"]), "created_at": now - timedelta(days=rng.randrange(700)),
+    } for _ in range(SCALE["work_order"])])
+    insert(Transaction, [{
+        "type": rng.choice(["Income", "Expense"]), "category": rng.choice(["Booking", "Supplies", "Rent"]),
+        "party": f"Customer {rng.randint(1, SCALE['customer'])}", "description": "seeded",
+        "amount": rng.uniform(5, 3000), "status": rng.choice(["Paid", "Pending"]), "date": day(), "created_at": now,
+    } for _ in range(SCALE["transaction"])])
+    insert(Invoice, [{
+        "customer_id": rng.randint(1, SCALE["customer"]), "total": 300.0,
+        "status": rng.choice(["Draft", "Paid"]), "created_at": now - timedelta(days=rng.randrange(700)),
+    } for _ in range(SCALE["invoice"])])
+    insert(InvoiceItem, [
+        {"invoice_id": i, "description": "Design", "price": 150.0, "quantity": 2}
+        for i in range(1, SCALE["invoice"] + 1)
+    ])
+    db.session.commit()
+
+
+def measure(client, url):
+    tracemalloc.start()
+    try:
+        response = client.get(url)
+        body = response.get_data()  # drain streamed pages
+        _, peak = tracemalloc.get_traced_memory()
+        blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+    finally:
+        tracemalloc.stop()
+    if response.status_code != 200:
+        raise SystemExit(f"{url} returned {response.status_code}")
+    return {"peak_kb": peak / 1024, "live_blocks": blocks, "bytes": len(body)}
+
+
+def median_of(runs):
+    return {key: round(statistics.median(run[key] for run in runs), 1) for key in runs[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", default=",".join(PAGES), help="comma-separated URLs to measure")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default="membench-report.json")
+    parser.add_argument("--compare", help="earlier report to compare peak allocation against")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)  # resolved before we chdir into the scratch directory
+    compare = os.path.abspath(args.compare) if args.compare else None
+
+    workdir = tempfile.mkdtemp(prefix="bookcase-mem-")
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(workdir, "business.db")
+    os.environ["ARCHIVE_DATABASE"] = os.path.join(workdir, "archive.db")
+    os.chdir(workdir)  # keeps generated files out of the repo
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from app import (
+        app, db, fragment_cache, init_db, invalidate_customer_summaries,
+        Booking, BookingType, Customer, Invoice, InvoiceItem, Transaction, WorkOrder,
+    )
+
+    pages = {}
+    with app.app_context():
+        init_db()
+        seed(db, (Customer, Booking, BookingType, WorkOrder, Transaction, Invoice, InvoiceItem), random.Random(args.seed))
+        client = app.test_client()
+        for url in args.pages.split(","):
+            cold, warm = [], []
+            for _ in range(args.repeat):
+                invalidate_customer_summaries()
+                fragment_cache.clear()
+                cold.append(measure(client, url))
+                warm.append(measure(client, url))
+            pages[url] = {"cold": median_of(cold), "warm": median_of(warm)}
+            print(f"{url}: cold peak {pages[url]['cold']['peak_kb']:.0f} KB", file=sys.stderr)
+
+    report = {"generated_at": datetime.utcnow().isoformat(), "scale": SCALE, "repeat": args.repeat, "pages": pages}
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    before = {}
+    if compare:
+        with open(compare) as f:
+            before = json.load(f)["pages"]
+    print(f"{'page':<15} {'cold peak KB':>13} {'warm peak KB':>13} {'blocks':>9}")
+    for url, result in pages.items():
+        line = (f"{url:<15} {result['cold']['peak_kb']:>13.0f} {result['warm']['peak_kb']:>13.0f} "
+                f"{result['cold']['live_blocks']:>9.0f}")
+        old = before.get(url)
+        if old and old["cold"]["peak_kb"]:
+            line += f"   ({(result['cold']['peak_kb'] / old['cold']['peak_kb'] - 1) * 100:+.0f}% cold peak vs baseline)"
+        print(line)
+    print(f"report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+// Live dashboard: applies the deltas pushed by /dashboard/stream (see "Live dashboard" in app.py).
+(function () {
+  if (!window.EventSource) return;
+  const stream = document.currentScript.dataset.stream;
+
+  function element(html) {
+    const template = document.createElement("template");
+    template.innerHTML = html.trim();
+    return template.content.firstElementChild;
+  }
+
+  function applyRows(container, update, emptyText) {
+    if (!container) return;
+    const existing = {};
+    container.querySelectorAll(":scope > [data-id]").forEach((row) => (existing[row.dataset.id] = row));
+    const rows = update.ids.map((id) => (update.rows[id] ? element(update.rows[id]) : existing[id])).filter(Boolean);
+    if (!rows.length && emptyText) rows.push(element(emptyText));
+    container.replaceChildren(...rows);
+  }
+
+  function apply(delta) {
+    Object.entries(delta.metrics || {}).forEach(([name, value]) => {
+      document.querySelectorAll(`[data-metric="${name}"]`).forEach((node) => {
+        node.textContent = node.dataset.format === "money" ? `$${Number(value).toFixed(2)}` : value;
+      });
+    });
+    if (delta.recent) applyRows(document.getElementById("recentTransactions"), delta.recent);
+    if (delta.recent_orders) {
+      applyRows(document.getElementById("recentOrders"), delta.recent_orders,
+        '<li class="list-group-item text-muted" data-empty>No recent work orders</li>');
+    }
+    if (delta.upcoming !== undefined) document.getElementById("upcomingOrder").innerHTML = delta.upcoming;
+  }
+
+  // EventSource reconnects by itself when the server ends a stream
+  new EventSource(stream).addEventListener("dashboard", (event) => apply(JSON.parse(event.data)));
+})();
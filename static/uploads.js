@@ -0,0 +1,94 @@
+// Chunked, resumable uploads through /api/uploads (see "Uploads" in app.py).
+//   <input type="file" data-upload-target="workorder" data-upload-target-id="3" data-upload-status="statusId">
+// The upload id is remembered per file, so picking the same file again after a
+// dropped connection or page reload continues from the server's offset.
+(function () {
+  const RETRIES = 5;
+
+  async function sha256Hex(buffer) {
+    if (!window.crypto || !crypto.subtle) return null;  // plain http on a LAN address
+    const digest = await crypto.subtle.digest("SHA-256", buffer);
+    return Array.from(new Uint8Array(digest), (b) => b.toString(16).padStart(2, "0")).join("");
+  }
+
+  async function send(url, options) {
+    for (let attempt = 0; ; attempt++) {
+      try {
+        return await fetch(url, options);
+      } catch (err) {
+        if (attempt >= RETRIES) throw err;
+        await new Promise((resolve) => setTimeout(resolve, 1000 * 2 ** attempt));
+      }
+    }
+  }
+
+  async function upload(input, report) {
+    const file = input.files[0];
+    if (!file) return;
+    const { uploadTarget: target, uploadTargetId: targetId } = input.dataset;
+    const key = ["upload", target, targetId, file.name, file.size, file.lastModified].join(":");
+
+    let state = null;
+    const saved = localStorage.getItem(key);
+    if (saved) {
+      const response = await send(`/api/uploads/${saved}`);
+      if (response.ok) state = await response.json();
+    }
+    if (!state || state.complete) {
+      const response = await send("/api/uploads", {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ target, target_id: Number(targetId), filename: file.name, size: file.size }),
+      });
+      state = await response.json();
+      if (!response.ok) throw new Error(state.error || response.statusText);
+      localStorage.setItem(key, state.id);
+    }
+
+    let failures = 0;
+    while (!state.complete) {
+      if (state.offset >= state.size) {
+        // every byte is in; the server is checking the whole file
+        report("Verifying…");
+        await new Promise((resolve) => setTimeout(resolve, 1000));
+        const response = await send(`/api/uploads/${state.id}`);
+        state = await response.json();
+        if (!response.ok) throw new Error(state.error || response.statusText);
+        if (state.error && ++failures > RETRIES) throw new Error(state.error);
+        continue;
+      }
+      report(`Uploading… ${Math.floor((100 * state.offset) / state.size)}%`);
+      const buffer = await file.slice(state.offset, state.offset + state.chunk_size).arrayBuffer();
+      const headers = { "Upload-Offset": String(state.offset), "Content-Type": "application/octet-stream" };
+      const checksum = await sha256Hex(buffer);
+      if (checksum) headers["X-Chunk-SHA256"] = checksum;
+      const response = await send(`/api/uploads/${state.id}`, { method: "PATCH", headers, body: buffer });
+      const body = await response.json();
+      // 409 (stale offset, or another tab writing) / 422 carry the server's offset: carry on from there
+      if (!response.ok && !([409, 422].includes(response.status) && ++failures <= RETRIES)) {
+        throw new Error(body.error || response.statusText);
+      }
+      state = body;
+    }
+    localStorage.removeItem(key);
+    report("Uploaded.", state.url);
+  }
+
+  document.querySelectorAll("input[type=file][data-upload-target]").forEach((input) => {
+    const status = document.getElementById(input.dataset.uploadStatus);
+    const report = (text, url) => {
+      if (!status) return;
+      status.textContent = text + " ";
+      if (url) {
+        const link = document.createElement("a");
+        link.href = url;
+        link.target = "_blank";
+        link.textContent = "View";
+        status.appendChild(link);
+      }
+    };
+    input.addEventListener("change", () => {
+      upload(input, report).catch((err) => report(`Upload failed: ${err.message}. Pick the file again to resume.`));
+    });
+  });
+})();
@@ -0,0 +1,35 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Configure the database before app.py is imported: a throwaway SQLite file by
+# default, or TEST_DATABASE_URL (e.g. a local Postgres) for a parity run.
+_tmp_dir = tempfile.mkdtemp(prefix="bookcase-test-")
+os.environ["DATABASE_URL"] = os.environ.get(
+    "TEST_DATABASE_URL", "sqlite:///" + os.path.join(_tmp_dir, "business.db")
+)
+os.environ["ARCHIVE_DATABASE"] = os.path.join(_tmp_dir, "archive.db")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app as flask_app, db, init_db  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    flask_app.config.update(
+        TESTING=True, UPLOAD_FOLDER=_tmp_dir, WORKORDER_FOLDER=_tmp_dir,
+        UPLOAD_TMP_FOLDER=os.path.join(_tmp_dir, "uploads"), REPORT_FOLDER=os.path.join(_tmp_dir, "reports"),
+    )
+    flask_app.__dict__.pop("jobtypes_seeded", None)  # tables are recreated per test
+    with flask_app.app_context():
+        init_db()
+        yield flask_app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,246 @@
+"""Query-plan regression suite: no route should quietly fall back to full scans.
+
+Seeds SQLite at realistic scale, requests every GET route (plus the bulk and
+delete POSTs), captures each SQL statement it issues and runs EXPLAIN QUERY
+PLAN on it. Plans are stored as
+snapshots in tests/query_plans/, one file per URL; lines marked "!" are
+flagged (a SCAN of a large table, or a temp B-tree sort). A test fails when a
+flagged line shows up that the snapshot doesn't already accept, so every new
+scan or sort has to be reviewed. After reviewing, refresh the snapshots with:
+
+    UPDATE_QUERY_PLANS=1 pytest tests/test_query_plans.py
+"""
+import os
+import random
+import re
+from datetime import date, datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from app import (
+    app as flask_app, db, fragment_cache, init_db, invalidate_customer_summaries,
+    Booking, BookingType, ChangeLog, Customer, Invoice, InvoiceItem, Lead, Transaction, WorkOrder,
+)
+
+SNAPSHOT_DIR = os.path.join(os.path.dirname(__file__), "query_plans")
+UPDATE = os.environ.get("UPDATE_QUERY_PLANS") == "1"
+
+# tables that grow with the business; scanning the others is fine
+LARGE_TABLES = {
+    "transaction", "work_order", "booking", "customer", "invoice", "invoice_item", "lead", "change_log",
+}
+SCALE = {"customer": 2000, "booking": 6000, "work_order": 6000, "transaction": 20000, "invoice": 3000, "lead": 3000}
+
+# query-string variants on top of one plain request per GET route
+EXTRA_URLS = [
+    "/transactions?q=ada&type=Income&status=Paid", "/transactions?archive=1",
+    "/transactions/export?q=supplies", "/workorders?q=ada&status=New", "/workorders?archive=1",
+    "/bookings?status=Partial", "/customers/top?sort=last_activity", "/leads?search=grace&status=New",
+    "/forecast?granularity=week&horizon=8", "/api/changes?since=100&tables=transaction",
+]
+# GET routes that can't render in this tree (template missing), and the
+# dashboard's event stream (never ends; it runs /dashboard's queries)
+SKIP_ENDPOINTS = {"static", "edit_bookingtype", "dashboard_stream"}
+
+# set-based writes (bulk UPDATE/DELETE, INSERT ... SELECT, the delete cascade):
+# (snapshot name, url, form). They change the data, so they run after every GET
+# case, in this order.
+POST_CASES = [
+    ("bulk_bookings_mark_paid", "/bookings/bulk", {"ids": ["2", "3", "4"], "action": "mark_paid"}),
+    ("bulk_bookings_sync_status", "/bookings/bulk", {"ids": ["5", "6", "7"], "action": "sync_status"}),
+    ("bulk_bookings_reassign", "/bookings/bulk", {"ids": ["5", "6"], "action": "reassign:3"}),
+    ("bulk_bookings_delete", "/bookings/bulk", {"ids": ["8", "9"], "action": "delete"}),
+    ("bulk_workorders_close", "/workorders/bulk", {"ids": ["2", "3"], "action": "close"}),
+    ("bulk_workorders_delete", "/workorders/bulk", {"ids": ["4", "5"], "action": "delete"}),
+    ("bulk_transactions_mark_paid", "/transactions/bulk", {"ids": ["2", "3"], "action": "mark_paid"}),
+    ("bulk_transactions_delete", "/transactions/bulk", {"ids": ["4", "5"], "action": "delete"}),
+    ("delete_booking", "/bookings/delete/10", {}),
+    ("delete_invoice", "/invoices/delete/2", {}),
+    ("delete_customer", "/customers/delete/2", {}),
+]
+
+
+def route_urls():
+    urls = []
+    for rule in flask_app.url_map.iter_rules():
+        if "GET" in rule.methods and rule.endpoint not in SKIP_ENDPOINTS:
+            urls.append(re.sub(r"<(?:int:)?\w+>", "1", rule.rule))
+    return sorted(urls) + EXTRA_URLS
+
+
+def seed_large():
+    rng = random.Random(7)
+    today = date(2025, 6, 30)
+    now = datetime(2025, 6, 30, 12)
+
+    def day(span=900):
+        return today - timedelta(days=rng.randrange(span))
+
+    def insert(model, rows):
+        db.session.execute(model.__table__.insert(), rows)
+
+    insert(BookingType, [{"name": n, "created_at": now} for n in ("Wedding", "Portrait", "Event")])
+    insert(Customer, [
+        {"name": f"Customer {i}", "email": f"c{i}@example.com", "notes": "regular" * 20, "created_at": now}
+        for i in range(1, SCALE["customer"] + 1)
+    ])
+    insert(Booking, [{
+        "customer_id": rng.randint(1, SCALE["customer"]), "booking_type_id": rng.randint(1, 3),
+        "booking_type": "Wedding", "event_date": day() + timedelta(days=400),
+        "expected_income": rng.uniform(200, 4000), "paid_status": rng.choice(["Paid", "Pending", "Partial"]),
+        "created_at": now,
+    } for _ in range(SCALE["booking"])])
+    insert(WorkOrder, [{
+        "customer_id": rng.randint(1, SCALE["customer"]), "booking_id": rng.choice([None, rng.randint(1, SCALE["booking"])]),
+        "order_type": "Design", "price": rng.uniform(50, 900), "due_date": day(),
+        "status": rng.choice(["New", "In Progress", "Closed"]), "priority": rng.choice(["Low", "Medium", "High"]),
+        "created_at": now - timedelta(days=rng.randrange(900)),
+    } for _ in range(SCALE["work_order"])])
+    insert(Transaction, [{
+        "type": rng.choice(["Income", "Expense"]), "category": rng.choice(["Booking", "Supplies", "Rent", "Invoice"]),
+        "party": f"Customer {rng.randint(1, SCALE['customer'])}", "amount": rng.uniform(5, 3000),
+        "status": rng.choice(["Paid", "Pending"]), "date": day(), "created_at": now,
+    } for _ in range(SCALE["transaction"])])
+    insert(Invoice, [{
+        "customer_id": rng.randint(1, SCALE["customer"]), "booking_id": rng.randint(1, SCALE["booking"]),
+        "total": 300.0, "status": rng.choice(["Draft", "Paid"]), "created_at": now - timedelta(days=rng.randrange(900)),
+    } for _ in range(SCALE["invoice"])])
+    insert(InvoiceItem, [
+        {"invoice_id": i, "description": "Design", "price": 150.0, "quantity": 2}
+        for i in range(1, SCALE["invoice"] + 1) for _ in range(2)
+    ])
+    insert(Lead, [{
+        "contact_name": f"Lead {i}", "type": rng.choice(["Business", "Personal"]), "status": "New",
+        "source": rng.choice(["Referral", "Web", None]), "last_contacted": day(),
+    } for i in range(SCALE["lead"])])
+    insert(ChangeLog, [
+        {"table_name": "transaction", "row_id": i, "op": "insert", "created_at": now} for i in range(1, 5001)
+    ])
+    db.session.commit()
+
+
+@pytest.fixture(scope="module")
+def seeded(tmp_path_factory):
+    if not flask_app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite"):
+        pytest.skip("EXPLAIN QUERY PLAN snapshots are SQLite plans")
+    files = tmp_path_factory.mktemp("files")  # PDFs, receipts and reports the routes write
+    flask_app.config.update(
+        TESTING=True, UPLOAD_FOLDER=str(files), WORKORDER_FOLDER=str(files),
+        UPLOAD_TMP_FOLDER=str(files / "uploads"), REPORT_FOLDER=str(files / "reports"),
+    )
+    flask_app.__dict__.pop("jobtypes_seeded", None)
+    with flask_app.app_context():
+        init_db()
+        seed_large()
+        yield flask_app
+        db.session.remove()
+        db.drop_all()
+
+
+def capture_statements(client, url, data=None):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(("SELECT", "WITH", "UPDATE", "DELETE", "INSERT")):
+            statements.append((statement, parameters))
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        response = client.get(url) if data is None else client.post(url, data=data)
+        response.get_data()  # drain streamed pages
+        if data is not None:
+            assert response.status_code == 302, f"POST {url} returned {response.status_code}"
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+    return statements
+
+
+def normalise(statement):
+    statement = re.sub(r"\s+", " ", statement).strip()
+    statement = re.sub(r"\(\?(, \?)+\)", "(?...)", statement)  # expanded IN lists
+    # the outer column list doesn't affect the plan; dropping it keeps snapshots stable as models gain columns
+    return re.sub(r"^SELECT (?:(?!\(SELECT).)+? FROM ", "SELECT ... FROM ", statement)
+
+
+def table_aliases(statement):
+    aliases = {}
+    for table, alias in re.findall(r'(?:FROM|JOIN) "?([\w.]+)"? AS "?(\w+)"?', statement):
+        aliases[alias] = table.split(".")[-1]
+    return aliases
+
+
+def flagged(line, aliases):
+    if "USE TEMP B-TREE" in line:
+        return True
+    match = re.match(r"SCAN ([\w.]+)", line)
+    if match and "USING INTEGER PRIMARY KEY" not in line:
+        name = match.group(1).split(".")[-1]  # archive.transaction counts as transaction
+        return aliases.get(name, name) in LARGE_TABLES
+    return False
+
+
+def explain(statements):
+    """Return snapshot text: each statement followed by its plan, flagged lines marked "!"."""
+    blocks, seen = [], set()
+    with db.engine.connect() as conn:
+        for statement, parameters in statements:
+            sql = normalise(statement)
+            if sql in seen:
+                continue
+            seen.add(sql)
+            aliases = table_aliases(sql)
+            plan = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).all()
+            lines = [f"SQL: {sql}"]
+            for _, _, _, detail in plan:
+                lines.append(("! " if flagged(detail, aliases) else "  ") + detail)
+            blocks.append("\n".join(lines))
+    return "\n\n".join(blocks) + "\n"
+
+
+def flagged_lines(snapshot):
+    result, sql = set(), None
+    for line in snapshot.splitlines():
+        if line.startswith("SQL: "):
+            sql = line[5:]
+        elif line.startswith("! "):
+            result.add((sql, line[2:]))
+    return result
+
+
+def snapshot_path(url):
+    name = re.sub(r"\W+", "_", url).strip("_") or "index"
+    return os.path.join(SNAPSHOT_DIR, name + ".txt")
+
+
+def check_snapshot(path, request_line, actual):
+    if UPDATE or not os.path.exists(path):
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        with open(path, "w") as f:
+            f.write(f"# {request_line}\n" + actual)
+        if not UPDATE:
+            pytest.fail(f"no plan snapshot for {request_line}; wrote {path}, review it and commit")
+        return
+
+    with open(path) as f:
+        expected = f.read()
+    new = flagged_lines(actual) - flagged_lines(expected)
+    assert not new, f"{request_line}: new full scans / temp sorts (review, then UPDATE_QUERY_PLANS=1):\n" + "\n".join(
+        f"{line}\n    in {sql}" for sql, line in sorted(new)
+    )
+
+
+@pytest.mark.parametrize("url", route_urls())
+def test_query_plans(seeded, url):
+    client = seeded.test_client()
+    # cold caches, so the route issues all of its queries
+    invalidate_customer_summaries()
+    fragment_cache.clear()
+    check_snapshot(snapshot_path(url), f"GET {url}", explain(capture_statements(client, url)))
+
+
+@pytest.mark.parametrize("name, url, form", POST_CASES, ids=[case[0] for case in POST_CASES])
+def test_write_query_plans(seeded, name, url, form):
+    client = seeded.test_client()
+    actual = explain(capture_statements(client, url, form))
+    check_snapshot(os.path.join(SNAPSHOT_DIR, f"post_{name}.txt"), f"POST {url} {form}", actual)
@@ -0,0 +1,605 @@
+"""Route parity: every page and form works on the configured backend.
+
+Runs against a temporary SQLite file by default. For the Postgres parity run:
+
+    TEST_DATABASE_URL=postgresql://localhost/bookcase_test pytest
+"""
+import gzip
+import hashlib
+import json
+import os
+from datetime import date, datetime, timedelta
+
+from reportlab import rl_config
+
+from app import db, init_db, archive_before, archived_transactions, backfill_transaction_links, cash_flow_forecast, copy_database, customer_balances, customer_statement, dashboard_publisher, report_jobs, report_transactions, upload_jobs, upload_lock, upload_part_path, lead_facets, _lead_facet_cache, customer_summary, _summary_cache, file_cleanup, invoice_pdf_path, outstanding_balances, transaction_totals, workorder_tiles, Booking, BookingType, ChangeLog, Customer, Invoice, InvoiceItem, Lead, ReportJob, Transaction, WorkOrder
+
+
+def seed(client):
+    client.post("/customers/add", data={"name": "Ada Lovelace", "email": "ada@example.com"})
+    client.post("/settings/bookingtypes/add", data={"name": "Wedding"})
+    client.post("/bookings/add", data={
+        "customer_id": "1", "booking_type_id": "1", "event_date": "2024-06-01",
+        "expected_income": "1500", "paid_status": "Partial", "partial_amount": "500",
+    })
+    client.post("/settings/jobtypes/edit/1", data={"name": "Design", "price": "250"})
+    client.post("/workorders/add", data={
+        "customer_id": "1", "order_type": "Design", "due_date": "2024-05-20", "booking_id": "1",
+    })
+    client.post("/add", data={
+        "type": "Expense", "category": "Supplies", "party": "Paper Co", "amount": "42.50",
+        "status": "Pending", "date": "2024-04-02",
+    })
+    client.post("/invoices/create_from_booking/1", data={"workorders": ["1"]})
+    client.post("/leads/add", data={"contact_name": "Grace Hopper", "type": "Business", "last_contacted": "2024-03-01"})
+
+
+def test_pages_render(client):
+    seed(client)
+    for url in [
+        "/dashboard", "/transactions", "/transactions?q=ada&type=Income&status=Paid",
+        "/transactions?archive=1", "/transactions/export?q=supplies", "/workorders",
+        "/workorders?q=ada&status=New&archive=1", "/workorders/add", "/workorders/edit/1",
+        "/bookings", "/bookings?status=Partial", "/bookings/add", "/bookings/1", "/bookings/edit/1",
+        "/customers", "/customers/add", "/customers/1", "/customers/edit/1",
+        "/customers/top", "/customers/top?sort=last_activity",
+        "/invoices", "/invoices/1", "/invoices/1/pdf", "/leads", "/leads?search=grace&status=New",
+        "/leads/edit/1", "/add", "/edit/1", "/settings/jobtypes", "/settings/jobtypes/edit/1",
+        "/settings/bookingtypes", "/api/changes",
+        "/forecast", "/forecast?granularity=week&horizon=8", "/api/forecast",
+    ]:
+        assert client.get(url).status_code == 200, url
+
+
+def test_writes(client, app):
+    seed(client)
+    assert Customer.query.count() == 1
+    assert BookingType.query.one().name == "Wedding"
+    # partial booking payment is logged as income
+    assert Transaction.query.filter_by(type="Income", category="Booking").one().amount == 500
+
+    assert client.post("/invoices/1/mark_paid").status_code == 302
+    assert Transaction.query.filter_by(category="Invoice").count() == 1
+
+    assert client.post("/bookings/edit/1", data={
+        "customer_id": "1", "booking_type_id": "1", "event_date": "2024-06-02",
+        "expected_income": "1600", "paid_status": "Paid", "partial_amount": "100",
+    }).status_code == 302
+    # status follows the payments, whatever the form says, and editing records none
+    assert db.session.get(Booking, 1).paid_status == "Partial"
+    assert client.post("/bookings/edit/1", data={
+        "customer_id": "1", "booking_type_id": "1", "event_date": "2024-06-02", "expected_income": "500",
+    }).status_code == 302
+    assert db.session.get(Booking, 1).paid_status == "Paid"
+    assert Transaction.query.filter_by(category="Booking").count() == 1
+    assert client.post("/workorders/edit/1", data={
+        "customer_id": "1", "order_type": "Design", "status": "Closed",
+    }).status_code == 302
+    assert client.post("/leads/convert/1").status_code == 302
+    assert Customer.query.count() == 2
+    assert client.post("/delete/1").status_code == 302
+
+
+def test_archive_keeps_lifetime_totals(client, app):
+    seed(client)
+    db.session.add(Transaction(type="Income", category="Old", amount=100.0, status="Paid", date=date(2019, 1, 5)))
+    order = db.session.get(WorkOrder, 1)
+    order.status = "Closed"
+    order.created_at = order.created_at.replace(year=2019)
+    db.session.commit()
+    before = transaction_totals(), workorder_tiles()
+
+    for cutoff in ("", "01/01/2020", "2020-13-01"):
+        assert client.post("/settings/archive", data={"before": cutoff}).status_code == 302
+    assert Transaction.query.filter_by(category="Old").count() == 1
+    assert archive_before(date(2020, 1, 1)) == (1, 1)
+    assert Transaction.query.filter_by(category="Old").count() == 0
+    assert ChangeLog.query.filter_by(op="archive").count() == 2
+    assert (transaction_totals(), workorder_tiles()) == before
+    assert client.get("/dashboard").status_code == 200
+    listing = client.get("/transactions?archive=1").data
+    assert b"Old" in listing
+    # archived rows are read-only: no bulk checkbox for them
+    archived_id = db.session.execute(db.select(archived_transactions.c.id)).scalar()
+    assert f'name="ids" value="{archived_id}"'.encode() not in listing
+    assert listing.count(b'name="ids"') == Transaction.query.count()
+    workorders = client.get("/workorders?archive=1").data
+    assert b'name="ids" value="1"' not in workorders
+
+
+def test_archived_ids_are_never_reused(client, app):
+    if db.engine.dialect.name != "sqlite":
+        return
+    seed(client)
+    # a table from before the models asked for AUTOINCREMENT
+    with db.engine.connect() as conn:
+        ddl = conn.exec_driver_sql("SELECT sql FROM sqlite_master WHERE name = 'transaction'").scalar()
+        conn.exec_driver_sql("PRAGMA foreign_keys = OFF")
+        conn.exec_driver_sql(ddl.replace("AUTOINCREMENT", "").replace('"transaction"', "legacy", 1))
+        conn.exec_driver_sql('INSERT INTO legacy SELECT * FROM "transaction"')
+        conn.exec_driver_sql('DROP TABLE "transaction"')
+        conn.exec_driver_sql('ALTER TABLE legacy RENAME TO "transaction"')
+        conn.exec_driver_sql("PRAGMA foreign_keys = ON")
+        conn.commit()
+    db.session.add(Transaction(type="Income", category="Old", amount=10.0, status="Paid", date=date(2019, 1, 5)))
+    db.session.commit()
+    archive_before(date(2020, 1, 1))
+    reused = Transaction(type="Income", category="New", amount=20.0, status="Paid", date=date(2019, 6, 1))
+    db.session.add(reused)
+    db.session.commit()
+    assert reused.id == 3  # SQLite handed the archived row's id out again
+
+    init_db()
+    db.session.expire_all()
+    assert "AUTOINCREMENT" in db.session.execute(db.text(
+        "SELECT sql FROM sqlite_master WHERE name = 'transaction'")).scalar()
+    assert [t.id for t in Transaction.query.filter_by(category="New")] == [4]
+    assert [c.op for c in ChangeLog.query.filter_by(table_name="transaction").filter(
+        ChangeLog.row_id.in_([3, 4])).order_by(ChangeLog.seq)][-2:] == ["delete", "insert"]
+    assert archive_before(date(2020, 1, 1)) == (1, 0)
+    db.session.add(Transaction(type="Expense", category="Newer", amount=1.0, status="Pending", date=date.today()))
+    db.session.commit()
+    assert Transaction.query.filter_by(category="Newer").one().id == 5
+
+
+def test_copy_database_repairs_orphans(app, tmp_path):
+    from sqlalchemy import create_engine
+
+    # a legacy SQLite file, written while foreign keys weren't enforced
+    source = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    db.metadata.create_all(source, tables=[t for t in db.metadata.sorted_tables if t.schema is None])
+    with source.connect() as conn:
+        conn.exec_driver_sql("PRAGMA foreign_keys = OFF")
+        conn.commit()
+        with conn.begin():
+            conn.execute(Customer.__table__.insert(), [{"id": 1, "name": "Ada"}])
+            conn.execute(BookingType.__table__.insert(), [{"id": 1, "name": "Wedding"}])
+            conn.execute(Booking.__table__.insert(), [
+                {"id": 1, "customer_id": 1, "booking_type_id": 1, "event_date": date(2024, 6, 1)},
+                {"id": 2, "customer_id": 7, "booking_type_id": 1, "event_date": date(2024, 6, 2)},  # customer deleted
+            ])
+            conn.execute(Invoice.__table__.insert(), [
+                {"id": 1, "customer_id": 1, "booking_id": 2, "total": 10.0},
+                {"id": 2, "customer_id": 7, "booking_id": None, "total": 20.0},
+            ])
+            conn.execute(InvoiceItem.__table__.insert(), [
+                {"id": 1, "invoice_id": 1, "description": "Print", "price": 10.0},
+                {"id": 2, "invoice_id": 2, "description": "Print", "price": 20.0},
+            ])
+            conn.execute(Transaction.__table__.insert(), [
+                {"id": 5, "type": "Income", "category": "Booking", "status": "Paid", "amount": 9.0,
+                 "date": date(2024, 6, 1), "customer_id": 1, "booking_id": 2, "invoice_id": 2},
+            ])
+    source.dispose()
+
+    output = []
+    copy_database(f"sqlite:///{tmp_path / 'legacy.db'}", batch_size=1, echo=output.append)
+    db.session.expire_all()
+    assert [b.id for b in Booking.query] == [1]
+    assert [(i.id, i.booking_id) for i in Invoice.query] == [(1, None)]
+    assert [i.invoice_id for i in InvoiceItem.query] == [1]
+    txn = db.session.get(Transaction, 5)
+    assert (txn.customer_id, txn.booking_id, txn.invoice_id) == (1, None, None)
+    assert "  1 rows referenced a missing booking.customer_id: row skipped" in output
+    assert "  1 rows referenced a missing transaction.booking_id: set to NULL" in output
+
+    if db.engine.dialect.name == "postgresql":  # sequences carry on past the copied ids
+        db.session.add(Transaction(type="Expense", category="Rent", status="Paid", amount=1.0, date=date(2024, 7, 1)))
+        db.session.commit()
+        assert Transaction.query.order_by(Transaction.id.desc()).first().id == 6
+
+
+def test_customer_summary_invalidated_on_write(client, app):
+    seed(client)
+    summary = customer_summary(1)
+    assert summary["bookings"] == 1 and summary["expected_income"] == 1500
+    assert summary["open_workorders"] == 1 and summary["outstanding"] == summary["invoiced_draft"] == 250
+
+    assert summary["paid_income"] == 500  # the partial booking's payment, as on its balance
+
+    client.post("/invoices/1/mark_paid")
+    client.post("/workorders/edit/1", data={"customer_id": "1", "order_type": "Design", "status": "Closed"})
+    client.post("/bookings/1/payments", data={"amount": "250"})
+    summary = customer_summary(1)
+    assert summary["outstanding"] == 0 and summary["open_workorders"] == 0 and summary["paid_income"] == 750
+
+    # dropped when the write commits, not when it flushes
+    db.session.get(Booking, 1).expected_income = 2000
+    db.session.flush()
+    assert 1 in _summary_cache
+    db.session.commit()
+    assert 1 not in _summary_cache and customer_summary(1)["expected_income"] == 2000
+
+    client.post("/customers/add", data={"name": "Charles Babbage"})
+    top = client.get("/customers/top?limit=-5")  # a negative LIMIT would mean "no limit" to SQLite
+    assert top.status_code == 200 and b"Ada Lovelace" in top.data and b"Charles Babbage" not in top.data
+
+
+def test_change_feed_since_cursor(client, app):
+    seed(client)
+    changes = [json.loads(line) for line in client.get("/api/changes").data.splitlines()]
+    assert [c["seq"] for c in changes] == sorted(c["seq"] for c in changes)
+    customer = next(c for c in changes if c["table"] == "customer")
+    assert customer["op"] == "insert" and customer["fields"]["name"] == "Ada Lovelace"
+
+    cursor = changes[-1]["seq"]
+    client.post("/customers/edit/1", data={"name": "Ada King", "email": "ada@example.com"})
+    client.post("/delete/1")
+    new = [json.loads(line) for line in client.get(f"/api/changes?since={cursor}").data.splitlines()]
+    # the deleted payment was the booking's only one, so its status follows
+    assert [(c["table"], c["op"]) for c in new] == [("customer", "update"), ("transaction", "delete"),
+                                                   ("booking", "update")]
+    assert new[0]["fields"] == {"name": "Ada King"}
+
+
+def test_list_pages_stream_compressed(client, app):
+    seed(client)
+    plain = client.get("/bookings").data
+    assert b"Ada Lovelace" in plain and b"Wedding" in plain
+
+    response = client.get("/bookings", headers={"Accept-Encoding": "gzip"})
+    assert response.is_streamed and response.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(response.data) == plain
+
+    # an edited row gets a new version, so the cached fragment isn't reused
+    client.post("/customers/edit/1", data={"name": "Ada King"})
+    assert b"Ada King" in client.get("/customers").data
+    assert b"Ada King" in client.get("/bookings").data
+
+    # list previews are bounded, and say so when they cut a long text short
+    db.session.get(WorkOrder, 1).description = "Mood board. " * 40 + "the tail end"
+    db.session.commit()
+    page = client.get("/workorders").data.decode()
+    assert "the tail end" not in page and "Mood board. Mood boa…" in page and "Full description" in page
+
+
+def test_bulk_actions_are_set_based(client, app):
+    seed(client)
+    client.post("/workorders/add", data={"customer_id": "1", "order_type": "Print"})
+    client.post("/workorders/bulk", data={"ids": ["1", "2"], "action": "priority:High"})
+    client.post("/workorders/bulk", data={"ids": ["1", "2"], "action": "close"})
+    assert {(w.status, w.priority) for w in WorkOrder.query} == {("Closed", "High")}
+
+    client.post("/bookings/add", data={
+        "customer_id": "1", "booking_type_id": "1", "event_date": "2024-07-01",
+        "expected_income": "800", "paid_status": "Pending",
+    })
+    client.post("/bookings/bulk", data={"ids": ["1", "2"], "action": "mark_paid"})
+    income = Transaction.query.filter_by(type="Income", category="Booking").all()
+    # partial booking logged 500 at creation; now each logs its outstanding balance
+    assert sorted(t.amount for t in income) == [500, 800, 1000]
+    assert income[-1].party == "Ada Lovelace" and income[-1].description == "Wedding Booking"
+    assert {t.booking_id for t in income} == {1, 2}
+    assert ChangeLog.query.filter_by(table_name="transaction", op="insert").count() == 4
+
+    assert {b.paid_status for b in Booking.query} == {"Paid"}
+    client.post("/transactions/bulk", data={"ids": [str(t.id) for t in Transaction.query], "action": "delete"})
+    assert Transaction.query.count() == 0
+    assert {b.paid_status for b in Booking.query} == {"Pending"}  # their payments are gone
+    client.post("/bookings/bulk", data={"ids": ["1"], "action": "delete"})
+    assert db.session.get(WorkOrder, 1).booking_id is None
+
+
+def test_delete_customer_removes_graph(client, app):
+    seed(client)
+    client.post("/customers/add", data={"name": "Charles Babbage"})
+    client.post("/workorders/add", data={"customer_id": "2", "order_type": "Print", "booking_id": "1"})
+    attachment = os.path.join(app.config["UPLOAD_FOLDER"], "brief.pdf")
+    with open(attachment, "w") as f:
+        f.write("brief")
+    db.session.get(WorkOrder, 1).file_path = attachment
+    db.session.commit()
+    client.get("/invoices/1/pdf")
+    assert os.path.exists(invoice_pdf_path(1))
+
+    client.post("/invoices/1/mark_paid")
+    archive_before(date.today() + timedelta(days=1))  # both payments move to the archive
+    client.post("/customers/delete/1")
+    file_cleanup.join()
+    links = db.select(archived_transactions.c.customer_id, archived_transactions.c.booking_id,
+                      archived_transactions.c.invoice_id)
+    assert db.session.execute(links).all() == [(None, None, None), (None, None, None)]
+    assert [c.name for c in Customer.query] == ["Charles Babbage"]
+    assert Booking.query.count() == Invoice.query.count() == InvoiceItem.query.count() == 0
+    # another customer's work order on the deleted booking is kept, unlinked
+    assert [(w.customer_id, w.booking_id) for w in WorkOrder.query] == [(2, None)]
+    assert not os.path.exists(attachment) and not os.path.exists(invoice_pdf_path(1))
+    assert ChangeLog.query.filter_by(table_name="customer", op="delete").count() == 1
+
+
+def test_delete_booking_keeps_linked_rows(client, app):
+    seed(client)
+    assert customer_summary(1)["bookings"] == 1
+    response = client.post("/bookings/delete/1")
+    assert response.status_code == 302
+    assert Booking.query.count() == 0
+    assert [(w.id, w.booking_id) for w in WorkOrder.query] == [(1, None)]
+    assert [(i.id, i.booking_id) for i in Invoice.query] == [(1, None)]
+    # the deposit is kept, unlinked, and the unlink is in the change feed
+    assert [(t.id, t.booking_id) for t in Transaction.query.filter_by(type="Income")] == [(1, None)]
+    assert ChangeLog.query.filter_by(table_name="transaction", row_id=1, op="update").one().fields == {"booking_id": None}
+    assert customer_summary(1)["bookings"] == 0
+
+
+def test_booking_type_in_use_is_not_deleted(client, app):
+    seed(client)
+    client.post("/settings/bookingtypes/delete/1")
+    assert BookingType.query.count() == 1
+
+
+def test_payments_link_to_bookings_and_invoices(client, app):
+    seed(client)  # partial booking 1500 with 500 paid; invoice 1 from its work order (250)
+    assert outstanding_balances()["booking"][1] == {"due": 1500, "paid": 500, "outstanding": 1000}
+
+    client.post("/bookings/1/payments", data={"amount": "600", "date": "2024-05-01"})
+    assert db.session.get(Booking, 1).paid_status == "Partial"
+    client.post("/bookings/1/payments", data={"amount": "400"})
+    assert db.session.get(Booking, 1).paid_status == "Paid"
+
+    client.post("/invoices/1/mark_paid")
+    client.post("/invoices/1/mark_paid")  # nothing outstanding the second time
+    balances = outstanding_balances(booking_ids=[1], invoice_ids=[1])
+    assert balances["booking"][1]["outstanding"] == 0
+    assert balances["invoice"][1] == {"due": 250, "paid": 250, "outstanding": 0}
+    assert Transaction.query.filter_by(invoice_id=1, customer_id=1).count() == 1
+
+
+def test_changing_payments_rederives_booking_status(client, app):
+    seed(client)  # partial booking 1500 with 500 paid
+    client.post("/bookings/1/payments", data={"amount": "1000"})
+    assert db.session.get(Booking, 1).paid_status == "Paid"
+
+    last = Transaction.query.filter_by(booking_id=1, amount=1000).one()
+    client.post(f"/edit/{last.id}", data={
+        "date": "2024-05-02", "type": "Income", "category": "Booking", "amount": "10", "status": "Pending",
+    })
+    assert db.session.get(Booking, 1).paid_status == "Partial"
+    for payment in Transaction.query.filter_by(booking_id=1).all():
+        client.post(f"/delete/{payment.id}")
+    assert db.session.get(Booking, 1).paid_status == "Pending"
+
+    client.post("/bookings/1/payments", data={"amount": "1500"})
+    assert db.session.get(Booking, 1).paid_status == "Paid"
+    paid = Transaction.query.filter_by(booking_id=1).one()
+    client.post("/transactions/bulk", data={"ids": [str(paid.id)], "action": "mark_pending"})
+    assert db.session.get(Booking, 1).paid_status == "Pending"
+
+
+def test_backfill_links_free_text_payments(client, app):
+    seed(client)
+    client.post("/customers/add", data={"name": "Alan Turing"})
+    client.post("/invoices/1/mark_paid")
+    # drop the links, as on rows logged before they existed
+    db.session.execute(Transaction.__table__.update().values(customer_id=None, booking_id=None, invoice_id=None))
+    db.session.commit()
+    db.session.add(Transaction(type="Income", category="Booking", party="  ADA lovelace.", amount=9.99,
+                               status="Paid", date=date(2024, 1, 1)))
+    db.session.add(Transaction(type="Income", category="Other", party="Someone Else", amount=5,
+                               status="Paid", date=date(2024, 1, 1)))
+    db.session.commit()
+
+    stats = backfill_transaction_links()
+    assert (stats["scanned"], stats["customer"], stats["booking"], stats["invoice"], stats["unmatched"]) == (4, 3, 1, 1, 1)
+    partial = Transaction.query.filter_by(category="Booking", amount=500).one()
+    assert (partial.customer_id, partial.booking_id) == (1, 1)
+    assert Transaction.query.filter_by(category="Invoice").one().invoice_id == 1
+    # wrong amount for any booking: linked to the customer only
+    assert Transaction.query.filter_by(amount=9.99).one().booking_id is None
+    assert backfill_transaction_links()["booking"] == 0
+
+
+def test_lead_facets_and_paging(client, app):
+    for i in range(45):
+        db.session.add(Lead(contact_name=f"Lead {i:02d}", type="Business" if i % 3 else "Personal",
+                            status="Contacted" if i < 5 else "New", source="Web" if i % 2 else "Referral"))
+    db.session.commit()
+
+    counts, total = lead_facets("", {"type": "Business"})
+    assert total == 30
+    # a facet's own filter doesn't narrow its counts; the others' do
+    assert counts["type"] == {"Business": 30, "Personal": 15}
+    assert counts["status"] == {"Contacted": 3, "New": 27}
+
+    page = client.get("/leads?type=Business&page=2").data.decode()
+    assert "30 matching leads" in page and "Page 2 of 2" in page and "Business (30)" in page
+    assert "Lead 31" in page and "Lead 29" not in page  # ordered by name, 20 per page
+
+    # writes drop the cached counts; uncached counts can be skipped
+    client.post("/leads/add", data={"contact_name": "Lead 99", "type": "Business"})
+    assert lead_facets("", {"type": "Business"})[1] == 31
+    # ...when they commit: a flushed write leaves them until then
+    db.session.add(Lead(contact_name="Lead 98", type="Business"))
+    db.session.flush()
+    assert _lead_facet_cache
+    db.session.commit()
+    assert not _lead_facet_cache and lead_facets("", {"type": "Business"})[1] == 32
+    page = client.get("/leads?search=lead&page=2&counts=0").data.decode()  # not cached yet
+    assert "Page 2<" in page and "matching" not in page and "Lead 22" in page
+    # padded searches run (and are cached) as the trimmed string
+    assert "47 matching leads" in client.get("/leads?search=lead").data.decode()
+    page = client.get("/leads?search=%20lead%20&page=3").data.decode()
+    assert "47 matching leads" in page and "Lead 44" in page
+
+
+def test_cash_flow_forecast(client, app):
+    seed(client)  # partial booking 1500 on 2024-06-01 (500 paid), pending expense 42.50 on 2024-04-02
+    result = cash_flow_forecast("month", horizon=3, history=2, today=date(2024, 5, 15))
+    periods = {p["start"]: p for p in result["periods"]}
+    assert list(periods) == ["2024-03", "2024-04", "2024-05", "2024-06", "2024-07"]
+    # overdue pending expense is due now; the unpaid booking lands on its event month
+    assert periods["2024-05"]["projected_out"] == 42.5
+    assert periods["2024-06"]["projected_in"] == 1000  # 500 of the 1500 is already paid
+    assert result["aging"]["payable"]["31-60"] == 42.5
+    assert periods["2024-07"]["balance"] == round(result["opening_balance"] + sum(p["net"] for p in periods.values()), 2)
+
+    # archived payments stay in their own month, not the opening balance
+    db.session.add_all([
+        Transaction(type="Income", category="Old", amount=300.0, status="Paid", date=date(2024, 4, 20)),
+        Transaction(type="Expense", category="Old", amount=50.0, status="Paid", date=date(2023, 12, 1)),
+    ])
+    db.session.commit()
+    archive_before(date(2024, 5, 1))
+    result = cash_flow_forecast("month", horizon=3, history=2, today=date(2024, 5, 15))
+    periods = {p["start"]: p for p in result["periods"]}
+    assert periods["2024-04"]["actual_in"] == 300 and result["opening_balance"] == -50
+    weekly = cash_flow_forecast("week", horizon=2, history=4, today=date(2024, 5, 15))
+    assert weekly["periods"][0]["start"] == "2024-04-15" and weekly["opening_balance"] == 250  # April counts on the 1st
+
+
+def test_chunked_upload_resumes_and_serves_ranges(client, app):
+    seed(client)
+    data = os.urandom(200_000)
+    opened = client.post("/api/uploads", json={
+        "target": "workorder", "target_id": 1, "filename": "../proofs final.mp4", "size": len(data),
+        "sha256": hashlib.sha256(data).hexdigest(),
+    })
+    assert opened.status_code == 201
+    upload = opened.get_json()
+    url = f"/api/uploads/{upload['id']}"
+
+    def patch(offset, chunk, **headers):
+        return client.patch(url, data=chunk, headers={"Upload-Offset": str(offset), **headers})
+
+    assert patch(0, data[:80_000]).get_json()["offset"] == 80_000
+    # a bad chunk checksum is rejected and rolled back; a stale offset reports where to resume
+    bad = patch(80_000, data[80_000:160_000], **{"X-Chunk-SHA256": "0" * 64})
+    assert bad.status_code == 422 and bad.get_json()["offset"] == 80_000
+    assert patch(0, data[:10]).status_code == 409
+    assert client.get(url).get_json()["offset"] == 80_000
+    # a PATCH racing another one for the same upload is turned away before it writes
+    with upload_lock(upload_part_path(upload["id"])):
+        busy = patch(80_000, data[80_000:])
+    assert busy.status_code == 409 and client.get(url).get_json()["offset"] == 80_000
+    chunk = data[80_000:]
+    done = patch(80_000, chunk, **{"X-Chunk-SHA256": hashlib.sha256(chunk).hexdigest()})
+    # the whole-file check runs in the background; the client polls until complete
+    assert done.status_code == 202 and done.get_json()["verifying"]
+    assert patch(200_000, b"x").status_code == 409
+    upload_jobs.join()
+    db.session.expire_all()
+    assert client.get(url).get_json()["complete"]
+
+    order = db.session.get(WorkOrder, 1)
+    assert os.path.basename(order.file_path) == "proofs_final.mp4"
+    assert ChangeLog.query.filter_by(table_name="upload").count() == 0
+    response = client.get("/workorders/1/file", headers={"Range": "bytes=100-199"})
+    assert response.status_code == 206 and response.data == data[100:200]
+    assert client.get("/workorders/1/file").data == data
+
+    # a corrupted file fails the whole-file check and starts over
+    upload = client.post("/api/uploads", json={
+        "target": "receipt", "target_id": 1, "filename": "r.pdf", "size": 4, "sha256": hashlib.sha256(b"good").hexdigest(),
+    }).get_json()
+    failed = client.patch(f"/api/uploads/{upload['id']}", data=b"evil", headers={"Upload-Offset": "0"})
+    assert failed.status_code == 202
+    upload_jobs.join()
+    db.session.expire_all()
+    state = client.get(f"/api/uploads/{upload['id']}").get_json()
+    assert state["offset"] == 0 and not state["complete"] and "mismatch" in state["error"]
+    assert os.path.getsize(upload_part_path(upload["id"])) == 0
+    assert client.post("/api/uploads", json={"target": "receipt", "target_id": 1, "filename": "a.exe", "size": 4}).status_code == 400
+    for target_id in (None, "abc", "1", True):
+        assert client.post("/api/uploads", json={
+            "target": "workorder", "target_id": target_id, "filename": "a.mp4", "size": 4,
+        }).status_code == 400
+
+
+def test_dashboard_stream_pushes_deltas(client, app):
+    seed(client)
+    response = client.get("/dashboard/stream", buffered=False)
+    assert response.mimetype == "text/event-stream" and "Content-Encoding" not in response.headers
+    chunks = response.iter_encoded()
+    assert next(chunks).startswith(b"retry:")
+    full = json.loads(next(chunks).split(b"data: ", 1)[1])  # full state first
+    assert full["metrics"]["income_paid"] == 500 and len(full["recent"]["ids"]) == 2
+    response.close()
+
+    subscription = dashboard_publisher.subscribe()
+    try:
+        subscription.get(timeout=5)
+        client.post("/add", data={
+            "type": "Income", "category": "Sales", "party": "Walk-in", "amount": "100",
+            "status": "Paid", "date": "2024-07-01",
+        })
+        dashboard_publisher.refresh()
+        delta = json.loads(subscription.get(timeout=5).split("data: ", 1)[1])
+        new_id = str(Transaction.query.filter_by(party="Walk-in").one().id)
+        # only what changed: two tiles and the one new recent row
+        assert delta["metrics"] == {"income_paid": 600, "profit": 600}
+        assert list(delta["recent"]["rows"]) == [new_id] and int(new_id) in delta["recent"]["ids"]
+        assert "recent_orders" not in delta and "upcoming" not in delta
+        assert dashboard_publisher.refresh() is None and subscription.empty()
+    finally:
+        dashboard_publisher.unsubscribe(subscription)
+
+
+def test_year_end_report_job(client, app):
+    from io import BytesIO
+    from PIL import Image
+
+    seed(client)
+    receipt = BytesIO()
+    Image.new("RGB", (800, 600), "red").save(receipt, "PNG")
+    receipt.seek(0)
+    for category, amount in [("Supplies", "10"), ("Rent", "700"), ("Supplies", "5")]:
+        data = {"type": "Expense", "category": category, "party": "Vendor", "amount": amount, "status": "Paid",
+                "date": "2023-03-01"}
+        if amount == "5":
+            data["receipt"] = (receipt, "r.png")
+        client.post("/add", data=data, content_type="multipart/form-data")
+    client.post("/add", data={"type": "Expense", "category": "Rent", "party": "Landlord", "amount": "1",
+                              "status": "Paid", "date": "2024-01-01"})
+
+    rows = list(report_transactions(date(2023, 1, 1), date(2023, 12, 31), batch_size=1))
+    assert [(r.category, r.amount) for r in rows] == [("Rent", 700), ("Supplies", 10), ("Supplies", 5)]
+
+    assert client.get("/reports").status_code == 200
+    response = client.post("/reports/year-end", data={"start": "2023-01-01", "end": "2023-12-31", "categories": ["Supplies"]})
+    assert response.status_code == 302
+    report_jobs.join()
+    db.session.expire_all()
+    job = ReportJob.query.one()
+    assert (job.status, job.rows) == ("done", 2)
+    pdf = client.get(f"/reports/{job.id}/download")
+    assert pdf.status_code == 200 and pdf.data.startswith(b"%PDF") and b"/Subtype /Image" in pdf.data
+
+
+def test_customer_statements(client, app):
+    seed(client)  # invoice #1 ($250) and a $500 booking payment for Ada, both dated today
+    client.post("/customers/add", data={"name": "Settled Sam"})
+    older, settled = Invoice(customer_id=1, total=300.0, created_at=datetime(2023, 1, 10, 9, 30)), \
+        Invoice(customer_id=2, total=80.0, created_at=datetime(2023, 1, 5))
+    db.session.add_all([older, settled])
+    db.session.flush()
+    db.session.add_all([
+        Transaction(type="Income", category="Invoice", party="Ada Lovelace", amount=100.0, status="Paid",
+                    date=date(2023, 2, 1), customer_id=1, invoice_id=older.id),
+        Transaction(type="Income", category="Invoice", party="Ada Lovelace", amount=40.0, status="Paid",
+                    date=date(2023, 3, 1), customer_id=1, invoice_id=older.id),
+        Transaction(type="Income", category="Invoice", party="Settled Sam", amount=80.0, status="Paid",
+                    date=date(2023, 1, 6), customer_id=2, invoice_id=settled.id),
+    ])
+    db.session.commit()
+    archive_before(date(2023, 2, 15))  # the $100 payment moves to the archive
+
+    statement = customer_statement(1, start=date(2023, 2, 15))
+    assert statement["opening"] == 200.0  # 300 invoiced, 100 paid before the period
+    # the booking payment settles the booking, not an invoice: it isn't a credit here
+    assert [(e.kind, e.balance) for e in statement["entries"]] == [("payment", 160.0), ("invoice", 410.0)]
+    assert statement["closing"] == 410.0
+    assert customer_statement(1, end=date(2023, 12, 31))["closing"] == 160.0
+    assert [(row.id, row.balance) for row in customer_balances()] == [(1, 410.0)]
+
+    page = client.get("/customers/1/statement?start=2023-02-15")
+    assert page.status_code == 200 and b"Invoice #1" in page.data and b"$410.00" in page.data
+    assert client.get("/statements").status_code == 200
+    pdf = client.get("/customers/1/statement.pdf?end=2023-12-31")
+    assert pdf.status_code == 200 and pdf.data.startswith(b"%PDF") and b"ASCII85Decode" not in pdf.data
+    assert rl_config.useA85  # other PDFs keep ReportLab's default
+
+    client.post("/statements/batch", data={"end": date.today().isoformat()})
+    report_jobs.join()
+    db.session.expire_all()
+    job = ReportJob.query.one()
+    assert (job.kind, job.status, job.rows) == ("statements", "done", 1)  # Sam's ledger nets to zero
+    assert client.get(f"/reports/{job.id}/download").data.startswith(b"%PDF")